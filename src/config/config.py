@@ -1,5 +1,7 @@
 import json
 
+DEVICE_FILE = "config/device_id.json"
+
 class Config:
     """Configuration manager with type hints and error handling - BROTHER!"""
     
@@ -18,7 +20,7 @@ class Config:
                 
             # Try to load device_id.json overlay (gitignored)
             try:
-                with open("config/device_id.json") as f:
+                with open(DEVICE_FILE) as f:
                     device_config = json.load(f)
                     self.config.update(device_config)
                     print(f"✅ Loaded device identity: {device_config.get('node_id')}")
@@ -53,6 +55,24 @@ class Config:
         """Set a config value"""
         self.config[key] = value
         
+    def save_device(self, values):
+        """Merge values into the device_id.json overlay (and the live config) - per-device settings"""
+        try:
+            with open(DEVICE_FILE) as f:
+                device_config = json.load(f)
+        except (OSError, ValueError):
+            device_config = {"node_id": self.node_id}
+        device_config.update(values)
+        try:
+            with open(DEVICE_FILE, "w") as f:
+                json.dump(device_config, f)
+            print(f"💾 Saved {', '.join(values)} to {DEVICE_FILE}")
+        except OSError as e:
+            print(f"💥 Failed to save {DEVICE_FILE}: {e}")
+            return False
+        self.config.update(values)
+        return True
+        
     def save_config(self):
         """Save current config to file"""
         try:
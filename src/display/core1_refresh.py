@@ -0,0 +1,189 @@
+# core1_refresh.py - Push display frames to the panel from the second core
+#
+# A full ST7789 refresh (4-bit framebuffer -> RGB565 through the colour LUT,
+# then ~115KB down SPI) blocks for 50-80ms, and on a single uasyncio loop
+# nothing else runs meanwhile - socket reads, result pushes and the game
+# loop all wait for the display. With dual_core_display set, the refresh
+# runs on core 1 instead:
+#
+#   core 0  ugui's auto_refresh draws stale widgets into the framebuffer as
+#           before, then do_refresh() copies it into the back buffer (a
+#           memcpy, well under 1ms) and posts CMD_FRAME
+#   core 1  takes commands off the ring, pushes the back buffer and sets a
+#           ThreadSafeFlag once the frame is on the panel
+#
+# do_refresh() keeps one frame in flight: it sleeps on that flag until core 1
+# has pushed the previous frame, so auto_refresh runs at the panel's pace
+# instead of spinning on copies. The back buffer is guarded by a lock that
+# core 0 only ever *tries* to take from the loop, so core 0 never blocks on
+# the display and every frame on the panel is whole. Commands go through a
+# single-producer single-consumer ring - core 0 only moves the head and core
+# 1 only moves the tail, so it needs no lock.
+#
+# ssd.show() is routed here too. It takes the lock and pushes from core 0,
+# so ugui's final blank-and-show at shutdown can't race a core 1 push.
+#
+# Widget drawing stays on core 0 because widgets are only ever changed by
+# core 0 code. Core 1 must not touch WiFi on the Pico W, and nothing here
+# does. tools/check_core_handoff.py runs the handoff on two host threads.
+
+import _thread
+import time
+import uasyncio
+from array import array
+
+CMD_FRAME = 1  # arg = frame number now in the back buffer
+CMD_STOP = 2
+
+
+class CommandRing:
+    """Lock-free single-producer single-consumer queue of (command, arg)"""
+
+    def __init__(self, size=8):
+        self.size = size
+        self._commands = array('i', [0] * size)
+        self._args = array('i', [0] * size)
+        # [head, tail] - array stores are single word writes, so each core
+        # always sees a whole index from the other
+        self._ends = array('i', [0, 0])
+
+    def put(self, command, arg=0):
+        """Producer side - False if the ring is full"""
+        head = self._ends[0]
+        following = (head + 1) % self.size
+        if following == self._ends[1]:
+            return False  # One slot stays empty to tell full from empty
+        self._commands[head] = command
+        self._args[head] = arg
+        self._ends[0] = following  # Only now can the consumer see the slot
+        return True
+
+    def get(self):
+        """Consumer side - (command, arg), or None if the ring is empty"""
+        tail = self._ends[1]
+        if tail == self._ends[0]:
+            return None
+        item = (self._commands[tail], self._args[tail])
+        self._ends[1] = (tail + 1) % self.size
+        return item
+
+    def __len__(self):
+        return (self._ends[0] - self._ends[1]) % self.size
+
+
+class Core1Refresh:
+    """Double-buffered display refresh with the push on core 1"""
+
+    def __init__(self, push, front, idle_ms=2, ring_size=8):
+        """
+        Args:
+            push: push(memoryview) - writes one frame to the panel (runs on core 1)
+            front: The framebuffer core 0 draws into
+            idle_ms: How long core 1 sleeps when there is nothing to do
+        """
+        self._push = push
+        self._front = front
+        self._back = bytearray(len(front))
+        self._back_view = memoryview(self._back)
+        self._lock = _thread.allocate_lock()
+        self.commands = CommandRing(ring_size)
+        self.idle_ms = idle_ms
+        self.running = False
+        self.frame = 0  # Number of the frame in the back buffer (core 0 writes)
+        self.shown = 0  # Number of the frame last pushed to the panel (core 1 writes)
+        self.pushed = 0  # Frames pushed to the panel (core 1 writes)
+        self.retries = 0  # Times core 0 found core 1 mid-push and came back later
+        self._taken = uasyncio.ThreadSafeFlag()  # Set by core 1 after each push
+
+    def start(self):
+        self.running = True
+        _thread.start_new_thread(self._core1, ())
+        print("🖥️  Display refresh running on core 1")
+
+    def stop(self):
+        """Ask core 1 to finish - do_refresh pushes from core 0 again once it has"""
+        while self.running and not self.commands.put(CMD_STOP):
+            time.sleep_ms(self.idle_ms)
+
+    # Core 0
+
+    def publish(self):
+        """Copy the finished framebuffer to the back buffer - False if core 1 is using it"""
+        if not self._lock.acquire(0):
+            return False
+        try:
+            self._back[:] = self._front
+            self.frame += 1
+        finally:
+            self._lock.release()
+        # A full ring is fine - core 1 pushes the newest frame on any CMD_FRAME
+        self.commands.put(CMD_FRAME, self.frame)
+        return True
+
+    async def do_refresh(self, split=4, elock=None):
+        """Drop-in for ssd.do_refresh() - ugui's auto_refresh awaits this"""
+        # One frame in flight - wait for core 1 to put the last one on the panel
+        while self.running and self.shown != self.frame:
+            await self._taken.wait()
+        if not self.running:
+            self._push(memoryview(self._front))  # Core 1 gone - refresh in place
+            return
+        while True:
+            if elock is None:
+                done = self.publish()
+            else:
+                async with elock:  # ugui short_lock mode
+                    done = self.publish()
+            if done:
+                return
+            self.retries += 1
+            await uasyncio.sleep_ms(1)
+
+    def show(self):
+        """Drop-in for ssd.show() - a blocking refresh from core 0
+
+        Holds the lock, so it waits out a push already running on core 1.
+        The frame goes through the back buffer, so a CMD_FRAME still queued
+        can only push this same frame again.
+        """
+        with self._lock:
+            self._back[:] = self._front
+            self.frame += 1
+            self._push(self._back_view)
+            self.shown = self.frame
+
+    # Core 1
+
+    def _core1(self):
+        commands = self.commands
+        sent = 0
+        try:
+            while True:
+                item = commands.get()
+                if item is None:
+                    time.sleep_ms(self.idle_ms)
+                    continue
+                command = item[0]
+                if command == CMD_STOP:
+                    break
+                # Older CMD_FRAMEs queued behind a push are covered by it
+                if command == CMD_FRAME and self.frame != sent:
+                    with self._lock:
+                        sent = self.frame
+                        self._push(self._back_view)
+                        self.shown = sent  # Under the lock, so it can't undo a show()
+                    self.pushed += 1
+                    self._taken.set()
+        except Exception as e:
+            print(f"💥 Core 1 display refresh failed: {e}")
+        self.running = False
+        self._taken.set()  # A waiting do_refresh falls back to refreshing in place
+
+
+def start_core1_refresh(ssd):
+    """Route ssd.do_refresh through core 1 - call before the GUI starts"""
+    refresh = Core1Refresh(ssd.push, ssd.mvb)
+    refresh.start()
+    ssd.do_refresh = refresh.do_refresh
+    ssd.show = refresh.show
+    return refresh
@@ -234,12 +234,17 @@ class ST7789(framebuf.FrameBuffer):
         # Blocks for 60ms @30MHz SPI on TTGO in PORTRAIT mode
         # Blocks for 46ms @30MHz SPI on TTGO in LANDSCAPE mode
         # ts = ticks_us()
+        self.push(self.mvb)
+        # print(ticks_diff(ticks_us(), ts))
+
+    # Push any framebuffer-sized memoryview to the panel - show() passes our
+    # own, core1_refresh passes its back buffer from the second core
+    def push(self, buf):
         clut = ST7789.lut
         wd = -(-self.width // 2)  # Ceiling division for odd number widths
         end = self.height * wd
         lb = memoryview(self._linebuf)
         cm = self._gscale  # color False, greyscale True
-        buf = self.mvb
         if self._spi_init:  # A callback was passed
             self._spi_init(self._spi)  # Bus may be shared
         self._dc(0)
@@ -250,7 +255,6 @@ class ST7789(framebuf.FrameBuffer):
             _lcopy(lb, buf[start:], clut, wd, cm)  # Copy and map colors
             self._spi.write(lb)
         self._cs(1)
-        # print(ticks_diff(ticks_us(), ts))
 
     def short_lock(self, v=None):
         if v is not None:
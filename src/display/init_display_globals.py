@@ -18,6 +18,13 @@ def initialize_display_globals():
     # that are then made available through ugui imports
     import display.hardware_setup  # Creates ssd/display instances
     
+    # Optionally move the display refresh to core 1 - before the GUI starts,
+    # and early so the back buffer is allocated while RAM is still clean
+    from config.config import config
+    if config.get('dual_core_display', False):
+        from display.core1_refresh import start_core1_refresh
+        start_core1_refresh(display.hardware_setup.ssd)
+    
     # Initialize global GPIO handlers for physical side buttons
     from display.gpio_handlers import _init_global_buttons
     _init_global_buttons()
@@ -0,0 +1,430 @@
+# game_log.py - Append-only binary event log on flash
+#
+# Every activation, hit and miss goes into a 16-byte record:
+#
+#   offset  size  field
+#   0       1     kind (KIND_* below, 0 is padding)
+#   1       1     target wire index (NO_TARGET if none)
+#   2       2     round number
+#   4       4     master time.ticks_ms()
+#   8       4     value (signed - reaction us, duration ms, points...)
+#   12      2     extra (hit value, round count...)
+#   14      1     flags
+#   15      1     check byte - sum of bytes 0-14, xor 0xA5
+#
+# append() only packs the record into a RAM block and never touches the
+# filesystem, so it is safe to call from the game loop. Full blocks go to
+# flash from the background run() task as whole block_size writes - the
+# write pattern LittleFS handles best. flush() pads the current block with
+# zero records (skipped by readers) so files always hold whole blocks.
+#
+# Files live next to this module as gamelog/log_NNNNN.bin. On boot the
+# newest segment is checked - a torn block from a power cut is cut off at the
+# last good record - and appended to until it reaches segment_size, so power
+# cycles don't pile up segments. The oldest segments are deleted once the log
+# takes more than max_bytes. When a segment closes, compact() merges it with
+# the closed segments before it that are still raw or small, without their
+# padding, so flush() padding doesn't eat the space the history could use.
+# Trimming waits while a merge is running, so it never deletes a segment the
+# merge is still reading.
+#
+# All-zero records are padding and a bad check byte ends a segment, so
+# readers never need more than one block in RAM.
+
+import os
+import struct
+import time
+import uasyncio
+from utils.wire_codec import NO_TARGET
+
+RECORD_FORMAT = "<BBHIiHBB"
+RECORD_SIZE = 16
+
+KIND_PAD = 0
+KIND_COMPACTED = 1  # First record of a compacted segment, value = first merged segment
+KIND_GAME_START = 2  # value = seed, extra = rounds
+KIND_ACTIVATE = 3  # value = duration ms
+KIND_HIT = 4  # value = reaction us, extra = hit value
+KIND_MISS = 5  # value = reaction us
+KIND_NO_SHOW = 6
+KIND_GAME_END = 7  # value = points, extra = hits
+
+KIND_NAMES = ("pad", "compacted", "game_start", "activate", "hit", "miss", "no_show", "game_end")
+
+LOG_DIR = "gamelog"
+_PREFIX = "log_"
+_SUFFIX = ".bin"
+_TMP = LOG_DIR + "/compact.tmp"
+
+
+def _check(buf, offset):
+    total = 0
+    for i in range(offset, offset + RECORD_SIZE - 1):
+        total += buf[i]
+    return (total & 0xFF) ^ 0xA5
+
+
+def _record_state(buf, offset):
+    """1 for a good record, 0 for padding, -1 for garbage"""
+    if buf[offset + RECORD_SIZE - 1] == _check(buf, offset):
+        return 1
+    for i in range(offset, offset + RECORD_SIZE):
+        if buf[i]:
+            return -1
+    return 0
+
+
+def _segment_path(number):
+    return f"{LOG_DIR}/{_PREFIX}{number:05d}{_SUFFIX}"
+
+
+def _is_compacted(path):
+    """Whether a segment starts with a KIND_COMPACTED record"""
+    header = bytearray(RECORD_SIZE)
+    try:
+        with open(path, "rb") as f:
+            if f.readinto(header) != RECORD_SIZE:
+                return False
+    except OSError:
+        return False
+    return header[0] == KIND_COMPACTED and _record_state(header, 0) > 0
+
+
+def _file_size(path):
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return 0
+
+
+def segment_numbers():
+    """Numbers of the segments on flash, oldest first"""
+    try:
+        names = os.listdir(LOG_DIR)
+    except OSError:
+        return []
+    numbers = []
+    for name in names:
+        if name.startswith(_PREFIX) and name.endswith(_SUFFIX):
+            try:
+                numbers.append(int(name[len(_PREFIX):-len(_SUFFIX)]))
+            except ValueError:
+                pass
+    numbers.sort()
+    return numbers
+
+
+def read_records(numbers=None, block_size=512):
+    """Yield (kind, target, round, ticks_ms, value, extra, flags) from flash
+
+    Reads one block at a time, oldest segment first. Records still in the
+    writer's RAM block are not included until they are flushed.
+    """
+    buf = bytearray(block_size)
+    for number in segment_numbers() if numbers is None else numbers:
+        try:
+            f = open(_segment_path(number), "rb")
+        except OSError:
+            continue
+        try:
+            torn = False
+            while not torn:
+                size = f.readinto(buf)
+                if not size:
+                    break
+                for offset in range(0, size - size % RECORD_SIZE, RECORD_SIZE):
+                    state = _record_state(buf, offset)
+                    if state < 0:
+                        torn = True  # Nothing after a torn write is trusted
+                        break
+                    if state and buf[offset] != KIND_COMPACTED:
+                        yield struct.unpack_from(RECORD_FORMAT, buf, offset)[:7]
+        finally:
+            f.close()
+
+
+class GameLog:
+    """Buffered writer for the on-flash event log"""
+
+    def __init__(self, block_size=512, segment_size=65536, max_bytes=524288, flush_ms=30000):
+        self.block_size = block_size
+        self.segment_size = segment_size - segment_size % block_size
+        self.max_bytes = max_bytes
+        self.flush_ms = flush_ms
+
+        # Two RAM blocks: the game fills one while the other is written out
+        self._block = bytearray(block_size)
+        self._spare = bytearray(block_size)
+        self._used = 0
+        self._full = []  # Blocks waiting for flash
+        self._wake = uasyncio.Event()
+
+        self._file = None
+        self._segment = None
+        self._segment_bytes = 0
+        self._compacting = False
+        self._trim_pending = False  # A trim put off until the running compaction ends
+        self._closed = False  # A segment closed since the last compaction
+        self.dropped = 0  # Records lost because flash fell two blocks behind
+        self.written_blocks = 0
+
+    # Writing (game side - no I/O)
+
+    def append(self, kind, target=NO_TARGET, round_number=0, value=0, extra=0, flags=0):
+        """Pack one record into the RAM block"""
+        block = self._block
+        if block is None:
+            self.dropped += 1
+            return False
+        offset = self._used
+        struct.pack_into(RECORD_FORMAT, block, offset, kind, target, round_number,
+                         time.ticks_ms(), value, extra & 0xFFFF, flags, 0)
+        block[offset + RECORD_SIZE - 1] = _check(block, offset)
+        self._used = offset + RECORD_SIZE
+        if self._used + RECORD_SIZE > self.block_size:
+            self._rotate_block()
+        return True
+
+    def _rotate_block(self):
+        """Hand the full RAM block to the flusher and carry on in the spare"""
+        block = self._block
+        for i in range(self._used, self.block_size):
+            block[i] = 0
+        self._full.append(block)
+        self._block = self._spare
+        self._spare = None
+        self._used = 0
+        self._wake.set()
+
+    def flush(self):
+        """Queue the partly filled block too (padded) - e.g. at the end of a game"""
+        if self._used and self._block is not None:
+            self._rotate_block()
+
+    # Flash side
+
+    def open(self):
+        """Recover the newest segment and carry on appending to it"""
+        try:
+            os.mkdir(LOG_DIR)
+        except OSError:
+            pass  # Already there
+        self._finish_compaction()
+        numbers = segment_numbers()
+        if numbers:
+            self._recover(numbers[-1])
+            if _file_size(_segment_path(numbers[-1])) < self.segment_size:
+                self._start_segment(numbers[-1], append=True)
+                return
+        self._start_segment(numbers[-1] + 1 if numbers else 1)
+
+    def _start_segment(self, number, append=False):
+        if self._file:
+            self._file.close()
+        self._segment = number
+        path = _segment_path(number)
+        if append:
+            self._file = open(path, "ab")
+            self._segment_bytes = _file_size(path)
+            tail = self._segment_bytes % self.block_size
+            if tail:
+                # A recovered segment ends mid-block - pad it so blocks stay aligned
+                self._file.write(bytes(self.block_size - tail))
+                self._segment_bytes += self.block_size - tail
+        else:
+            self._file = open(path, "wb")
+            self._segment_bytes = 0
+        if self._compacting:
+            self._trim_pending = True  # It could delete a segment _merge is reading
+        else:
+            self._trim()
+
+    def _trim(self):
+        """Delete the oldest closed segments while the log is over max_bytes"""
+        self._trim_pending = False
+        numbers = segment_numbers()
+        sizes = [_file_size(_segment_path(number)) for number in numbers]
+        total = sum(sizes)
+        while total > self.max_bytes and numbers and numbers[0] != self._segment:
+            total -= sizes.pop(0)
+            self._remove(numbers.pop(0))
+
+    def _remove(self, number):
+        try:
+            os.remove(_segment_path(number))
+            print(f"🗑️ Game log segment {number} deleted")
+        except OSError:
+            pass
+
+    def _recover(self, number):
+        """Cut a segment back to its last good record if its tail is torn"""
+        path = _segment_path(number)
+        buf = bytearray(self.block_size)
+        good = 0
+        torn = False
+        with open(path, "rb") as f:
+            while not torn:
+                size = f.readinto(buf)
+                if not size:
+                    break
+                for offset in range(0, size, RECORD_SIZE):
+                    if size - offset < RECORD_SIZE or _record_state(buf, offset) < 0:
+                        torn = True
+                        break
+                    good += RECORD_SIZE
+        if not torn:
+            return
+
+        print(f"🩹 Game log segment {number} torn - keeping {good // RECORD_SIZE} records")
+        with open(path, "rb") as src, open(_TMP, "wb") as dst:
+            remaining = good
+            while remaining:
+                size = src.readinto(buf)
+                if not size:
+                    break
+                size = min(size, remaining)
+                dst.write(memoryview(buf)[:size])
+                remaining -= size
+        os.rename(_TMP, path)
+
+    async def run(self):
+        """Background task - write out full blocks, and partial ones every flush_ms"""
+        if self._file is None:
+            self.open()
+        while True:
+            if not self._full:
+                try:
+                    await uasyncio.wait_for_ms(self._wake.wait(), self.flush_ms)
+                except uasyncio.TimeoutError:
+                    self.flush()
+                self._wake.clear()
+            while self._full:
+                block = self._full.pop(0)
+                self._write_block(block)
+                # Give the block back so append() has somewhere to write again
+                if self._block is None:
+                    self._block = block
+                    self._used = 0
+                else:
+                    self._spare = block
+                await uasyncio.sleep_ms(0)
+            if self._closed and not self._compacting:
+                self._closed = False
+                uasyncio.create_task(self.compact())
+
+    def _write_block(self, block):
+        try:
+            self._file.write(block)
+            self._file.flush()
+        except OSError as e:
+            print(f"💥 Game log write failed: {e}")
+            return
+        self.written_blocks += 1
+        self._segment_bytes += self.block_size
+        if self._segment_bytes >= self.segment_size:
+            self._start_segment(self._segment + 1)
+            self._closed = True
+
+    def close(self):
+        """Write everything buffered and close the segment"""
+        self.flush()
+        while self._full:
+            self._write_block(self._full.pop(0))
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    # Compaction
+
+    def _compaction_run(self):
+        """The closed segments to merge - the newest ones back to the first settled one
+
+        A segment as written still holds its padding, so it is always
+        merged; a merged one is merged again only while it is smaller than
+        segment_size, so every record is rewritten a bounded number of
+        times. The run is always neighbours, so a merged file never spans a
+        segment that was left out.
+        """
+        numbers = [n for n in segment_numbers() if n != self._segment]
+        run = []
+        while numbers:
+            path = _segment_path(numbers[-1])
+            if _is_compacted(path) and _file_size(path) >= self.segment_size:
+                break
+            run.insert(0, numbers.pop())
+        if len(run) == 1 and _is_compacted(_segment_path(run[0])):
+            return []  # Nothing to merge it with, and no padding to drop
+        return run
+
+    async def compact(self):
+        """Merge the run of part-filled closed segments into one, dropping padding
+
+        Called by the writer whenever it closes a segment. The merged data
+        is written to a temp file and renamed over the newest merged
+        segment; its first record names the oldest one, so if power is lost
+        before the old files are deleted, open() finishes the job instead
+        of reading the records twice.
+        """
+        numbers = self._compaction_run()
+        if not numbers or self._compacting:
+            return 0
+        self._compacting = True
+        try:
+            return await self._merge(numbers)
+        finally:
+            self._compacting = False
+            if self._trim_pending:
+                self._trim()
+
+    async def _merge(self, numbers):
+        first, last = numbers[0], numbers[-1]
+
+        out = bytearray(self.block_size)
+        used = 0
+        kept = 0
+        with open(_TMP, "wb") as dst:
+            struct.pack_into(RECORD_FORMAT, out, 0, KIND_COMPACTED, NO_TARGET, 0,
+                             time.ticks_ms(), first, 0, 0, 0)
+            out[RECORD_SIZE - 1] = _check(out, 0)
+            used = RECORD_SIZE
+            for record in read_records(numbers, self.block_size):
+                struct.pack_into(RECORD_FORMAT, out, used, *record, 0)
+                out[used + RECORD_SIZE - 1] = _check(out, used)
+                used += RECORD_SIZE
+                kept += 1
+                if used + RECORD_SIZE > self.block_size:
+                    for i in range(used, self.block_size):
+                        out[i] = 0
+                    dst.write(out)
+                    used = 0
+                    await uasyncio.sleep_ms(0)
+            if used:
+                for i in range(used, self.block_size):
+                    out[i] = 0
+                dst.write(out)
+
+        os.rename(_TMP, _segment_path(last))
+        for number in numbers[:-1]:
+            self._remove(number)
+        print(f"🗜️ Game log compacted segments {first}-{last}: {kept} records")
+        return kept
+
+    def _finish_compaction(self):
+        """Undo or complete a compaction cut short by a reset"""
+        try:
+            os.remove(_TMP)  # Never renamed - the originals are all still there
+        except OSError:
+            pass
+        header = bytearray(RECORD_SIZE)
+        for number in segment_numbers():
+            try:
+                with open(_segment_path(number), "rb") as f:
+                    if f.readinto(header) != RECORD_SIZE:
+                        continue
+            except OSError:
+                continue
+            if header[0] == KIND_COMPACTED and _record_state(header, 0) > 0:
+                first = struct.unpack_from(RECORD_FORMAT, header, 0)[4]
+                for stale in segment_numbers():
+                    if first <= stale < number:
+                        self._remove(stale)
@@ -0,0 +1,190 @@
+# clock_sync.py - Master/target clock synchronization
+#
+# NTP-style offset and drift estimation over the socket protocol. The master
+# stamps t1 and sends SYNC, the target stamps t2 on receipt and t3 just before
+# replying SYNCED, and the master stamps t4 when the reply lands:
+#
+#   offset = ((t2 - t1) + (t3 - t4)) / 2     (target clock minus master clock)
+#   rtt    = (t4 - t1) - (t3 - t2)
+#
+# Every round fires a short burst of exchanges and keeps only the one with the
+# smallest RTT - queueing delay only ever adds time, so the fastest exchange
+# is the most accurate one. The kept samples go into a small window and a
+# least-squares line through them gives offset plus skew (crystal drift).
+#
+# All timestamps are time.ticks_us() values, which wrap every ~17.9 minutes
+# on MicroPython, so arithmetic goes through ticks_diff/ticks_add relative to
+# the newest sample. Converting a target timestamp is only valid within a few
+# minutes of the last sync, which the sync interval guarantees.
+
+import time
+import uasyncio
+from master.target_registry import STATE_DEAD
+
+
+def _wrap(value):
+    """Normalise a plain int difference into the signed ticks range"""
+    return time.ticks_diff(value, 0)
+
+
+class ClockEstimate:
+    """Offset/skew estimate for one target's ticks_us clock"""
+
+    def __init__(self, window=8):
+        self.window = window
+        self.samples = []  # [master ticks_us, offset_us, rtt_us], oldest first
+        self.ref_ticks = None  # Master time the offset below is valid at
+        self.offset_us = 0  # Target minus master at ref_ticks
+        self.skew = 0.0  # Offset change (us) per master millisecond
+        self.error_us = None  # Estimated error bound, None until synced
+
+    @property
+    def synced(self):
+        return self.error_us is not None
+
+    def add_exchange(self, t1, t2, t3, t4):
+        """Add the best exchange of a burst and refit"""
+        rtt = time.ticks_diff(t4, t1) - time.ticks_diff(t3, t2)
+        a = time.ticks_diff(t2, t1)
+        b = time.ticks_diff(t3, t4)
+        offset = _wrap(a + time.ticks_diff(b, a) // 2)
+        master_mid = time.ticks_add(t1, time.ticks_diff(t4, t1) // 2)
+
+        self.samples.append([master_mid, offset, max(rtt, 0)])
+        if len(self.samples) > self.window:
+            self.samples.pop(0)
+        self._fit()
+
+    def _fit(self):
+        """Least-squares offset and skew over the sample window"""
+        ref, ref_offset, ref_rtt = self.samples[-1]
+        count = len(self.samples)
+
+        # Work relative to the newest sample so nothing wraps, with x in ms so
+        # the sums stay within single-precision float range on the RP2040
+        xs = [time.ticks_diff(s[0], ref) / 1000 for s in self.samples]
+        ys = [time.ticks_diff(s[1], ref_offset) for s in self.samples]
+
+        skew = 0.0
+        intercept = 0.0
+        if count >= 3:
+            mean_x = sum(xs) / count
+            mean_y = sum(ys) / count
+            sxx = sum((x - mean_x) ** 2 for x in xs)
+            if sxx > 0:
+                skew = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sxx
+                intercept = mean_y - skew * mean_x
+        else:
+            intercept = sum(ys) / count
+
+        # Error bound: half the best round trip plus the worst fit residual
+        residual = max(abs(y - (intercept + skew * x)) for x, y in zip(xs, ys))
+        best_rtt = min(s[2] for s in self.samples)
+
+        self.ref_ticks = ref
+        self.offset_us = _wrap(ref_offset + int(intercept))
+        self.skew = skew
+        self.error_us = best_rtt // 2 + int(residual)
+
+    def offset_at(self, master_ticks):
+        """Target-minus-master offset at a master time"""
+        return _wrap(self.offset_us + int(self.skew * time.ticks_diff(master_ticks, self.ref_ticks) / 1000))
+
+    def to_master(self, target_ticks):
+        """Convert a target ticks_us timestamp to master ticks_us"""
+        # Skew is tiny, so one refinement step from the plain offset is plenty
+        approx = time.ticks_add(target_ticks, -self.offset_us)
+        return time.ticks_add(target_ticks, -self.offset_at(approx))
+
+    def to_target(self, master_ticks):
+        """Convert a master ticks_us timestamp to target ticks_us"""
+        return time.ticks_add(master_ticks, self.offset_at(master_ticks))
+
+
+class ClockSyncService:
+    """Keeps a ClockEstimate per registered target up to date in the background
+
+    Targets start on a fast schedule until they have enough samples for a
+    skew fit, then drop to a slow one - an idle fleet costs one burst of a
+    few tiny messages per target every `interval_ms`. Up to `parallel`
+    targets sync at once, and targets the heartbeat has declared dead are
+    left until it brings them back, so a few unreachable targets can't hold
+    up everyone else's estimates.
+    """
+
+    def __init__(self, controller, interval_ms=30000, fast_interval_ms=2000, burst=5, parallel=4):
+        self.controller = controller
+        self.interval_ms = interval_ms
+        self.fast_interval_ms = fast_interval_ms
+        self.burst = burst
+        self.parallel = parallel
+        self.estimates = {}  # target_name -> ClockEstimate
+        self._next_due = {}  # target_name -> master ticks_ms of next round
+
+    def estimate(self, target_name):
+        """The target's estimate, or None if it has never synced"""
+        estimate = self.estimates.get(target_name)
+        return estimate if estimate and estimate.synced else None
+
+    def forget(self, target_name):
+        """Drop a target's estimate (e.g. after it is removed or reboots)"""
+        self.estimates.pop(target_name, None)
+        self._next_due.pop(target_name, None)
+
+    async def sync_target(self, target_name, target_ip):
+        """Run one burst of exchanges and fold the best into the estimate"""
+        best = None
+        for _ in range(self.burst):
+            stamps = await self.controller.server.sync_target(target_ip, target_name)
+            if stamps is None:
+                # A lost exchange is a full timeout - don't sit out the rest
+                # of the burst too, take what we have
+                break
+            t1, t2, t3, t4 = stamps
+            rtt = time.ticks_diff(t4, t1) - time.ticks_diff(t3, t2)
+            if best is None or rtt < best[0]:
+                best = (rtt, stamps)
+
+        if best is None:
+            return None
+
+        estimate = self.estimates.get(target_name)
+        if estimate is None:
+            estimate = self.estimates[target_name] = ClockEstimate()
+        estimate.add_exchange(*best[1])
+        return estimate
+
+    async def _sync_due(self, due):
+        """Worker - syncs (target_name, target_ip) pairs off the shared due list"""
+        while due:
+            target_name, target_ip = due.pop()
+            estimate = await self.sync_target(target_name, target_ip)
+            fast = estimate is None or len(estimate.samples) < 3
+            self._next_due[target_name] = time.ticks_add(
+                time.ticks_ms(), self.fast_interval_ms if fast else self.interval_ms
+            )
+
+    async def run(self):
+        """Background loop - syncs each target when its round is due"""
+        while True:
+            now = time.ticks_ms()
+            targets = self.controller.targets
+            due = []
+            # The cached list is replaced, never mutated, if targets come and go
+            for target_name in targets.names_list():
+                next_due = self._next_due.get(target_name)
+                if next_due is not None and time.ticks_diff(next_due, now) > 0:
+                    continue
+                index = targets.index_of(target_name)
+                if index is None:
+                    continue
+                if targets.states[index] == STATE_DEAD:
+                    # Look again later - the heartbeat revives it if it answers
+                    self._next_due[target_name] = time.ticks_add(now, self.fast_interval_ms)
+                    continue
+                due.append((target_name, targets.ips[index]))
+
+            if due:
+                await uasyncio.gather(*[self._sync_due(due) for _ in range(min(self.parallel, len(due)))])
+
+            await uasyncio.sleep_ms(500)
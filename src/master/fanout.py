@@ -0,0 +1,142 @@
+# fanout.py - Send one command to many targets and stream back the answers
+#
+# A FanOut runs a per-target server coroutine for every target with at most
+# `limit` in flight at once. Each attempt gets target_timeout_ms; the whole
+# run is capped by deadline_ms. Targets that fail can be retried (stragglers
+# go to the back of the queue) while the deadline allows. Results come out as
+# an async stream in completion order:
+#
+#     async for target_name, result in controller.fan_out(server.ping_target):
+#         show(target_name, result)
+#
+# or all at once with `await fan_out.collect()`. Every target yields exactly
+# one result - a target still unanswered when the deadline passes gets a
+# {"status": "failed", "error": "Deadline exceeded"} result.
+
+import time
+import uasyncio
+
+
+class FanOut:
+    """Bounded-concurrency fan-out of one command, iterated in completion order"""
+
+    def __init__(self, server_method, targets, args=(), limit=8, target_timeout_ms=5000,
+                 deadline_ms=None, retries=0, retry_ms=100, prelude=None, on_result=None,
+                 settled=None):
+        """
+        Args:
+            server_method: called as server_method(target_ip, target_name, *args, timeout=seconds)
+            targets: [(target_name, target_ip), ...] - the targets to contact
+            prelude: optional async function returning {target_name: result} for
+                targets already handled another way (e.g. a UDP broadcast) -
+                those are emitted first and not sent the command
+            on_result: optional callback(target_name, result), called as each finishes
+            settled: optional {target_name: result} for targets that aren't
+                contacted at all (e.g. dead ones) - streamed first, never
+                counted against the limit, deadline or retries, and not
+                passed to on_result
+        """
+        self.server_method = server_method
+        self.args = args
+        self.limit = limit
+        self.target_timeout_ms = target_timeout_ms
+        self.deadline_ms = deadline_ms
+        self.retries = retries
+        self.retry_ms = retry_ms
+        self.prelude = prelude
+        self.on_result = on_result
+
+        self._ips = dict(targets)
+        self._queue = [[name, ip, 0] for name, ip in targets]  # [name, ip, attempt]
+        self._outstanding = set(name for name, _ in targets)
+        self._results = list(settled.items()) if settled else []  # (name, result) not yet consumed
+        self._ready = uasyncio.Event()
+        self._start_ms = None
+        self._runner = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._runner is None:
+            self._start_ms = time.ticks_ms()
+            self._runner = uasyncio.create_task(self._run())
+        while not self._results:
+            if not self._outstanding:
+                raise StopAsyncIteration
+            self._ready.clear()
+            await self._ready.wait()
+        return self._results.pop(0)
+
+    async def collect(self):
+        """Run to completion and return {target_name: result}"""
+        results = {}
+        async for target_name, result in self:
+            results[target_name] = result
+        return results
+
+    def _time_left(self):
+        if self.deadline_ms is None:
+            return self.target_timeout_ms
+        return self.deadline_ms - time.ticks_diff(time.ticks_ms(), self._start_ms)
+
+    def _emit(self, name, result):
+        if name not in self._outstanding:
+            return
+        self._outstanding.discard(name)
+        if self.on_result:
+            self.on_result(name, result)
+        self._results.append((name, result))
+        self._ready.set()
+
+    async def _run(self):
+        if self.prelude is not None:
+            early = await self.prelude()
+            for name, result in early.items():
+                self._emit(name, result)
+            self._queue = [item for item in self._queue if item[0] in self._outstanding]
+
+        workers = [uasyncio.create_task(self._worker()) for _ in range(min(self.limit, len(self._queue)))]
+        try:
+            if self.deadline_ms is None:
+                await uasyncio.gather(*workers)
+            else:
+                await uasyncio.wait_for_ms(uasyncio.gather(*workers), max(self._time_left(), 0))
+        except uasyncio.TimeoutError:
+            pass
+        finally:
+            for worker in workers:
+                worker.cancel()
+            # Anyone left over ran out of time
+            for name in list(self._outstanding):
+                self._emit(name, {"status": "failed", "error": "Deadline exceeded", "ip": self._ips.get(name)})
+
+    async def _worker(self):
+        while self._queue:
+            item = self._queue.pop(0)
+            name, ip, attempt = item
+            timeout_ms = min(self.target_timeout_ms, self._time_left())
+            if timeout_ms <= 0:
+                self._queue.insert(0, item)  # Left for the deadline sweep
+                return
+
+            try:
+                result = await uasyncio.wait_for_ms(
+                    self.server_method(ip, name, *self.args, timeout=timeout_ms / 1000),
+                    timeout_ms
+                )
+            except uasyncio.TimeoutError:
+                result = {"status": "failed", "error": "Timeout", "ip": ip}
+            except Exception as e:
+                result = {"status": "failed", "error": str(e), "ip": ip}
+
+            if result.get("status") == "failed" and attempt < self.retries \
+                    and self._time_left() > self.retry_ms:
+                print(f"🔁 Retrying {name} ({attempt + 1}/{self.retries}): {result.get('error')}")
+                item[2] = attempt + 1
+                if not self._queue:
+                    await uasyncio.sleep_ms(self.retry_ms)
+                self._queue.append(item)
+                continue
+
+            self._emit(name, result)
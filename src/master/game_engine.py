@@ -0,0 +1,327 @@
+# game_engine.py - Round planning, dispatch and scoring for a game
+#
+# A game is worked out completely before the first target moves. new_plan()
+# turns a mode and a seed into a RoundPlan: for every round, which targets
+# rise, at what offset from the game start, and for how long. The same seed,
+# mode and target list always give the same plan, so a game can be replayed.
+#
+# run() then fixes every round's absolute start time up front and walks the
+# plan, sending each round's scheduled ACTIVATE lookahead_ms before its start
+# (see activate_target_at) so the targets rise on time however long the
+# commands take to get there. Every ACTIVATE carries an activation ID that the
+# target echoes in its pushed hit/miss, so a result is scored only against the
+# activation it answers - a late result from an earlier round (or game) that
+# lands after the target was picked again is ignored. Scores go into a
+# ScoreBoard, and everything is appended to the controller's game log (RAM only - the log
+# writes to flash in its own task). During play the loop only sleeps, sends
+# and records.
+
+import time
+import uasyncio
+from array import array
+from config.config import config
+from utils.stats import RunningStats
+from utils.wire_codec import NO_TARGET
+from gamelog.game_log import KIND_GAME_START, KIND_ACTIVATE, KIND_HIT, KIND_MISS, KIND_NO_SHOW, KIND_GAME_END
+
+GAME_IDLE = "idle"
+GAME_RUNNING = "running"
+GAME_FINISHED = "finished"
+
+# Preset modes - durations in whole seconds, gaps between round starts in ms
+GAME_MODES = {
+    "quick": {"rounds": 10, "per_round": 1, "duration": (2, 3), "gap_ms": (800, 2500)},
+}
+
+
+def mode_settings(mode):
+    """Settings for a mode - "custom" reads the game_* config keys"""
+    if mode == "custom":
+        return {
+            "rounds": config.get('game_rounds', 20),
+            "per_round": config.get('game_targets_per_round', 2),
+            "duration": (config.get('game_min_duration', 1), config.get('game_max_duration', 4)),
+            "gap_ms": (config.get('game_min_gap_ms', 500), config.get('game_max_gap_ms', 2000)),
+        }
+    return GAME_MODES[mode]
+
+
+class _Rng:
+    """xorshift32 - the same sequence on the Pico and on a desktop"""
+
+    def __init__(self, seed):
+        self.state = (seed & 0xFFFFFFFF) or 0x9E3779B9
+
+    def next(self):
+        x = self.state
+        x ^= (x << 13) & 0xFFFFFFFF
+        x ^= x >> 17
+        x ^= (x << 5) & 0xFFFFFFFF
+        self.state = x
+        return x
+
+    def between(self, low, high):
+        """Integer in [low, high]"""
+        return low + self.next() % (high - low + 1)
+
+    def sample(self, items, count):
+        """count distinct items, in pick order"""
+        pool = list(items)
+        picked = []
+        for _ in range(count):
+            picked.append(pool.pop(self.next() % len(pool)))
+        return picked
+
+
+class RoundPlan:
+    """Precomputed rounds - parallel per-round arrays"""
+
+    def __init__(self, mode, seed):
+        self.mode = mode
+        self.seed = seed
+        self.starts_ms = array('i')  # Offset of each round from the game start
+        self.durations = bytearray()  # Seconds each round's targets stay up
+        self.round_targets = []  # Tuple of target names per round
+        self.length_ms = 0  # When the last round ends
+
+    def __len__(self):
+        return len(self.starts_ms)
+
+    def add_round(self, start_ms, duration, target_names):
+        self.starts_ms.append(start_ms)
+        self.durations.append(duration)
+        self.round_targets.append(tuple(target_names))
+        self.length_ms = max(self.length_ms, start_ms + duration * 1000)
+
+
+def plan_game(target_names, mode="quick", seed=0, settings=None, rest_ms=1500):
+    """Build a RoundPlan for these targets
+
+    Rounds may overlap, but a target is never picked again until rest_ms
+    after its last round ended - long enough for its result to come back
+    before it is sent the next command.
+    """
+    settings = settings or GAME_MODES[mode]
+    plan = RoundPlan(mode, seed)
+    if not target_names:
+        return plan
+
+    rng = _Rng(seed)
+    per_round = max(1, min(settings["per_round"], len(target_names)))
+    min_duration, max_duration = settings["duration"]
+    min_gap, max_gap = settings["gap_ms"]
+    free_at = {name: 0 for name in target_names}  # ms offset each target is free again
+
+    start_ms = 0
+    for _ in range(settings["rounds"]):
+        start_ms += rng.between(min_gap, max_gap)
+        free = [name for name in target_names if free_at[name] <= start_ms]
+        if len(free) < per_round:
+            # Push the round back until enough targets have rested
+            start_ms = sorted(free_at.values())[per_round - 1]
+            free = [name for name in target_names if free_at[name] <= start_ms]
+
+        duration = rng.between(min_duration, max_duration)
+        picked = rng.sample(free, per_round)
+        for name in picked:
+            free_at[name] = start_ms + duration * 1000 + rest_ms
+        plan.add_round(start_ms, duration, picked)
+
+    return plan
+
+
+class ScoreBoard:
+    """Running score for one game"""
+
+    def __init__(self, plan):
+        self.points = 0
+        self.hits = 0
+        self.misses = 0
+        self.no_shows = 0  # Targets that never got the command or never reported
+        self.round_points = array('H', [0] * len(plan))
+        self.reaction_us = RunningStats()  # Over every hit
+        self.target_points = {}  # target name -> points
+
+    def record(self, round_index, result):
+        """Score a pushed hit/miss result for its round"""
+        if not result.get("hit"):
+            self.misses += 1
+            return
+        points = result.get("hit_value", 0)
+        self.hits += 1
+        self.points += points
+        self.round_points[round_index] += points
+        name = result.get("target")
+        self.target_points[name] = self.target_points.get(name, 0) + points
+        if result.get("reaction_us") is not None:
+            self.reaction_us.add(result["reaction_us"])
+
+    def record_no_show(self, round_index, target_name):
+        self.no_shows += 1
+
+    def summary(self):
+        """Totals as a dict (for display and logging)"""
+        reaction = self.reaction_us
+        return {
+            "points": self.points,
+            "hits": self.hits,
+            "misses": self.misses,
+            "no_shows": self.no_shows,
+            "best_reaction_us": reaction.min,
+            "avg_reaction_us": int(reaction.mean) if reaction.count else None,
+        }
+
+
+class GameEngine:
+    """Plans games and plays them out through the controller"""
+
+    def __init__(self, controller, lookahead_ms=500, lead_ms=1000, result_grace_ms=1500):
+        """
+        Args:
+            lookahead_ms: How long before a round starts its commands go out
+            lead_ms: Time from run() to the first round's zero point
+            result_grace_ms: How long after the last round to wait for results
+        """
+        self.controller = controller
+        self.lookahead_ms = lookahead_ms
+        self.lead_ms = lead_ms
+        self.result_grace_ms = result_grace_ms
+        self.state = GAME_IDLE
+        self.plan = None
+        self.score = None
+        self._playing = None  # Plan being run
+        self._pending = {}  # target name -> (round index, activation ID) it is playing
+        self._activation = time.ticks_us() & 0xFFFF  # Last ID handed out - not reused across a reboot
+        self._wire = {}  # target name -> wire index, for log records
+        self._stop = False
+        self.player = None  # Who is playing - their hits go to controller.stats too
+
+    def new_plan(self, mode="quick", seed=None):
+        """Plan a game over the currently registered targets"""
+        if seed is None:
+            seed = time.ticks_us()
+        self.plan = plan_game(
+            list(self.controller.get_targets()),
+            mode,
+            seed,
+            mode_settings(mode),
+            rest_ms=self.lookahead_ms + 1000
+        )
+        print(f"🎲 Planned {mode} game: {len(self.plan)} rounds over {self.plan.length_ms // 1000}s (seed {seed})")
+        return self.plan
+
+    def stop(self):
+        """Stop dispatching rounds - results already on the way still count"""
+        self._stop = True
+
+    async def run(self, plan=None, player=None):
+        """Play a plan (default: the last one planned), returning its ScoreBoard"""
+        plan = plan or self.plan
+        if self.state == GAME_RUNNING:
+            print("⚠️ Game already running")
+            return self.score
+        if plan is None or not len(plan):
+            print("⚠️ Nothing to play - no rounds planned")
+            return None
+
+        self.state = GAME_RUNNING
+        self.player = player
+        self._stop = False
+        self._pending = {}
+        self._playing = plan
+        score = self.score = ScoreBoard(plan)
+        self._wire = {}
+        for names in plan.round_targets:
+            for name in names:
+                index = self.controller.targets.index_of(name)
+                self._wire[name] = NO_TARGET if index is None else index
+        self._log(KIND_GAME_START, None, 0, plan.seed & 0x7FFFFFFF, len(plan))
+
+        # Fix every round's start on the master clock before anything moves
+        zero_us = time.ticks_add(time.ticks_us(), self.lead_ms * 1000)
+        starts_us = [time.ticks_add(zero_us, offset * 1000) for offset in plan.starts_ms]
+        end_us = time.ticks_add(zero_us, (plan.length_ms + self.result_grace_ms) * 1000)
+        lookahead_us = self.lookahead_ms * 1000
+
+        self.controller.add_result_listener(self._on_result)
+        print(f"🎮 Game on! {len(plan)} rounds")
+        try:
+            for index in range(len(plan)):
+                wait_us = time.ticks_diff(starts_us[index], time.ticks_us()) - lookahead_us
+                if wait_us > 0:
+                    await uasyncio.sleep_ms(wait_us // 1000)
+                if self._stop:
+                    break
+                activations = {}
+                for name in plan.round_targets[index]:
+                    self._activation = (self._activation + 1) & 0xFFFF
+                    activations[name] = self._activation
+                    self._pending[name] = (index, self._activation)
+                    self._log(KIND_ACTIVATE, name, index, plan.durations[index] * 1000)
+                uasyncio.create_task(self._dispatch(index, starts_us[index], activations))
+
+            if not self._stop:
+                # Wait for the last results, or give up on them at end_us
+                while self._pending and time.ticks_diff(end_us, time.ticks_us()) > 0:
+                    await uasyncio.sleep_ms(50)
+        finally:
+            self.controller.remove_result_listener(self._on_result)
+            for name, (index, _) in self._pending.items():
+                score.record_no_show(index, name)
+                self._log(KIND_NO_SHOW, name, index)
+            self._pending = {}
+            self.state = GAME_FINISHED
+            self._log(KIND_GAME_END, None, len(plan), score.points, score.hits)
+            if self.controller.game_log:
+                self.controller.game_log.flush()
+
+        print(f"🏁 Game over: {score.summary()}")
+        return score
+
+    async def _dispatch(self, index, start_at, activations):
+        """Send one round's scheduled activations, each tagged with its ID"""
+        names = self._playing.round_targets[index]
+        fan_out = self.controller.fan_out(
+            self._activate,
+            self._playing.durations[index],
+            start_at,
+            activations,
+            names=names
+        )
+        results = await fan_out.collect()
+        for name in names:
+            result = results.get(name)
+            if result is None or result.get("status") == "failed":
+                # Never got the command - it won't be reporting for this round
+                if self._pending.get(name) == (index, activations[name]):
+                    del self._pending[name]
+                    self.score.record_no_show(index, name)
+                    self._log(KIND_NO_SHOW, name, index)
+                    print(f"💥 {name} missed round {index + 1}: {result.get('error') if result else 'not registered'}")
+
+    async def _activate(self, target_ip, target_name, duration, start_at, activations, timeout=5):
+        return await self.controller.activate_target_at(
+            target_ip, target_name, duration, start_at, activations[target_name], timeout=timeout
+        )
+
+    async def _on_result(self, result):
+        name = result["target"]
+        pending = self._pending.get(name)
+        if pending is None:
+            return
+        index, activation = pending
+        if result.get("activation") != activation:
+            print(f"⚠️ Ignoring {name} result for activation {result.get('activation')} - waiting on {activation}")
+            return
+        del self._pending[name]
+        self.score.record(index, result)
+        self._log(KIND_HIT if result.get("hit") else KIND_MISS, name, index,
+                  result.get("reaction_us") or 0, result.get("hit_value", 0))
+        if self.player is not None:
+            self.controller.stats.record_player(self.player, result)
+
+    def _log(self, kind, target_name, round_number, value=0, extra=0):
+        game_log = self.controller.game_log
+        if game_log:
+            target = NO_TARGET if target_name is None else self._wire.get(target_name, NO_TARGET)
+            game_log.append(kind, target, round_number, value, extra)
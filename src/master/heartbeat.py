@@ -0,0 +1,126 @@
+# heartbeat.py - Background liveness checks for registered targets
+#
+# Replaces the "ping everyone at once, drop whoever misses" sweep. Probes go
+# out one at a time, round-robin over the registry, spaced evenly across the
+# heartbeat interval. The spacing never drops below 1 / max_rate seconds, so
+# a bigger fleet stretches the interval rather than adding packets: the AP
+# carries at most max_rate probes per second however many targets there are.
+#
+# A probe is skipped for a healthy target that was heard from within the
+# current interval (a command reply, a pushed hit, a sync), so during a game
+# the heartbeat mostly stays quiet. A failed probe is retried after retry_ms
+# until the target answers or the registry marks it dead (see the state
+# hysteresis in target_registry.py). Retries wait for a probe slot like
+# everything else - a due retry takes the next slot ahead of the round-robin -
+# so a burst of failures never pushes the AP past max_rate. Targets that stay
+# dead for forget_ms are removed and have to re-register.
+
+import time
+import uasyncio
+from master.target_registry import STATE_HEALTHY, STATE_DEAD, STATE_NAMES
+
+
+class HeartbeatMonitor:
+    """Staggered, rate-capped health probing of every registered target"""
+
+    def __init__(self, controller, interval_ms=10000, max_rate=5, timeout=2,
+                 retry_ms=1000, forget_ms=300000):
+        self.controller = controller
+        self.interval_ms = interval_ms
+        self.max_rate = max_rate
+        self.timeout = timeout
+        self.retry_ms = retry_ms
+        self.forget_ms = forget_ms
+        self._cursor = 0
+        self._in_flight = set()  # Target names with a probe running
+        self._retry_at = {}  # Target name -> ticks_ms its retry is due
+        self.probes_sent = 0
+
+    def period_ms(self):
+        """Time for one full round - the interval, stretched to respect max_rate"""
+        return max(self.interval_ms, len(self.controller.targets) * 1000 // self.max_rate)
+
+    def _next_index(self):
+        """Next occupied registry slot after the cursor, or None if there are none"""
+        names = self.controller.targets.names
+        for _ in range(len(names)):
+            index = self._cursor % len(names)
+            self._cursor = index + 1
+            if names[index] is not None:
+                return index
+        return None
+
+    async def run(self):
+        """Background loop - one probe slot every period / target count"""
+        while True:
+            targets = self.controller.targets
+            count = len(targets)
+            if not count:
+                await uasyncio.sleep_ms(self.interval_ms)
+                continue
+
+            period = self.period_ms()
+            name = self._due_retry()
+            if name is not None:
+                self._start_probe(name)
+            else:
+                index = self._next_index()
+                if index is not None:
+                    self._check(index, period)
+            await uasyncio.sleep_ms(period // count)
+
+    def _due_retry(self):
+        """Pop a target whose retry is due, or None"""
+        now = time.ticks_ms()
+        for name, due in self._retry_at.items():
+            if time.ticks_diff(now, due) >= 0:
+                del self._retry_at[name]
+                if self.controller.targets.index_of(name) is None:
+                    return None  # Removed meanwhile - the slot goes unused this once
+                return name
+        return None
+
+    def _start_probe(self, name):
+        self._in_flight.add(name)
+        uasyncio.create_task(self._probe(name))
+
+    def _check(self, index, period):
+        targets = self.controller.targets
+        name = targets.names[index]
+        if name in self._in_flight or name in self._retry_at:
+            return
+
+        state = targets.states[index]
+        if state == STATE_HEALTHY and targets.seen_ms_ago(index) < period:
+            return  # Recent traffic already proves it is alive
+
+        if state == STATE_DEAD and targets.seen_ms_ago(index) > self.forget_ms:
+            uasyncio.create_task(self.controller.remove_target(name))
+            return
+
+        self._start_probe(name)
+
+    async def _probe(self, name):
+        """Ping a target once, queueing a quick retry if it failed but isn't dead yet"""
+        targets = self.controller.targets
+        try:
+            index = targets.index_of(name)
+            if index is None:
+                return  # Removed while we were waiting
+            before = targets.states[index]
+
+            self.probes_sent += 1
+            result = await self.controller.server.ping_target(targets.ips[index], name, timeout=self.timeout)
+            if targets.index_of(name) != index:
+                return
+            self.controller.record_result(name, result)
+
+            after = targets.states[index]
+            if after != before:
+                print(f"💓 {name} is now {STATE_NAMES[after]} (was {STATE_NAMES[before]})")
+
+            # Healthy targets wait for their next turn, dead ones for the next round
+            if result.get("status") == "failed" and after != STATE_DEAD:
+                self._retry_at[name] = time.ticks_add(time.ticks_ms(), self.retry_ms)
+        finally:
+            self._in_flight.discard(name)
@@ -2,20 +2,59 @@
 # 
 # Single controller for managing all SNYPER system state and operations
 
+import json
+import time
 import uasyncio
+from config.config import config
+from utils.socket_protocol import binary_codec, CODEC_JSON
 from master.master_server import MasterServer
+from master.clock_sync import ClockSyncService
+from master.target_registry import TargetRegistry, STATE_DEAD, STATE_SUSPECT
+from master.heartbeat import HeartbeatMonitor
+from master.fanout import FanOut
+from master.game_engine import GameEngine
+from master.score_stats import ScoreStats
+from gamelog.game_log import GameLog
 
 
 class MasterController:
     """Central controller managing all SNYPER operations"""
     
     def __init__(self):
-        self.server = MasterServer(on_target_register=self.register_target)
+        self.server = MasterServer(
+            on_target_register=self.register_target,
+            on_target_result=self.handle_target_result,
+            on_target_seen=self.target_seen
+        )
         self._ap = None
         self._server_started = False
         
-        # Target tracking - unified structure
-        self.targets = {}  # target_name -> {"ip": ip_address, ...}
+        # Target tracking - slot per target, its index is also the wire index
+        self.targets = TargetRegistry()
+        self.registry_file = config.get('registry_file', 'config/targets.json')
+        self._saved_version = self.targets.version
+        
+        # Hit/miss results pushed by targets
+        self.last_results = {}  # target_name -> latest result dict
+        self.result_listeners = []  # async callbacks, called with each result
+        self.round_start_us = None  # Master ticks_us the last scheduled round started at
+        self.stats = ScoreStats()  # Per-target / per-player hit stats, bounded memory
+        
+        # Per-target clock offset estimates, kept fresh in the background
+        self.clock_sync = ClockSyncService(self)
+        
+        # Staggered liveness probes - replaces full ping sweeps
+        self.heartbeat = HeartbeatMonitor(
+            self,
+            interval_ms=config.get('heartbeat_ms', 10000),
+            max_rate=config.get('heartbeat_rate', 5)
+        )
+        
+        # Round planning and scoring - plans are built before a game starts
+        self.game = GameEngine(self, lookahead_ms=config.get('game_lookahead_ms', 500))
+        
+        # Every activation and result, packed into RAM blocks and written to flash in the background
+        self.game_log = GameLog(max_bytes=config.get('game_log_max_kb', 512) * 1024) if config.get('game_log', True) else None
         
         print("🎯 MasterController initialized - Command center operational!")
     
@@ -40,6 +79,15 @@ class MasterController:
         async def server_task():
             # WiFi AP should already be started by now via controller.start_ap()
             try:
+                # Pick up the targets we knew before a reboot and check they're still there
+                if config.get('persist_registry', True):
+                    restored = self.restore_registry()
+                    uasyncio.create_task(self.recover_targets(restored))
+                    uasyncio.create_task(self.persist_registry())
+                uasyncio.create_task(self.clock_sync.run())
+                uasyncio.create_task(self.heartbeat.run())
+                if self.game_log:
+                    uasyncio.create_task(self.game_log.run())
                 await self.server.start_server(debug=True)
             except Exception as e:
                 print(f"💥 Master server error: {e}")
@@ -50,52 +98,216 @@ class MasterController:
     
     
     def register_target(self, client_id, client_ip):
-        """Register a new target client"""
-        self.targets[client_id] = {"ip": client_ip}
+        """Register a new target client, returning its wire index"""
+        # Keeps a target's index across re-registration so binary frames stay valid
+        index = self.targets.add(client_id, client_ip)
+        
+        # A re-registering target has usually rebooted, so its clock restarted
+        self.clock_sync.forget(client_id)
         
         print(f"🤝 Target {client_id} registered at {client_ip} via controller - LOCKED AND LOADED!")
         print(f"🔍 Controller Debug: {len(self.targets)} targets registered")
+        return index
+    
+    def target_seen(self, client_id, client_ip, index):
+        """A target answered a beacon - liveness, if it is registered where it says"""
+        if self.targets.index_of(client_id) != index or self.targets.ips[index] != client_ip:
+            return False
+        self.targets.mark_seen(index)
+        return True
+    
+    def save_registry(self):
+        """Write the registry (name, IP, index, codec, last seen) to flash"""
+        now_s = time.time()
+        entries = []
+        for index, target_name in enumerate(self.targets.names):
+            if target_name is None:
+                continue
+            target_ip = self.targets.ips[index]
+            entries.append({
+                "name": target_name,
+                "ip": target_ip,
+                "index": index,
+                "codec": self.server.peer_codecs.get(target_ip, CODEC_JSON),
+                "seen_s": now_s - self.targets.seen_ms_ago(index) // 1000,
+            })
+        try:
+            with open(self.registry_file, "w") as f:
+                json.dump({"targets": entries}, f)
+            self._saved_version = self.targets.version
+        except OSError as e:
+            print(f"💥 Failed to save target registry: {e}")
+    
+    def restore_registry(self):
+        """Reload the registry saved before a reboot, returning the restored names
+        
+        Restored targets keep their wire index and codec but start out
+        suspect until they answer a probe.
+        """
+        try:
+            with open(self.registry_file) as f:
+                entries = json.load(f).get("targets", [])
+        except (OSError, ValueError):
+            return []
+        
+        restored = []
+        for entry in entries:
+            target_name = entry["name"]
+            target_ip = entry["ip"]
+            index = self.targets.add(target_name, target_ip, entry.get("index"))
+            self.targets.states[index] = STATE_SUSPECT
+            self.server.peer_codecs[target_ip] = entry.get("codec", CODEC_JSON)
+            binary_codec.bind_target(target_name, index)
+            restored.append(target_name)
+        self._saved_version = self.targets.version
+        print(f"📂 Restored {len(restored)} targets from {self.registry_file}")
+        return restored
+    
+    async def recover_targets(self, target_names):
+        """Probe restored targets so the live ones are usable without re-registering"""
+        if not target_names:
+            return
+        print(f"🔎 Probing {len(target_names)} known targets...")
+        results = await self.fan_out(self.server.ping_target, names=target_names, retries=2).collect()
+        alive = sum(1 for result in results.values() if result.get("status") != "failed")
+        print(f"♻️ {alive}/{len(target_names)} known targets back after reboot")
+    
+    async def persist_registry(self, interval_ms=5000):
+        """Background loop - save the registry whenever targets join, leave or move"""
+        while True:
+            await uasyncio.sleep_ms(interval_ms)
+            if self.targets.version != self._saved_version:
+                self.save_registry()
+    
+    def add_result_listener(self, callback):
+        """Subscribe an async callback to every hit/miss result from any target"""
+        self.result_listeners.append(callback)
+    
+    def remove_result_listener(self, callback):
+        """Unsubscribe a result callback"""
+        if callback in self.result_listeners:
+            self.result_listeners.remove(callback)
+    
+    async def handle_target_result(self, message, client_ip):
+        """Record a hit/miss pushed by a target and notify listeners"""
+        index = self.targets.index_of(message.target_id)
+        if index is not None:
+            self.targets.mark_seen(index)
+        
+        data = message.data
+        result = {
+            "target": message.target_id,
+            "ip": client_ip,
+            "hit": message.type == "hit",
+            "hit_value": data.get("hit_value", 0),
+            "intensity": data.get("intensity", 0),
+            "reaction_us": data.get("reaction_us"),
+            "target_ticks_us": data.get("ticks_us"),
+            "received_us": time.ticks_us(),
+            "master_us": self.to_master_us(message.target_id, data.get("ticks_us")),
+            "activation": data.get("activation")  # Echoed from the ACTIVATE, None if untagged
+        }
+        self.last_results[message.target_id] = result
+        self.stats.record(result)
+        
+        if result["hit"]:
+            print(f"💥 {message.target_id} HIT! reaction {result['reaction_us']} us, intensity {result['intensity']}")
+        else:
+            print(f"⏰ {message.target_id} missed")
+        
+        for listener in self.result_listeners:
+            try:
+                await listener(result)
+            except Exception as e:
+                print(f"💥 Result listener error: {e}")
+    
+    def to_master_us(self, target_name, target_ticks):
+        """Convert a target's ticks_us timestamp to master time, None if not synced"""
+        estimate = self.clock_sync.estimate(target_name)
+        if estimate is None or target_ticks is None:
+            return None
+        return estimate.to_master(target_ticks)
+    
+    def clock_error_us(self, target_name):
+        """Estimated clock sync error for a target in us, None if not synced"""
+        estimate = self.clock_sync.estimate(target_name)
+        return estimate.error_us if estimate else None
     
     def get_targets(self):
-        """Get list of registered target names"""
-        targets = list(self.targets.keys())
-        print(f"📋 Controller returning {len(targets)} targets: {targets}")
-        return targets
+        """Get list of registered target names (cached until a target joins or leaves)"""
+        return self.targets.names_list()
     
-    async def _message_all(self, server_method):
-        """Send messages to all registered targets using multiplexed communication"""
+    def record_result(self, target_name, result):
+        """Fold a command result into the target's health stats"""
+        index = self.targets.index_of(target_name)
+        if index is None:
+            return
+        if result.get("status") == "failed":
+            self.targets.record_failure(index)
+        elif "rtt_us" in result:
+            self.targets.record_rtt(index, result["rtt_us"])
+        else:
+            self.targets.mark_seen(index)
+    
+    def fan_out(self, server_method, *args, broadcast=None, names=None, limit=None,
+                target_timeout_ms=None, deadline_ms=None, retries=None):
+        """Start a command on every registered target, streaming results as they land
+        
+        Args:
+            server_method: Per-target server coroutine, called as
+                server_method(target_ip, target_name, *args, timeout=seconds)
+            broadcast: Optional (command_type, reply_type, data) - sends the
+                command to every eligible target in one UDP datagram first,
+                and only targets that didn't ack get a TCP command
+            names: Only these targets (default: every registered target) -
+                a broadcast always reaches everyone, so it is not used then
+            limit, target_timeout_ms, deadline_ms, retries: Override the
+                fanout_* config defaults for this run
+        
+        Returns:
+            FanOut: async-iterate it for (target_name, result) in completion
+            order, or await .collect() for a dict
+        """
+        targets = []
+        skipped = {}
+        if names is None:
+            indexes = range(len(self.targets.names))
+        else:
+            indexes = [self.targets.index_of(target_name) for target_name in names]
+        for index in indexes:
+            target_name = self.targets.name_at(index) if index is not None else None
+            if target_name is None:
+                continue
+            target_ip = self.targets.ips[index]
+            if self.targets.states[index] == STATE_DEAD:
+                # Don't hold the whole fan-out hostage to a timeout - the
+                # heartbeat brings it back once it answers again
+                skipped[target_name] = {"status": "failed", "ip": target_ip, "error": "Target not responding"}
+            else:
+                targets.append((target_name, target_ip))
+        
+        async def prelude():
+            command_type, reply_type, data = broadcast
+            return await self.server.broadcast_command(command_type, reply_type, self.targets, data)
+        
+        return FanOut(
+            server_method,
+            targets,
+            args,
+            limit=limit or config.get('fanout_limit', 8),
+            target_timeout_ms=target_timeout_ms or config.get('fanout_target_timeout_ms', 3000),
+            deadline_ms=deadline_ms or config.get('fanout_deadline_ms', 8000),
+            retries=config.get('fanout_retries', 1) if retries is None else retries,
+            prelude=prelude if broadcast and targets and names is None else None,
+            on_result=self.record_result,
+            settled=skipped
+        )
+    
+    async def _message_all(self, server_method, *args, broadcast=None):
+        """Send a command to all registered targets and wait for every result"""
         if not self.targets:
             return {}
-        
-        # Create tasks for all targets simultaneously
-        tasks = []
-        target_names = []
-        
-        for target_name, target_info in self.targets.items():
-            target_ip = target_info["ip"]
-            # Create task for this target
-            task = server_method(target_ip, target_name)
-            tasks.append(task)
-            target_names.append(target_name)
-        
-        # Execute all tasks concurrently
-        results = await uasyncio.gather(*tasks, return_exceptions=True)
-        
-        # Build results dictionary
-        final_results = {}
-        for target_name, result in zip(target_names, results):
-            if isinstance(result, Exception):
-                # Handle exceptions from failed tasks
-                final_results[target_name] = {
-                    "status": "failed", 
-                    "ip": self.targets[target_name]["ip"],
-                    "error": str(result)
-                }
-            else:
-                # Use the result from successful task
-                final_results[target_name] = result
-        
-        return final_results
+        return await self.fan_out(server_method, *args, broadcast=broadcast).collect()
     
     async def ping_targets(self):
         """Ping all registered targets and return results"""
@@ -110,7 +322,7 @@ class MasterController:
         
         # Process results for logging
         for target_name, result in results.items():
-            target_ip = self.targets[target_name]["ip"]
+            target_ip = result.get("ip")
             status = result.get("status")
             
             if status == "alive":
@@ -131,12 +343,15 @@ class MasterController:
         
         print(f"🚀 Socket sending STAND UP command to {len(self.targets)} targets...")
         
-        # Use multiplexed communication
-        results = await self._message_all(self.server.raise_target)
+        # Broadcast to all targets at once, TCP for any that don't ack
+        results = await self._message_all(
+            self.server.raise_target,
+            broadcast=("STAND_UP", "standing", {"from": "master"})
+        )
         
         # Process results for logging
         for target_name, result in results.items():
-            target_ip = self.targets[target_name]["ip"]
+            target_ip = result.get("ip")
             status = result.get("status")
             
             if status == "standing":
@@ -159,12 +374,15 @@ class MasterController:
         
         print(f"🚀 Socket sending LAY DOWN command to {len(self.targets)} targets...")
         
-        # Use multiplexed communication
-        results = await self._message_all(self.server.lower_target)
+        # Broadcast to all targets at once, TCP for any that don't ack
+        results = await self._message_all(
+            self.server.lower_target,
+            broadcast=("LAY_DOWN", "down", {"from": "master"})
+        )
         
         # Process results for logging
         for target_name, result in results.items():
-            target_ip = self.targets[target_name]["ip"]
+            target_ip = result.get("ip")
             status = result.get("status")
             
             if status == "down":
@@ -179,45 +397,66 @@ class MasterController:
         
         return results
     
-    async def activate_all(self, duration=5):
-        """Send activate command to all registered targets"""
+    async def activate_target_at(self, target_ip, target_name, duration, start_at, activation=None, timeout=5):
+        """Activate one target so it rises at master time start_at (ticks_us)
+        
+        The start goes out in the target's own clock when we have an estimate
+        for it, otherwise as a delay from now (off by the one-way latency).
+        activation tags the command - the target's pushed result carries it.
+        """
+        estimate = self.clock_sync.estimate(target_name)
+        if estimate is not None:
+            return await self.server.activate_target(
+                target_ip, target_name, duration, timeout=timeout, start_us=estimate.to_target(start_at),
+                activation=activation
+            )
+        delay_ms = max(time.ticks_diff(start_at, time.ticks_us()) // 1000, 0)
+        return await self.server.activate_target(target_ip, target_name, duration, timeout=timeout,
+                                                 delay_ms=delay_ms, activation=activation)
+    
+    async def activate_all(self, duration=5, lead_ms=None):
+        """Send activate command to all registered targets
+        
+        Targets are told to rise together lead_ms from now (config
+        activate_lead_ms), so the round starts at the same instant whatever
+        order the commands arrive in. lead_ms=0 activates on receipt instead.
+        
+        Only lead_ms=0 uses the UDP broadcast. A scheduled round needs a
+        start time in each target's own clock, and one datagram can't carry
+        that - a shared delay_ms would be stale on every rebroadcast (up to
+        retries * retry_ms late) and off by each target's unknown latency,
+        where clock-synced start_us rises within a few ms. Set
+        activate_lead_ms to 0 to trade that for one datagram per round.
+        """
         if not self.targets:
             print("⚠️ No targets registered to activate")
             return {}
         
+        if lead_ms is None:
+            lead_ms = config.get('activate_lead_ms', 500)
+        
         print(f"🚀 Socket sending ACTIVATE command to {len(self.targets)} targets for {duration} seconds...")
         
-        # Create activate tasks with duration parameter
-        tasks = []
-        target_names = []
-        
-        for target_name, target_info in self.targets.items():
-            target_ip = target_info["ip"]
-            # Create task with duration parameter
-            task = self.server.activate_target(target_ip, target_name, duration)
-            tasks.append(task)
-            target_names.append(target_name)
-        
-        # Execute all tasks concurrently
-        results = await uasyncio.gather(*tasks, return_exceptions=True)
-        
-        # Build results dictionary
-        final_results = {}
-        for target_name, result in zip(target_names, results):
-            if isinstance(result, Exception):
-                # Handle exceptions from failed tasks
-                final_results[target_name] = {
-                    "status": "failed", 
-                    "ip": self.targets[target_name]["ip"],
-                    "error": str(result)
-                }
-            else:
-                # Use the result from successful task
-                final_results[target_name] = result
+        if lead_ms:
+            # Every target gets its own start time, so no shared broadcast (see above)
+            self.round_start_us = time.ticks_add(time.ticks_us(), lead_ms * 1000)
+            final_results = await self.fan_out(
+                self.activate_target_at,
+                duration,
+                self.round_start_us
+            ).collect()
+        else:
+            # One broadcast datagram, with TCP fallback for targets that miss it
+            self.round_start_us = None
+            final_results = await self._message_all(
+                self.server.activate_target,
+                duration,
+                broadcast=("ACTIVATE", "activated", {"from": "master", "duration": duration})
+            )
         
         # Process results for logging
         for target_name, result in final_results.items():
-            target_ip = self.targets[target_name]["ip"]
+            target_ip = result.get("ip")
             status = result.get("status")
             
             if status == "activated":
@@ -231,23 +470,66 @@ class MasterController:
                 print(f"⚠️ {target_name} responded with status: {status}")
         
         return final_results
+
+    async def calibrate_all(self):
+        """Have every target measure its own noise and retune its hit thresholds"""
+        if not self.targets:
+            print("⚠️ No targets registered to calibrate")
+            return {}
+
+        print(f"🎚️ Calibrating {len(self.targets)} targets - keep clear of the plates...")
+
+        # Targets measure in parallel; each one takes a few seconds of servo cycles
+        timeout_ms = config.get('calibrate_timeout_ms', 15000) + 2000
+        results = await self.fan_out(
+            self.server.calibrate_target,
+            target_timeout_ms=timeout_ms,
+            deadline_ms=timeout_ms + 2000,
+            retries=0
+        ).collect()
+
+        for target_name, result in results.items():
+            target_ip = result.get("ip")
+            status = result.get("status")
+
+            if status == "calibrated":
+                clamped = " (clamped - check the mount)" if result.get("clamped") else ""
+                print(f"✅ {target_name} hit threshold {result.get('hit_threshold')}, noise floor {result.get('noise_floor')}, servo {result.get('travel_ms')}ms{clamped}")
+            elif status == "failed":
+                error = result.get("error", "Unknown error")
+                print(f"💥 {target_name} at {target_ip} failed to calibrate: {error}")
+            else:
+                print(f"⚠️ {target_name} responded with status: {status}")
+
+        return results
+
+    async def remove_target(self, target_name):
+        """Forget a target entirely - it has to re-register to come back"""
+        target_ip = self.targets.remove(target_name)
+        if target_ip is None:
+            return
+        await self.server.pool.discard(target_ip)
+        self.clock_sync.forget(target_name)
+        print(f"🗑️ Removed {target_name} ({target_ip}) from registered targets")
     
     async def ping_and_cleanup_targets(self):
-        """Ping all targets and remove any that fail to respond"""
+        """Ping all targets and remove any the heartbeat has declared dead
+        
+        A single missed ping only makes a target suspect - it takes several
+        failures in a row (see target_registry.py) before it is removed.
+        """
         results = await self.ping_targets()
         
-        # Remove failed targets from system state
-        failed_targets = [name for name, result in results.items() if result["status"] == "failed"]
+        dead_targets = [name for name in self.targets.names_list()
+                        if self.targets.states[self.targets.index_of(name)] == STATE_DEAD]
         
-        if failed_targets:
-            print(f"🧹 Cleaning up {len(failed_targets)} failed targets...")
-            for target_name in failed_targets:
-                target_ip = self.targets[target_name]["ip"]
-                del self.targets[target_name]
-                print(f"🗑️ Removed {target_name} ({target_ip}) from registered targets")
+        if dead_targets:
+            print(f"🧹 Cleaning up {len(dead_targets)} dead targets...")
+            for target_name in dead_targets:
+                await self.remove_target(target_name)
             
             print(f"📊 Cleanup complete: {len(self.targets)} targets remaining")
         else:
-            print("✨ All targets responded successfully - no cleanup needed!")
+            print("✨ No dead targets - no cleanup needed!")
         
         return results
\ No newline at end of file
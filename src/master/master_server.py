@@ -1,14 +1,21 @@
+import random
+import time
 import uasyncio
 from config.config import config
 from utils.helpers import initialize_access_point
-from utils.socket_protocol import SocketMessage, SocketServer
+from utils.socket_protocol import SocketMessage, SocketServer, binary_codec, preferred_codecs, CODEC_JSON, CODEC_BINARY
+from utils.wire_codec import NO_TARGET
+from utils.broadcast import (BroadcastChannel, BeaconService, pack_beacon, pack_hello,
+                             WELCOME_MARKER, FLAG_BINARY)
+from master.target_registry import STATE_DEAD
 
 class MasterServer(SocketServer):
     """Master server class to handle socket communication - let me tell you something, this is gonna be AWESOME!"""
     
-    def __init__(self, on_target_register=None):
-        # Initialize parent SocketServer with port
-        super().__init__(config.port)
+    def __init__(self, on_target_register=None, on_target_result=None, on_target_seen=None):
+        # Initialize parent SocketServer with port - every target keeps one
+        # stream open for pushes, so size the connection cap for the fleet
+        super().__init__(config.port, max_clients=config.get('max_clients', 24))
         
         self._ap = None
         
@@ -19,6 +26,16 @@ class MasterServer(SocketServer):
         
         # Callback functions for communicating with controller
         self.on_target_register = on_target_register
+        self.on_target_result = on_target_result  # async (message, client_ip)
+        self.on_target_seen = on_target_seen  # (client_id, client_ip, index) -> True if registered there
+        
+        # UDP channel for one-packet commands to many targets (opened with the server)
+        self.broadcast = None
+        
+        # Changes on every boot, so targets can tell their registration is stale
+        # (30 bits keeps it a small int and a positive int32 on the wire; never 0)
+        self.epoch = random.getrandbits(30) | 1
+        self.beacons = None
     
     async def start_ap(self):
         """Create WiFi Access Point with clean network state"""
@@ -36,6 +53,10 @@ class MasterServer(SocketServer):
         # Handle registration messages
         if message.type == "register":
             await self._handle_socket_registration(message, client_ip, writer)
+        elif message.type in ("hit", "miss"):
+            # Pushed results are one-way - hand straight to the controller, no reply
+            if self.on_target_result:
+                await self.on_target_result(message, client_ip)
         else:
             # Send error for unsupported message types
             error_msg = SocketMessage(
@@ -44,8 +65,7 @@ class MasterServer(SocketServer):
                 target_id=message.target_id,
                 data={"error": f"Unsupported message type: {message.type}"}
             )
-            writer.write(error_msg.to_line().encode('utf-8'))
-            await writer.drain()
+            await self.write_message(writer, error_msg, message.codec)
     
     async def _handle_socket_registration(self, message, client_ip, writer):
         """Handle socket registration message"""
@@ -53,23 +73,16 @@ class MasterServer(SocketServer):
         print(f"🎯 Socket registration: {client_id} from {client_ip}")
         
         try:
-            # Call the registration callback (same as HTTP)
-            if self.on_target_register:
-                print(f"🤝 Calling registration callback for {client_id} at {client_ip}")
-                self.on_target_register(client_id, client_ip)
-                print(f"✅ Socket registration callback completed for {client_id}")
-            else:
-                print(f"🤝 Target {client_id} at {client_ip} wants to register (no callback registered)")
+            index, codec = self.accept_registration(client_id, client_ip, message.data.get("codecs", [CODEC_JSON]))
             
-            # Send success response
+            # Send success response (registration replies are always JSON)
             response = SocketMessage(
                 "REGISTERED",
                 msg_id=message.id,
                 target_id=client_id,
-                data={"status": "registered"}
+                data={"status": "registered", "codec": codec, "index": index, "epoch": self.epoch}
             )
-            writer.write(response.to_line().encode('utf-8'))
-            await writer.drain()
+            await self.write_message(writer, response)
             
             print(f"✅ Socket registration complete for {client_id}")
             
@@ -82,11 +95,55 @@ class MasterServer(SocketServer):
                 target_id=client_id,
                 data={"error": str(e)}
             )
-            writer.write(error_msg.to_line().encode('utf-8'))
-            await writer.drain()
+            await self.write_message(writer, error_msg, message.codec)
+
 
+    def accept_registration(self, client_id, client_ip, offered_codecs):
+        """Register a target through the controller, returning (wire index, codec)"""
+        index = None
+        if self.on_target_register:
+            print(f"🤝 Calling registration callback for {client_id} at {client_ip}")
+            index = self.on_target_register(client_id, client_ip)
+            print(f"✅ Registration callback completed for {client_id}")
+        else:
+            print(f"🤝 Target {client_id} at {client_ip} wants to register (no callback registered)")
+        
+        # Pick the first codec the target offers that we also speak
+        codec = next((c for c in preferred_codecs() if c in offered_codecs), CODEC_JSON)
+        self.peer_codecs[client_ip] = codec
+        binary_codec.bind_target(client_id, index)
+        print(f"🗜️ {client_id} will use {codec} framing (index {index})")
+        return index, codec
+    
+    def _handle_announce(self, announce, addr):
+        """A target answered a beacon - refresh it, or register it if it's new to this epoch"""
+        client_id, index, flags, epoch = announce
+        client_ip = addr[0]
+        if epoch == self.epoch and self.on_target_seen and self.on_target_seen(client_id, client_ip, index):
+            return None
+        
+        print(f"🛰️ Announce from {client_id} at {client_ip} - registering")
+        offered = [CODEC_BINARY, CODEC_JSON] if flags & FLAG_BINARY else [CODEC_JSON]
+        index, codec = self.accept_registration(client_id, client_ip, offered)
+        if index is None:
+            index = NO_TARGET
+        return pack_hello(WELCOME_MARKER, client_id, index, FLAG_BINARY if codec == CODEC_BINARY else 0, self.epoch)
+    
+    def process_response(self, response_message, expected_type, target_id, target_ip):
+        """Turn a target's reply message into a result dict for the controller"""
+        if response_message.type == expected_type:
+            status = response_message.data.get("status", "unknown")
+            print(f"✅ {target_id} responded with {expected_type.upper()}: {status}")
+            return {"status": status, "ip": target_ip}
+        elif response_message.type == "error":
+            error_msg = response_message.data.get("error", "Unknown error")
+            print(f"💥 {target_id} responded with error: {error_msg}")
+            return {"status": "error", "error": error_msg, "ip": target_ip}
+        else:
+            print(f"⚠️ {target_id} unexpected response type: {response_message.type}")
+            return {"status": "unknown", "response_type": response_message.type, "ip": target_ip}
 
-    async def ping_target(self, target_ip, target_id):
+    async def ping_target(self, target_ip, target_id, timeout=5):
         """Ping a specific target using socket communication"""
         # Create ping message
         ping_msg = SocketMessage(
@@ -95,28 +152,19 @@ class MasterServer(SocketServer):
             data={"from": "master"}
         )
         
-        # Send command and process response
-        result = await self.send_message(ping_msg, target_ip)
+        # Send command and process response, timing the round trip
+        start = time.ticks_us()
+        result = await self.send_message(ping_msg, target_ip, timeout=timeout)
         
         if result["status"] == "failed":
             return result
         
         # Process successful response
-        response_message = result["response_message"]
-        
-        if response_message.type == "pong":
-            status = response_message.data.get("status", "unknown")
-            print(f"✅ {target_id} responded with PONG: {status}")
-            return {"status": status, "ip": target_ip}
-        elif response_message.type == "error":
-            error_msg = response_message.data.get("error", "Unknown error")
-            print(f"💥 {target_id} responded with error: {error_msg}")
-            return {"status": "error", "error": error_msg, "ip": target_ip}
-        else:
-            print(f"⚠️ {target_id} unexpected response type: {response_message.type}")
-            return {"status": "unknown", "response_type": response_message.type, "ip": target_ip}
+        processed = self.process_response(result["response_message"], "pong", target_id, target_ip)
+        processed["rtt_us"] = time.ticks_diff(time.ticks_us(), start)
+        return processed
 
-    async def raise_target(self, target_ip, target_id):
+    async def raise_target(self, target_ip, target_id, timeout=5):
         """Send stand_up command to a specific target using socket communication"""
         # Create stand_up message
         stand_up_msg = SocketMessage(
@@ -126,27 +174,15 @@ class MasterServer(SocketServer):
         )
         
         # Send command and process response
-        result = await self.send_message(stand_up_msg, target_ip)
+        result = await self.send_message(stand_up_msg, target_ip, timeout=timeout)
         
         if result["status"] == "failed":
             return result
         
         # Process successful response
-        response_message = result["response_message"]
-        
-        if response_message.type == "standing":
-            status = response_message.data.get("status", "unknown")
-            print(f"✅ {target_id} responded with STANDING: {status}")
-            return {"status": status, "ip": target_ip}
-        elif response_message.type == "error":
-            error_msg = response_message.data.get("error", "Unknown error")
-            print(f"💥 {target_id} responded with error: {error_msg}")
-            return {"status": "error", "error": error_msg, "ip": target_ip}
-        else:
-            print(f"⚠️ {target_id} unexpected response type: {response_message.type}")
-            return {"status": "unknown", "response_type": response_message.type, "ip": target_ip}
+        return self.process_response(result["response_message"], "standing", target_id, target_ip)
 
-    async def lower_target(self, target_ip, target_id):
+    async def lower_target(self, target_ip, target_id, timeout=5):
         """Send lay_down command to a specific target using socket communication"""
         # Create lay_down message
         lay_down_msg = SocketMessage(
@@ -156,55 +192,134 @@ class MasterServer(SocketServer):
         )
         
         # Send command and process response
-        result = await self.send_message(lay_down_msg, target_ip)
+        result = await self.send_message(lay_down_msg, target_ip, timeout=timeout)
         
         if result["status"] == "failed":
             return result
         
         # Process successful response
-        response_message = result["response_message"]
-        
-        if response_message.type == "down":
-            status = response_message.data.get("status", "unknown")
-            print(f"✅ {target_id} responded with DOWN: {status}")
-            return {"status": status, "ip": target_ip}
-        elif response_message.type == "error":
-            error_msg = response_message.data.get("error", "Unknown error")
-            print(f"💥 {target_id} responded with error: {error_msg}")
-            return {"status": "error", "error": error_msg, "ip": target_ip}
-        else:
-            print(f"⚠️ {target_id} unexpected response type: {response_message.type}")
-            return {"status": "unknown", "response_type": response_message.type, "ip": target_ip}
+        return self.process_response(result["response_message"], "down", target_id, target_ip)
 
-    async def activate_target(self, target_ip, target_id, duration=5):
-        """Send activate command to a specific target using socket communication"""
+    async def activate_target(self, target_ip, target_id, duration=5, timeout=5, start_us=None, delay_ms=None,
+                              activation=None):
+        """Send activate command to a specific target using socket communication
+        
+        start_us schedules the activation at that instant of the target's own
+        ticks_us clock; delay_ms is the fallback for a target with no clock
+        estimate. With neither the target activates as soon as it can. The
+        target echoes activation (an int ID) in the hit/miss it pushes back.
+        """
         # Create activate message with duration data
+        data = {"from": "master", "duration": duration}
+        if start_us is not None:
+            data["start_us"] = start_us
+        elif delay_ms is not None:
+            data["delay_ms"] = delay_ms
+        if activation is not None:
+            data["activation"] = activation
         activate_msg = SocketMessage(
             "ACTIVATE",
             target_id=target_id,
-            data={"from": "master", "duration": duration}
+            data=data
         )
         
         # Send command and process response
-        result = await self.send_message(activate_msg, target_ip)
+        result = await self.send_message(activate_msg, target_ip, timeout=timeout)
         
         if result["status"] == "failed":
             return result
         
         # Process successful response
-        response_message = result["response_message"]
+        processed = self.process_response(result["response_message"], "activated", target_id, target_ip)
+        if processed["status"] not in ("error", "unknown"):
+            processed["duration"] = duration
+        return processed
+
+    async def calibrate_target(self, target_ip, target_id, timeout=15):
+        """Have a target recalibrate its piezo thresholds - the reply comes once it's done"""
+        calibrate_msg = SocketMessage(
+            "CALIBRATE",
+            target_id=target_id,
+            data={"from": "master"}
+        )
         
-        if response_message.type == "activated":
-            status = response_message.data.get("status", "unknown")
-            print(f"✅ {target_id} responded with ACTIVATED: {status}")
-            return {"status": status, "ip": target_ip, "duration": duration}
-        elif response_message.type == "error":
-            error_msg = response_message.data.get("error", "Unknown error")
-            print(f"💥 {target_id} responded with error: {error_msg}")
-            return {"status": "error", "error": error_msg, "ip": target_ip}
-        else:
-            print(f"⚠️ {target_id} unexpected response type: {response_message.type}")
-            return {"status": "unknown", "response_type": response_message.type, "ip": target_ip}
+        result = await self.send_message(calibrate_msg, target_ip, timeout=timeout)
+        
+        if result["status"] == "failed":
+            return result
+        
+        processed = self.process_response(result["response_message"], "calibrated", target_id, target_ip)
+        if processed["status"] == "calibrated":
+            data = result["response_message"].data
+            processed["hit_threshold"] = data.get("hit_threshold")
+            processed["noise_floor"] = data.get("noise_floor")
+            processed["clamped"] = data.get("clamped", False)
+            processed["travel_ms"] = data.get("travel_ms")
+        return processed
+
+    async def broadcast_command(self, command_type, reply_type, targets, data=None):
+        """Send one command to many targets in a single UDP broadcast
+        
+        Args:
+            command_type: Message type to send (e.g. "STAND_UP")
+            reply_type: Message type a successful target answers with
+            targets: TargetRegistry - slot index is the wire index
+            data: Optional command payload
+        
+        Returns:
+            dict: {target_name: result} for every target that acked. Targets
+            without binary framing, or that never acked, are left out so the
+            caller can fall back to sending them a TCP command. Targets the
+            registry has declared dead aren't waited on at all.
+        """
+        if not self.broadcast:
+            return {}
+        
+        # Broadcast frames are binary and address targets by wire index. Dead
+        # targets can't ack - they would only burn every retry waiting
+        eligible = {}
+        for index, target_name in enumerate(targets.names):
+            if (target_name is not None and targets.states[index] != STATE_DEAD
+                    and self.peer_codecs.get(targets.ips[index]) == CODEC_BINARY):
+                eligible[index] = target_name
+        if not eligible:
+            return {}
+        
+        command_msg = SocketMessage(command_type, data=data)
+        print(f"📢 Broadcasting {command_type} to {len(eligible)} targets")
+        replies = await self.broadcast.send(command_msg, eligible.keys())
+        
+        results = {}
+        for index, reply in replies.items():
+            target_name = eligible[index]
+            result = self.process_response(reply, reply_type, target_name, targets.ips[index])
+            if data and "duration" in data and result["status"] not in ("error", "unknown"):
+                result["duration"] = data["duration"]
+            results[target_name] = result
+        return results
+
+    async def sync_target(self, target_ip, target_id):
+        """One clock sync exchange with a target
+        
+        Returns:
+            tuple: (t1, t2, t3, t4) ticks_us stamps, or None if it failed
+        """
+        t1 = time.ticks_us()
+        sync_msg = SocketMessage(
+            "SYNC",
+            target_id=target_id,
+            data={"t1": t1}
+        )
+        
+        result = await self.send_message(sync_msg, target_ip, timeout=1)
+        t4 = time.ticks_us()
+        
+        if result["status"] == "failed":
+            return None
+        response_message = result["response_message"]
+        if response_message.type != "synced" or response_message.data.get("t1") != t1:
+            return None
+        return t1, response_message.data["t2"], response_message.data["t3"], t4
 
     async def start_server(self, debug=True):
         """Start socket-only server"""
@@ -213,6 +328,22 @@ class MasterServer(SocketServer):
         # Start socket server only
         await self.start_socket_server()
         
+        # Close pooled target connections that have gone quiet
+        uasyncio.create_task(self.pool.run_evictor())
+        
+        if config.get('broadcast', True):
+            self.broadcast = BroadcastChannel()
+            self.broadcast.open()
+        
+        # Beacons let targets find us and register without a TCP handshake
+        if config.get('discovery', True):
+            self.beacons = BeaconService(
+                pack_beacon(self.port, self.epoch),
+                self._handle_announce,
+                interval_ms=config.get('beacon_ms', 2000)
+            )
+            uasyncio.create_task(self.beacons.run())
+        
         try:
             print(f"✅ Master running socket-only mode on port {self.port} (accessible at {self.server_ip}:{self.port})")
             # Keep socket server running (no HTTP server)
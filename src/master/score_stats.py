@@ -0,0 +1,99 @@
+# score_stats.py - Per-target and per-player scoring statistics
+#
+# One EntityStats per target and per player, fed one hit/miss at a time and
+# never holding more than a fixed window of recent reaction times. Every
+# figure a view shows (hit rate, reaction mean/min/max, p50/p90, streaks) is
+# an attribute or a one-line property, so reading them every frame costs
+# nothing; `version` moves on every update, so a view can skip redrawing
+# when nothing changed.
+
+from utils.stats import RingBuffer, RunningStats, P2Quantile
+
+RECENT_REACTIONS = 16  # Reaction times kept per entity for sparklines etc.
+
+
+class EntityStats:
+    """Running stats for one target or one player"""
+
+    def __init__(self, name):
+        self.name = name
+        self.reaction_us = RunningStats()
+        self.p50_us = P2Quantile(0.5)
+        self.p90_us = P2Quantile(0.9)
+        self.recent_us = RingBuffer(RECENT_REACTIONS)
+        self.clear()
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self.points = 0
+        self.streak = 0  # Current run of hits
+        self.best_streak = 0
+        self.reaction_us.clear()
+        self.p50_us.clear()
+        self.p90_us.clear()
+        self.recent_us.clear()
+
+    def record(self, hit, reaction_us=None, points=0):
+        if not hit:
+            self.misses += 1
+            self.streak = 0
+            return
+        self.hits += 1
+        self.points += points
+        self.streak += 1
+        if self.streak > self.best_streak:
+            self.best_streak = self.streak
+        if reaction_us is not None:
+            self.reaction_us.add(reaction_us)
+            self.p50_us.add(reaction_us)
+            self.p90_us.add(reaction_us)
+            self.recent_us.push(reaction_us)
+
+    @property
+    def shots(self):
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self):
+        shots = self.hits + self.misses
+        return self.hits / shots if shots else 0.0
+
+
+class ScoreStats:
+    """EntityStats per target and per player, updated from pushed results"""
+
+    def __init__(self):
+        self.targets = {}  # target name -> EntityStats
+        self.players = {}  # player name -> EntityStats
+        self.version = 0  # Bumped on every update
+
+    def _entity(self, table, name):
+        stats = table.get(name)
+        if stats is None:
+            stats = table[name] = EntityStats(name)
+        return stats
+
+    def target(self, name):
+        return self._entity(self.targets, name)
+
+    def player(self, name):
+        return self._entity(self.players, name)
+
+    def record(self, result):
+        """Fold a hit/miss result (as passed to result listeners) into its target's stats"""
+        self._record(self.target(result.get("target")), result)
+
+    def record_player(self, player, result):
+        """Credit a result to a player as well"""
+        self._record(self.player(player), result)
+
+    def _record(self, stats, result):
+        hit = result.get("hit")
+        stats.record(hit, result.get("reaction_us") if hit else None, result.get("hit_value", 0))
+        self.version += 1
+
+    def reset_players(self):
+        """Start a fresh leaderboard (target stats are kept)"""
+        self.players = {}
+        self.version += 1
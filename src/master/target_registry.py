@@ -0,0 +1,213 @@
+# target_registry.py - Indexed registry of the targets known to the master
+#
+# Every target owns a small integer slot for as long as it stays registered.
+# The slot doubles as its wire index (binary frame headers, broadcast masks),
+# and per-target state lives in flat per-slot arrays instead of a dict per
+# target:
+#
+#   names[i]      target name, None while the slot is free
+#   ips[i]        last known IP
+#   states[i]     STATE_* below (bytearray)
+#   last_seen[i]  master ticks_ms of the last message heard from it
+#   rtt_us[i]     smoothed command round trip, 0 until measured
+#   failures[i]   consecutive failed commands (saturates at 255)
+#   successes[i]  consecutive successes, for leaving the dead state
+#
+# States move with hysteresis: SUSPECT_AFTER straight failures make a target
+# suspect and DEAD_AFTER make it dead; any success clears suspicion, but a
+# dead target needs RECOVER_AFTER successes in a row to count as healthy.
+#
+# Lookups by name, index or IP are O(1). Readers that need a list of names
+# (the GUI dropdown, fan-out) get one cached copy that is only rebuilt when
+# a target joins or leaves.
+
+import time
+from array import array
+
+STATE_HEALTHY = 0
+STATE_SUSPECT = 1
+STATE_DEAD = 2
+
+STATE_NAMES = ("healthy", "suspect", "dead")
+
+SUSPECT_AFTER = 1
+DEAD_AFTER = 3
+RECOVER_AFTER = 2
+
+# RTT smoothing - new = old + (sample - old) / 2**RTT_SHIFT, as in TCP's SRTT
+RTT_SHIFT = 3
+
+
+class TargetRegistry:
+    """Slot-based target table with O(1) lookup by name, index or IP"""
+
+    def __init__(self):
+        self.names = []
+        self.ips = []
+        self.states = bytearray()
+        self.last_seen = array('i')
+        self.rtt_us = array('i')
+        self.failures = bytearray()
+        self.successes = bytearray()
+
+        self._by_name = {}  # name -> index
+        self._by_ip = {}    # ip -> index
+        self._count = 0
+        self._names_cache = None
+
+        # Bumped on every join/leave/move so readers can tell their copy is stale
+        self.version = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def __iter__(self):
+        """Iterate over registered target names in index order"""
+        for name in self.names:
+            if name is not None:
+                yield name
+
+    def add(self, name, ip, index=None):
+        """Register (or re-register) a target, returning its index
+
+        A known name keeps its index so wire indexes stay valid; a new one
+        takes the requested slot if it is free, else the lowest free slot.
+        """
+        known = self._by_name.get(name)
+        if known is None:
+            index = self._free_slot(index)
+            self.names[index] = name
+            self._by_name[name] = index
+            self._count += 1
+            self._changed()
+        else:
+            index = known
+            old_ip = self.ips[index]
+            if old_ip != ip:
+                if self._by_ip.get(old_ip) == index:
+                    del self._by_ip[old_ip]
+                self._changed()
+
+        self.ips[index] = ip
+        self._by_ip[ip] = index
+        self.states[index] = STATE_HEALTHY
+        self.last_seen[index] = time.ticks_ms()
+        self.failures[index] = 0
+        self.successes[index] = 0
+        return index
+
+    def _free_slot(self, wanted=None):
+        if wanted is not None:
+            while len(self.names) <= wanted:
+                self._grow()
+            if self.names[wanted] is None:
+                return wanted
+        for index, name in enumerate(self.names):
+            if name is None:
+                return index
+        self._grow()
+        return len(self.names) - 1
+
+    def _grow(self):
+        self.names.append(None)
+        self.ips.append(None)
+        self.states.append(STATE_HEALTHY)
+        self.last_seen.append(0)
+        self.rtt_us.append(0)
+        self.failures.append(0)
+        self.successes.append(0)
+
+    def remove(self, name):
+        """Free a target's slot, returning its last IP (None if unknown)"""
+        index = self._by_name.pop(name, None)
+        if index is None:
+            return None
+        ip = self.ips[index]
+        if self._by_ip.get(ip) == index:
+            del self._by_ip[ip]
+        self.names[index] = None
+        self.ips[index] = None
+        self.rtt_us[index] = 0
+        self._count -= 1
+        self._changed()
+        return ip
+
+    def _changed(self):
+        self._names_cache = None
+        self.version += 1
+
+    def names_list(self):
+        """Registered names in index order - a shared copy, don't modify it"""
+        if self._names_cache is None:
+            self._names_cache = [name for name in self.names if name is not None]
+        return self._names_cache
+
+    # Lookups
+
+    def index_of(self, name):
+        return self._by_name.get(name)
+
+    def index_by_ip(self, ip):
+        return self._by_ip.get(ip)
+
+    def name_at(self, index):
+        return self.names[index] if 0 <= index < len(self.names) else None
+
+    def ip_of(self, name):
+        index = self._by_name.get(name)
+        return None if index is None else self.ips[index]
+
+    # Health bookkeeping
+
+    def mark_seen(self, index):
+        """Anything heard from a target counts as a success"""
+        self.last_seen[index] = time.ticks_ms()
+        self.failures[index] = 0
+        successes = self.successes[index]
+        if successes < 255:
+            successes += 1
+            self.successes[index] = successes
+        if self.states[index] != STATE_DEAD or successes >= RECOVER_AFTER:
+            self.states[index] = STATE_HEALTHY
+
+    def record_rtt(self, index, rtt_us):
+        """Fold a measured round trip into the target's smoothed RTT"""
+        self.mark_seen(index)
+        current = self.rtt_us[index]
+        if current == 0:
+            self.rtt_us[index] = rtt_us
+        else:
+            self.rtt_us[index] = current + ((rtt_us - current) >> RTT_SHIFT)
+
+    def record_failure(self, index):
+        """Count a failed command, returning the consecutive failure count"""
+        self.successes[index] = 0
+        failures = self.failures[index]
+        if failures < 255:
+            failures += 1
+            self.failures[index] = failures
+        if failures >= DEAD_AFTER:
+            self.states[index] = STATE_DEAD
+        elif failures >= SUSPECT_AFTER and self.states[index] == STATE_HEALTHY:
+            self.states[index] = STATE_SUSPECT
+        return failures
+
+    def seen_ms_ago(self, index):
+        return time.ticks_diff(time.ticks_ms(), self.last_seen[index])
+
+    def info(self, name):
+        """Snapshot of one target's slot as a dict (for display and logging)"""
+        index = self._by_name.get(name)
+        if index is None:
+            return None
+        return {
+            "index": index,
+            "ip": self.ips[index],
+            "state": STATE_NAMES[self.states[index]],
+            "seen_ms_ago": self.seen_ms_ago(index),
+            "rtt_us": self.rtt_us[index],
+            "failures": self.failures[index],
+        }
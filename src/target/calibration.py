@@ -0,0 +1,158 @@
+# calibration.py - Piezo noise-floor calibration
+#
+# A threshold tuned on the bench misfires outdoors: wind on the plate, a
+# different mount or a noisier supply all move the noise. measure_noise()
+# measures it on the target itself, in two phases through the same
+# PiezoSampler ring the hit detector reads:
+#
+#   idle    the target holds still for idle_ms - the baseline, the sample
+#           standard deviation and the 99th percentile deviation give the
+#           everyday noise
+#   motion  the servo goes up and down `cycles` times - the 99th percentile
+#           deviation from the idle baseline is the vibration a moving (or
+#           just settled) target adds. Its one-sample current glitches land
+#           in the top 1% and are the energy check's job, not the threshold's
+#
+# thresholds() turns those into a hit_threshold well clear of both, and a
+# noise_floor for HitDetector's energy integral. measure_travel() then times
+# the servo's stroke by the same piezo: the arm shakes the plate until it
+# comes to rest, so the last sample above the noise marks its arrival. The
+# caller stores all of it in the device_id.json overlay
+# (PeripheralController.calibrate), so it survives a reboot and stays per
+# target.
+
+import uasyncio
+from utils.stats import RunningStats, P2Quantile
+from target.piezo_sampler import COUNT_MASK
+from target.servo_motion import RAISED, LOWERED
+
+MIN_THRESHOLD = 3000  # Below this, ADC noise alone would open candidates
+MAX_THRESHOLD = 40000  # Above this a real hit could never reach it - something was wrong
+MIN_FLOOR = 200
+MIN_TRAVEL_MS = 100  # Quicker than any hobby servo - the vibration was missed
+SETTLED_MS = 100  # Quiet this long before the window closes, or the arm never settled
+
+
+class NoiseCollector:
+    """Sample statistics, fed from the ring like a detector (see PiezoSampler.scan)"""
+
+    def __init__(self, reference):
+        self.reference = reference  # Deviations are measured from here
+        self.samples = RunningStats()
+        self.deviation = P2Quantile(0.99)
+        self.detected = False  # Never - scan() just keeps feeding us
+
+    def feed(self, ring, start, end):
+        mask = len(ring) - 1  # Power-of-two ring, see PiezoSampler
+        samples = self.samples
+        deviation = self.deviation
+        reference = self.reference
+        n = start
+        while n != end:
+            sample = ring[n & mask]
+            samples.add(sample)
+            deviation.add(abs(sample - reference))
+            n = (n + 1) & COUNT_MASK
+        return n
+
+
+class SettleCollector:
+    """Remembers the last sample further than level from the reference - when the arm came to rest"""
+
+    def __init__(self, reference, level):
+        self.reference = reference
+        self.level = level
+        self.last = None  # Sample count, None while nothing has moved
+        self.detected = False
+
+    def feed(self, ring, start, end):
+        mask = len(ring) - 1
+        reference = self.reference
+        level = self.level
+        n = start
+        while n != end:
+            if abs(ring[n & mask] - reference) > level:
+                self.last = n
+            n = (n + 1) & COUNT_MASK
+        return n
+
+
+async def _collect(sampler, collector, duration_ms, poll_ms=20):
+    """Feed everything sampled over duration_ms to collector"""
+    for _ in range(duration_ms // poll_ms):
+        await uasyncio.sleep_ms(poll_ms)
+        sampler.scan(collector)
+    sampler.scan(collector)
+    return collector
+
+
+async def measure_noise(peripheral, idle_ms=1500, cycles=2):
+    """Measure idle noise and servo vibration - returns the stats thresholds() needs"""
+    sampler = peripheral.sampler
+    sampler.discard()
+    await uasyncio.sleep_ms(50)  # A few samples to take the reference from
+    idle = NoiseCollector(sampler.mean())
+    sampler.discard()
+    await _collect(sampler, idle, idle_ms)
+
+    motion = NoiseCollector(int(idle.samples.mean))
+    sampler.discard()
+
+    async def move():
+        for _ in range(cycles):
+            await peripheral.raise_target()
+            await peripheral.lower_target()
+
+    task = uasyncio.create_task(move())
+    while not task.done():
+        await uasyncio.sleep_ms(20)
+        sampler.scan(motion)
+    sampler.scan(motion)
+
+    return {
+        "baseline": int(idle.samples.mean),
+        "idle_sd": int(idle.samples.stddev),
+        "idle_p99": int(idle.deviation.value or 0),
+        "motion_p99": int(motion.deviation.value or 0),
+        "samples": idle.samples.count + motion.samples.count,
+    }
+
+
+async def measure_travel(peripheral, baseline, level, max_ms=1500):
+    """Time a full stroke each way, target starting down - ms (the slower), or None if it can't tell
+
+    None when nothing moved above level, or when the vibration ran on to
+    the end of the window - a servo humming, jittering or straining against
+    its end stop never settles, and storing the window as the travel time
+    would make every move wait that long.
+    """
+    sampler = peripheral.sampler
+    motion = peripheral.motion
+    rate = sampler.rate_hz
+    slowest = 0
+    for angle in (RAISED, LOWERED):
+        collector = SettleCollector(baseline, level)
+        sampler.discard()
+        start = sampler.count
+        motion.move_to(angle, ease=False, ms=max_ms)  # Straight there, at the servo's own speed
+        await _collect(sampler, collector, max_ms)
+        await motion.arrived.wait()
+        if collector.last is None:
+            return None
+        quiet_ms = ((sampler.read_count - collector.last) & COUNT_MASK) * 1000 // rate
+        if quiet_ms < SETTLED_MS:
+            print(f"⚠️ Servo still shaking the plate {max_ms}ms after a move - not settling")
+            return None
+        slowest = max(slowest, ((collector.last - start) & COUNT_MASK) * 1000 // rate)
+    if slowest < MIN_TRAVEL_MS or slowest > max_ms - SETTLED_MS:
+        return None
+    return slowest
+
+
+def thresholds(stats):
+    """(hit_threshold, noise_floor, clamped) from measure_noise()'s stats"""
+    noise = max(stats["idle_p99"], 4 * stats["idle_sd"])
+    noise_floor = max(MIN_FLOOR, noise)
+    wanted = max(2 * stats["motion_p99"], 3 * noise)
+    hit_threshold = min(MAX_THRESHOLD, max(MIN_THRESHOLD, wanted))
+    return hit_threshold, min(noise_floor, hit_threshold // 2), wanted > MAX_THRESHOLD
@@ -0,0 +1,181 @@
+# hit_detector.py - Streaming hit detection over the piezo sample ring
+#
+# One raw reading against a fixed threshold is fooled both ways: a spike
+# that falls between reads is missed, and a drifting bias, servo vibration
+# or a one-sample glitch from the servo's current draw reads as a hit.
+# HitDetector runs over every sample PiezoSampler takes:
+#
+#   baseline    an integer moving average (1/2^baseline_shift per sample),
+#               frozen while a candidate is open so a hit can't drag it
+#   peak        a deviation from the baseline above peak_threshold opens a
+#               window of `window` samples and records the largest one
+#   floor       the mean deviation outside hits (its "spread") is tracked
+#               like the baseline; spread_factor times it, but never less
+#               than noise_floor, is the level vibration and ADC noise live
+#               under
+#   energy      deviations summed over the window. The decision only counts
+#               each sample's part between the floor and peak_threshold, so
+#               vibration adds nothing and one huge sample adds no more than
+#               a threshold-high one
+#   ringing     a hit rings for several samples, so at least min_samples of
+#               the window must also rise above the floor - two one- or
+#               two-sample glitches landing in the same window have the
+#               energy of a hit but not its length
+#   refractory  after a hit, refractory samples are ignored so its ringing
+#               (and the target falling) is never a second hit
+#
+# Seed reset() with the sampler's mean and mean deviation, so the floor
+# matches the vibration already present instead of growing into it.
+#
+# Everything is small-int arithmetic on locals, and feed() takes a whole run
+# of the ring per call rather than one call per sample.
+# tools/bench_hit_detector.py measures detection rate, false positives and
+# per-sample cost against the old single-threshold poll. On its synthetic
+# traces this finds every clean hit and 98-99% of light ones with no false
+# positives from vibration, glitches or drift. That is a measurement, not a
+# guarantee - a burst of glitches spread over min_samples samples still reads
+# as a hit.
+
+from target.piezo_sampler import COUNT_MASK
+
+
+class HitDetector:
+    """Baseline-removed peak + energy detector with a refractory period"""
+
+    def __init__(self, peak_threshold=10000, energy_threshold=None, window=16, refractory=300, baseline_shift=8, noise_floor=None, spread_factor=4, min_samples=6):
+        """
+        Args:
+            peak_threshold: Deviation from baseline that opens a candidate
+            energy_threshold: Clipped deviation sum over the window needed to
+                call it a hit (default two full-threshold samples' worth)
+            window: Samples integrated after the opening one (16 = 8ms at 2kHz)
+            refractory: Samples ignored after a hit (300 = 150ms at 2kHz)
+            baseline_shift: Baseline follows 1/2^shift of each new sample
+            noise_floor: Least deviation that counts for nothing towards the
+                energy (default a twentieth of peak_threshold)
+            spread_factor: The floor rises to this many times the mean
+                deviation, so it follows the vibration actually present
+            min_samples: Samples of the window, the opening one included,
+                that must rise above the floor
+        """
+        self.peak_threshold = peak_threshold
+        self.noise_floor = peak_threshold // 20 if noise_floor is None else noise_floor
+        self.energy_threshold = energy_threshold or 2 * peak_threshold
+        self.spread_factor = spread_factor
+        self.window = window
+        self.min_samples = min_samples
+        self.refractory = refractory
+        self.baseline_shift = baseline_shift
+        self._baseline_sum = 0  # baseline << baseline_shift
+        self._spread_sum = 0  # Mean deviation from baseline << baseline_shift
+        self.reset()
+
+        self.hits = 0
+        self.rejected = 0  # Candidates without the energy of a hit
+
+    def reset(self, baseline=None, spread=None):
+        """Drop any open candidate and refractory period, optionally re-seeding baseline and spread"""
+        if baseline is not None:
+            self._baseline_sum = baseline << self.baseline_shift
+        if spread is not None:
+            self._spread_sum = spread << self.baseline_shift
+        self._left = 0  # Samples left in the open window, 0 if none
+        self._quiet = 0  # Refractory samples left
+        self._peak = 0
+        self._energy = 0
+        self._clipped = 0
+        self._above = 0
+        self._start = 0
+        self.detected = False
+        self.hit_count = 0  # Sample count the last hit opened at
+        self.peak = 0  # Its peak deviation from baseline
+        self.energy = 0  # Its unclipped deviation sum
+
+    @property
+    def baseline(self):
+        return self._baseline_sum >> self.baseline_shift
+
+    @property
+    def spread(self):
+        """Mean deviation from the baseline outside hits - the noise level"""
+        return self._spread_sum >> self.baseline_shift
+
+    @property
+    def floor(self):
+        return max(self.noise_floor, self.spread * self.spread_factor)
+
+    def feed(self, ring, start, end):
+        """Run samples [start, end) - counts as PiezoSampler keeps them
+
+        Stops just after a hit is confirmed (setting detected, hit_count,
+        peak and energy) so the caller can act on it. Returns the count of
+        the next sample to feed.
+        """
+        mask = len(ring) - 1  # Power-of-two ring, see PiezoSampler
+        threshold = self.peak_threshold
+        shift = self.baseline_shift
+        baseline_sum = self._baseline_sum
+        baseline = baseline_sum >> shift
+        left = self._left
+        quiet = self._quiet
+        peak = self._peak
+        energy = self._energy
+        clipped = self._clipped
+        above = self._above
+        spread_sum = self._spread_sum
+        factor = self.spread_factor
+        floor = max(self.noise_floor, (spread_sum >> shift) * factor)
+
+        n = start
+        while n != end:
+            sample = ring[n & mask]
+            n = (n + 1) & COUNT_MASK
+            if quiet:
+                quiet -= 1
+                continue
+            deviation = sample - baseline
+            if deviation < 0:
+                deviation = -deviation
+            if left:
+                energy += deviation
+                if deviation > floor:
+                    clipped += deviation - floor if deviation < threshold else threshold - floor
+                    above += 1
+                if deviation > peak:
+                    peak = deviation
+                left -= 1
+                if left:
+                    continue
+                if clipped >= self.energy_threshold and above >= self.min_samples:
+                    self.hits += 1
+                    self.detected = True
+                    self.hit_count = self._start
+                    self.peak = peak
+                    self.energy = energy
+                    quiet = self.refractory
+                    break
+                self.rejected += 1
+            elif deviation > threshold:
+                self._start = (n - 1) & COUNT_MASK
+                left = self.window
+                peak = deviation
+                energy = deviation
+                clipped = threshold - floor
+                above = 1
+            else:
+                baseline_sum += sample - baseline
+                baseline = baseline_sum >> shift
+                spread_sum += deviation - (spread_sum >> shift)
+                floor = (spread_sum >> shift) * factor
+                if floor < self.noise_floor:
+                    floor = self.noise_floor
+
+        self._baseline_sum = baseline_sum
+        self._spread_sum = spread_sum
+        self._left = left
+        self._quiet = quiet
+        self._peak = peak
+        self._energy = energy
+        self._clipped = clipped
+        self._above = above
+        return n
@@ -1,5 +1,9 @@
 from machine import Pin, PWM, ADC
-import uasyncio
+from config.config import config
+from target.piezo_sampler import PiezoSampler, AdcSource
+from target.hit_detector import HitDetector
+from target.calibration import measure_noise, measure_travel, thresholds
+from target.servo_motion import ServoMotion, RAISED, LOWERED
 
 # Pin Assignments
 SERVO_PIN = 16
@@ -9,23 +13,6 @@ SERVO_FREQ = 50
 HIT_THRESHOLD = 10000
 
 
-def linear_interpolate(input, input_range, output_range):
-    """
-    Maps a value from one range to another proportionally.
-    
-    Args:
-        input: The value to convert
-        input_range: Tuple (min, max) of input range
-        output_range: Tuple (min, max) of output range
-    
-    Returns:
-        float: The interpolated value in the output range
-    """
-    input_min, input_max = input_range
-    output_min, output_max = output_range
-    return (input - input_min) * (output_max - output_min) / (input_max - input_min) + output_min
-
-
 class PeripheralController:
     """
     Controls target peripherals: servo motor for target positioning and piezo sensor for hit detection.
@@ -39,38 +26,50 @@ class PeripheralController:
             servo_pin: GPIO pin number for servo control
             piezo_pin: GPIO pin number for piezo sensor
             servo_freq: PWM frequency for servo control (default: 50Hz)
-            hit_threshold: ADC value threshold for hit detection (default: 10000)
+            hit_threshold: ADC value threshold for hit detection (default: 10000) -
+                a calibrated hit_threshold in the config overlay wins
         """
         self.servo_pin = servo_pin
         self.piezo_pin = piezo_pin
         self.servo_freq = servo_freq
-        self.hit_threshold = hit_threshold
+        self.hit_threshold = config.get('hit_threshold', hit_threshold)
         
         # Initialize hardware
         self.servo = PWM(Pin(self.servo_pin))
         self.servo.freq(self.servo_freq)
+        self.motion = ServoMotion(
+            self.servo,
+            self.servo_freq,
+            travel_ms=config.get('servo_travel_ms', 450),
+            settle_ms=config.get('servo_settle_ms', 50),
+            ease=config.get('servo_ease', False)
+        )
         self.piezo_in = ADC(Pin(self.piezo_pin))
-    
-    def _servo_write(self, angle_degrees):
-        """
-        Internal method to control servo position.
+        self.last_reading = 0  # Piezo value from the latest hit check
         
-        Args:
-            angle_degrees: Target angle (0-180 degrees)
-        """
-        pulse_width_ms = linear_interpolate(angle_degrees, (0, 180), (0.5, 2.5))
-        pwm_duty_cycle = int(linear_interpolate(pulse_width_ms, (0, 20), (0, 65535)))
-        self.servo.duty_u16(pwm_duty_cycle)
+        # Timer-driven sampling - hit_was_detected() polling is the fallback
+        # when piezo_sample_hz is 0
+        self.sampler = None
+        sample_hz = config.get('piezo_sample_hz', 2000)
+        if sample_hz:
+            self.sampler = PiezoSampler(AdcSource(self.piezo_in), sample_hz, config.get('piezo_ring_size', 512))
+            self.sampler.start()
+        self.detector = HitDetector(
+            peak_threshold=self.hit_threshold,
+            energy_threshold=config.get('hit_energy'),
+            noise_floor=config.get('hit_noise_floor'),
+            window=config.get('hit_window_ms', 8) * sample_hz // 1000,
+            refractory=config.get('hit_refractory_ms', 150) * sample_hz // 1000
+        )
     
     async def raise_target(self):
         """
         Raise target to upright position (90 degrees).
         
         Returns:
-            bool: True when movement is assumed complete (after 0.5s delay)
+            bool: True once the arm has arrived (see servo_motion.py)
         """
-        self._servo_write(90)
-        await uasyncio.sleep_ms(500)
+        await self.motion.move(RAISED)
         return True
     
     async def lower_target(self):
@@ -78,14 +77,53 @@ class PeripheralController:
         Lower target to down position (0 degrees).
         
         Returns:
-            bool: True when movement is assumed complete (after 0.5s delay)
+            bool: True once the arm has arrived (see servo_motion.py)
         """
-        self._servo_write(0)
-        await uasyncio.sleep_ms(500)
+        await self.motion.move(LOWERED)
         return True
     
+    def set_thresholds(self, hit_threshold, noise_floor):
+        """Use new detection thresholds from now on (e.g. after calibration)"""
+        self.hit_threshold = hit_threshold
+        detector = self.detector
+        detector.peak_threshold = hit_threshold
+        detector.noise_floor = noise_floor
+        detector.energy_threshold = config.get('hit_energy') or 2 * hit_threshold
+    
+    async def calibrate(self, save=True):
+        """Measure the piezo noise and derive this target's thresholds
+        
+        Also times the servo's stroke. Leaves the target down. Returns the
+        thresholds, travel time and the stats they came from; with save they
+        go to the device_id.json overlay too.
+        """
+        if not self.sampler:
+            raise RuntimeError("Calibration needs piezo sampling (piezo_sample_hz)")
+        stats = await measure_noise(self, config.get('calibrate_idle_ms', 1500), config.get('calibrate_cycles', 2))
+        hit_threshold, noise_floor, clamped = thresholds(stats)
+        self.set_thresholds(hit_threshold, noise_floor)
+        if clamped:
+            print(f"⚠️ Piezo noise too high for a usable threshold - clamped to {hit_threshold}")
+        print(f"🎚️ Calibrated: hit_threshold {hit_threshold}, noise_floor {noise_floor} ({stats})")
+        values = {"hit_threshold": hit_threshold, "hit_noise_floor": noise_floor}
+        
+        travel_ms = await measure_travel(self, stats["baseline"], 2 * noise_floor)
+        if travel_ms:
+            self.motion.travel_ms = travel_ms
+            values["servo_travel_ms"] = travel_ms
+            print(f"🎚️ Servo stroke takes {travel_ms}ms")
+        else:
+            print(f"⚠️ Servo travel not measurable from the piezo - keeping {self.motion.travel_ms}ms")
+        
+        if save:
+            config.save_device(values)
+        stats.update(hit_threshold=hit_threshold, noise_floor=noise_floor, clamped=clamped,
+                     travel_ms=self.motion.travel_ms)
+        return stats
+    
     def hit_was_detected(self):
         pot_value = self.piezo_in.read_u16()
+        self.last_reading = pot_value
         if pot_value > self.hit_threshold:
             return True
         return False
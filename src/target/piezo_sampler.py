@@ -0,0 +1,170 @@
+# piezo_sampler.py - Timer-driven piezo sampling into a ring buffer
+#
+# A piezo spike from a hit is over in a few milliseconds. Reading the ADC
+# from the activate loop every sleep_ms(10) misses spikes whenever the loop
+# is late - and with the socket server busy it often is. Here a hardware
+# timer reads the sample source at a fixed rate (piezo_sample_hz, default
+# 2kHz) into a preallocated array('H') ring, whatever the event loop is
+# doing, and the async side runs what has arrived since its last look
+# through a HitDetector (hit_detector.py).
+#
+# The timer callback runs as a hard IRQ where the port allows it, so it must
+# not allocate: it stores one sample, bumps a wrapping counter and stamps
+# ticks_us - all small ints. The consumer notices if it falls a whole ring
+# behind and skips to the oldest sample still there (counted in overruns).
+#
+# The ring length must be a power of two. Sample counts wrap at COUNT_MASK,
+# and count & (size - 1) only stays in step across that wrap when size
+# divides 2^30 - with any other size the slot sequence jumps at the wrap.
+#
+# Sources only need read() -> 0-65535, so the sampler can be fed a recorded
+# waveform (WaveformSource) and stepped by hand with tick() on a host.
+
+import time
+import uasyncio
+from array import array
+
+COUNT_MASK = 0x3FFFFFFF  # Wrap the sample counter before it leaves small-int range
+
+
+class AdcSource:
+    """Live piezo on a machine.ADC"""
+
+    def __init__(self, adc):
+        self.adc = adc
+        self.read = adc.read_u16  # Bound once - no allocation per sample
+
+
+class WaveformSource:
+    """Plays back recorded samples, then rests at the last one"""
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.position = 0
+
+    def read(self):
+        if self.position < len(self.samples):
+            self.position += 1
+        return self.samples[self.position - 1] if self.position else 0
+
+    def rewind(self):
+        self.position = 0
+
+
+class PiezoSampler:
+    """Fixed-rate sample ring with an async scanner"""
+
+    def __init__(self, source, rate_hz=2000, size=512):
+        """
+        Args:
+            source: Anything with read() -> 0-65535
+            rate_hz: Samples per second
+            size: Ring length, a power of two (512 at 2kHz keeps the last 256ms)
+        """
+        if size < 2 or size & (size - 1):
+            raise ValueError(f"Piezo ring size must be a power of two, not {size}")
+        self.source = source
+        self.rate_hz = rate_hz
+        self.period_us = 1000000 // rate_hz
+        self.size = size
+        self.mask = size - 1  # count & mask is the ring slot
+        self.ring = array('H', [0] * size)
+        self.count = 0  # Samples taken, wrapping at COUNT_MASK (IRQ writes)
+        self.last_us = 0  # ticks_us of the newest sample (IRQ writes)
+        self.read_count = 0  # Next sample the consumer will look at
+        self.overruns = 0
+        self.timer = None
+        self._tick_ref = self._tick  # Bound method made once, outside the IRQ
+
+    def _tick(self, timer):
+        count = self.count
+        self.ring[count & self.mask] = self.source.read()
+        self.last_us = time.ticks_us()
+        self.count = (count + 1) & COUNT_MASK
+
+    def tick(self, samples=1):
+        """Take samples now - stands in for the timer on a host"""
+        for _ in range(samples):
+            self._tick(None)
+
+    def start(self):
+        from machine import Timer
+        try:
+            self.timer = Timer(mode=Timer.PERIODIC, freq=self.rate_hz, callback=self._tick_ref, hard=True)
+        except TypeError:
+            # No hard timer IRQs on this port - a scheduled callback still beats polling
+            self.timer = Timer(mode=Timer.PERIODIC, freq=self.rate_hz, callback=self._tick_ref)
+        print(f"🎙️ Piezo sampling at {self.rate_hz}Hz ({self.size} sample ring)")
+
+    def stop(self):
+        if self.timer:
+            self.timer.deinit()
+            self.timer = None
+
+    # Consumer side
+
+    def discard(self):
+        """Forget everything sampled so far - e.g. the servo noise of a rise"""
+        self.read_count = self.count
+
+    def sample_us(self, sample_count):
+        """Local ticks_us a sample was taken at (within one sample period)"""
+        behind = (self.count - 1 - sample_count) & COUNT_MASK
+        return time.ticks_add(self.last_us, -behind * self.period_us)
+
+    def mean(self, samples=64):
+        """Average of the newest samples - e.g. to seed a detector's baseline"""
+        end = self.count
+        samples = min(samples, self.size, end) or 1
+        total = 0
+        for back in range(1, samples + 1):
+            total += self.ring[(end - back) & self.mask]
+        return total // samples
+
+    def mean_deviation(self, samples=64):
+        """Mean distance of the newest samples from their average - seeds a detector's spread"""
+        end = self.count
+        samples = min(samples, self.size, end) or 1
+        mean = self.mean(samples)
+        total = 0
+        for back in range(1, samples + 1):
+            deviation = self.ring[(end - back) & self.mask] - mean
+            total += deviation if deviation > 0 else -deviation
+        return total // samples
+
+    def scan(self, detector):
+        """Feed the samples since the last scan to a detector (see hit_detector.py)
+
+        Detectors index the ring with count & (len(ring) - 1).
+
+        Returns the sample count a hit started at, or None. Samples after
+        the hit are left for the next scan.
+        """
+        end = self.count
+        start = self.read_count
+        if (end - start) & COUNT_MASK > self.size:
+            # A whole ring went by unread - start from the oldest sample left
+            self.overruns += 1
+            start = (end - self.size) & COUNT_MASK
+        self.read_count = detector.feed(self.ring, start, end)
+        if detector.detected:
+            detector.detected = False
+            return detector.hit_count
+        return None
+
+    async def wait_for_hit(self, detector, timeout_ms, poll_ms=10, cancelled=None):
+        """Scan until a hit, the timeout or cancelled() - (ticks_us, peak, energy) or None
+
+        The timestamp is when the hit's first sample was taken, not when
+        this loop got round to seeing it.
+        """
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while True:
+            if cancelled and cancelled():
+                return None
+            hit = self.scan(detector)
+            if hit is not None:
+                return self.sample_us(hit), detector.peak, detector.energy
+            if time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+                return None
+            await uasyncio.sleep_ms(poll_ms)
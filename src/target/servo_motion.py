@@ -0,0 +1,147 @@
+# servo_motion.py - Servo moves from a duty lookup table, with an arrival event
+#
+# The old move worked out each duty with two float interpolations, then slept
+# a fixed 500ms whatever the distance - a target that was already up still
+# waited out the worst case, and a quick servo sat idle for most of it.
+#
+#   duty_table()  duty_u16 for every whole degree, worked out once in integer
+#                 arithmetic, so a move is a table lookup
+#   travel_ms     how long a full LOWERED <-> RAISED stroke takes to come to
+#                 rest, measured per device (calibration.measure_travel) and
+#                 scaled by the distance actually moved
+#   ease          optionally ramp the duty along a smoothstep curve, stepped
+#                 from a timer, so the arm starts and stops gently instead of
+#                 slamming the plate into its end stop
+#   arrived       a uasyncio.Event set when the move is done, so callers react
+#                 the moment the arm is there rather than after a fixed delay
+#
+# A new move supersedes one in progress; arrived then waits for the new one.
+
+import time
+import uasyncio
+from array import array
+
+LOWERED = 0
+RAISED = 90
+EASE_STEPS = 32  # Duty updates per eased move
+
+
+def duty_table(freq=50, min_us=500, max_us=2500, degrees=180):
+    """duty_u16 per whole degree for a servo taking min_us..max_us pulses"""
+    period_us = 1000000 // freq
+    table = array('H', [0] * (degrees + 1))
+    for angle in range(degrees + 1):
+        pulse_us = min_us + (max_us - min_us) * angle // degrees
+        table[angle] = pulse_us * 65535 // period_us
+    return table
+
+
+def ease_curve(steps=EASE_STEPS):
+    """Smoothstep progress (0-1024) after each of `steps` steps"""
+    cube = steps * steps * steps
+    return array('H', [(3 * steps - 2 * i) * i * i * 1024 // cube for i in range(steps + 1)])
+
+
+class ServoMotion:
+    """Moves a PWM servo and tells the caller when it has arrived"""
+
+    def __init__(self, pwm, freq=50, travel_ms=450, settle_ms=50, ease=False):
+        """
+        Args:
+            pwm: machine.PWM driving the servo, already at freq
+            freq: PWM frequency, for the duty table
+            travel_ms: Full LOWERED <-> RAISED stroke at the servo's own speed
+            settle_ms: Added to every move for the arm to stop ringing
+            ease: Ramp moves along a smoothstep curve by default
+        """
+        self.pwm = pwm
+        self.duty = duty_table(freq)
+        self.travel_ms = travel_ms
+        self.settle_ms = settle_ms
+        self.ease = ease
+        self.angle = None  # Last angle commanded, None until the first move
+        self.arrived = uasyncio.Event()
+        self.timer = None
+        self._curve = ease_curve()
+        self._duty = None  # Duty last written (the ramp timer writes), None if unknown
+        self._from = 0
+        self._delta = 0
+        self._step = 0
+        self._move = 0  # Bumped per move so a superseded one never sets arrived
+        self._step_ref = self._ramp_step  # Bound method made once, outside the callback
+
+    def _ramp_step(self, timer):
+        step = self._step + 1
+        self._step = step
+        duty = self._from + (self._delta * self._curve[step] >> 10)
+        self.pwm.duty_u16(duty)
+        self._duty = duty
+        if step >= EASE_STEPS:
+            timer.deinit()
+
+    def _stop_ramp(self):
+        if self.timer:
+            self.timer.deinit()
+
+    def move_to(self, angle, ease=None, ms=None):
+        """Start moving to angle (whole degrees) - returns the ms until arrived is set
+
+        Args:
+            ease: Override the default ramping for this move
+            ms: Override the travel time (e.g. to time the servo itself) -
+                used as is, with no settle_ms added
+        """
+        target = self.duty[angle]
+        self._stop_ramp()
+        current = self._duty
+        if ms is None:
+            stroke = abs(self.duty[RAISED] - self.duty[LOWERED]) or 1
+            distance = stroke if current is None else min(stroke, abs(target - current))
+            ramp_ms = self.travel_ms * distance // stroke
+            if ramp_ms and (self.ease if ease is None else ease):
+                # Smoothstep peaks at 1.5x the average speed - stretch it so
+                # the middle of the ramp is no faster than the servo can go
+                ramp_ms = ramp_ms * 3 // 2
+            ms = ramp_ms + self.settle_ms if ramp_ms else 0
+        else:
+            ramp_ms = ms  # An override is all travel - there is no settle to take off
+
+        self.angle = angle
+        self._move += 1
+        self.arrived.clear()
+        if current is not None and (self.ease if ease is None else ease) and ramp_ms >= EASE_STEPS:
+            self._from = current
+            self._delta = target - current
+            self._step = 0
+            from machine import Timer
+            if self.timer is None:
+                self.timer = Timer()
+            # The ramp takes the travel time, then any settle_ms runs as usual
+            self.timer.init(mode=Timer.PERIODIC, period=max(1, ramp_ms // EASE_STEPS),
+                            callback=self._step_ref)
+        else:
+            self.pwm.duty_u16(target)
+            self._duty = target
+
+        if ms:
+            uasyncio.create_task(self._arrive(self._move, ms))
+        else:
+            self.arrived.set()  # Already there
+        return ms
+
+    async def _arrive(self, move, ms):
+        await uasyncio.sleep_ms(ms)
+        if move == self._move:
+            if self._duty != self.duty[self.angle]:
+                # The ramp timer ran late - land exactly where we were sent
+                self._stop_ramp()
+                self.pwm.duty_u16(self.duty[self.angle])
+                self._duty = self.duty[self.angle]
+            self.arrived.set()
+
+    async def move(self, angle, ease=None):
+        """Move to angle and wait until the arm has arrived"""
+        started = time.ticks_ms()
+        self.move_to(angle, ease)
+        await self.arrived.wait()
+        return time.ticks_diff(time.ticks_ms(), started)
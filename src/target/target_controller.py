@@ -1,7 +1,10 @@
 import uasyncio
 from config.config import config
 import time
-from target.target_events import target_event_queue, HTTP_COMMAND_UP, HTTP_COMMAND_DOWN, HTTP_COMMAND_ACTIVATE
+from target.target_events import target_event_queue, HTTP_COMMAND_UP, HTTP_COMMAND_DOWN, HTTP_COMMAND_ACTIVATE, HTTP_COMMAND_CALIBRATE
+
+# A start further out than this is treated as bogus (e.g. a stale clock estimate)
+MAX_SCHEDULE_US = 60_000_000
 
 class TargetController:
     """Target Controller class. Executive component that manages target state and coordinates subordinate components."""
@@ -34,13 +37,37 @@ class TargetController:
             print(f"🎯 Target {self.id} laying down - taking cover!")
         elif event.type == HTTP_COMMAND_ACTIVATE:
             duration = event.data.get('duration', 5)
-            await self.activate(duration)
+            await self.activate(duration, event.data.get('start_us'), event.data.get('activation'))
+        elif event.type == HTTP_COMMAND_CALIBRATE:
+            await self.calibrate(event.data)
         else:
             print(f"⚠️  Unknown event type: {event.type}")
     
     
-    async def activate(self, duration):
-        """Activate target with hit detection polling"""
+    async def wait_until(self, start_us):
+        """Sleep until local ticks_us reaches start_us (returns at once if it has passed)"""
+        remaining = time.ticks_diff(start_us, time.ticks_us())
+        if remaining > MAX_SCHEDULE_US:
+            print(f"⚠️  Target {self.id} start time is {remaining // 1000}ms away - starting now")
+            return
+        if remaining < 0:
+            print(f"⚠️  Target {self.id} start time passed {-remaining // 1000}ms ago - starting now")
+            return
+        # Coarse sleep, then yield until the exact tick so other tasks keep running
+        if remaining > 2000:
+            await uasyncio.sleep_ms(remaining // 1000 - 1)
+        while time.ticks_diff(start_us, time.ticks_us()) > 0:
+            await uasyncio.sleep_ms(0)
+    
+    async def activate(self, duration, start_us=None, activation=None):
+        """Activate target with hit detection polling
+        
+        With start_us (local ticks_us) the target stays down until that
+        instant, so a round of targets scheduled together rises together.
+        activation is the master's ID for this command, echoed in the result.
+        """
+        if start_us is not None:
+            await self.wait_until(start_us)
         print(f"🎯 Target {self.id} activated for {duration} seconds - let the games begin!")
         
         self.is_active = True
@@ -51,30 +78,74 @@ class TargetController:
         self.is_standing = True
         
         start_time = time.time()
+        raised_us = time.ticks_us()
+        end_us = None
+        intensity = 0
+        
+        sampler = self.peripheral_controller.sampler
+        if sampler:
+            # The timer has been filling the ring all along - scan it from
+            # here on, timestamping the hit with its first sample
+            detector = self.peripheral_controller.detector
+            sampler.discard()
+            detector.reset(sampler.mean(), sampler.mean_deviation())
+            hit = await sampler.wait_for_hit(detector, duration * 1000, cancelled=lambda: self.hit_detected)
+            if hit:
+                end_us, intensity, energy = hit
+                self.peripheral_controller.last_reading = intensity
+                self.hit_detected = True
+                print(f"💥 HIT DETECTED on target {self.id}! (peak {intensity}, energy {energy})")
         
         # Poll for hits until timeout or hit detected
-        while time.time() - start_time < duration and not self.hit_detected:
+        while not sampler and time.time() - start_time < duration and not self.hit_detected:
             if self.peripheral_controller.hit_was_detected():
+                end_us = time.ticks_us()
+                intensity = self.peripheral_controller.last_reading
                 self.hit_detected = True
                 print(f"💥 HIT DETECTED on target {self.id}!")
                 break
             await uasyncio.sleep_ms(10)  # 100Hz polling
         
-        # Lower target and report result
+        if end_us is None:
+            # Timed out (or a simulated hit) - stamp it now
+            end_us = time.ticks_us()
+        
+        # Push the result before lowering so the master scores it immediately
+        hit_value = self.hit_value if self.hit_detected else 0
+        await self.target_server.report_result(
+            hit_value,
+            ticks_us=end_us,
+            reaction_us=time.ticks_diff(end_us, raised_us),
+            intensity=intensity,
+            activation=activation
+        )
+        
+        # Lower target
         await self.peripheral_controller.lower_target()
         self.is_standing = False
         
-        hit_value = 1 if self.hit_detected else 0
         if self.hit_detected:
-            print(f"🎯 Target {self.id} hit! Reporting success.")
+            print(f"🎯 Target {self.id} hit! Reported success.")
         else:
             print(f"⏰ Target {self.id} timeout - no hit detected")
-            
-        await self.target_server.report_result(hit_value)
         
         self.is_active = False
         print(f"🎯 Target {self.id} deactivated")
     
+    async def calibrate(self, request):
+        """Recalibrate the piezo thresholds, handing the outcome back to the server"""
+        print(f"🎚️ Target {self.id} calibrating - hold still!")
+        was_standing = self.is_standing
+        try:
+            request['result'] = await self.peripheral_controller.calibrate()
+        except Exception as e:
+            request['result'] = {"error": str(e)}
+        self.is_standing = False  # Calibration leaves the target down
+        if was_standing:
+            await self.peripheral_controller.raise_target()
+            self.is_standing = True
+        request['done'].set()
+    
     async def simulate_hit(self):
         """Simulate a hit for testing purposes"""
         if self.is_active and not self.hit_detected:
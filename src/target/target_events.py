@@ -1,4 +1,5 @@
 import uasyncio
+from config.config import config
 
 class TargetEvent:
     """Event object for target system communication"""
@@ -9,32 +10,95 @@ class TargetEvent:
     def __repr__(self):
         return f"TargetEvent(type='{self.type}', data={self.data})"
 
-class SimpleQueue:
-    """Simple async queue implementation for MicroPython"""
-    def __init__(self):
-        self._queue = []
-        self._event = uasyncio.Event()
+class QueueFull(Exception):
+    """No room left for the event - the caller reports it rather than waiting"""
+    pass
+
+PRIORITY_NORMAL = 0
+PRIORITY_URGENT = 1  # Overtakes everything pending at PRIORITY_NORMAL
+
+class EventQueue:
+    """Fixed-capacity async FIFO of TargetEvents, with priority levels and coalescing
+
+    Each priority level is a preallocated ring, so put and get are O(1) and
+    never grow the heap. get() takes from the most urgent non-empty level,
+    FIFO within it. An event whose type is in `coalesce` replaces the newest
+    pending event of its level if that one's type is in `coalesce` too - a
+    lay_down queued straight behind a stand_up that hasn't run yet makes the
+    stand_up pointless. Only the newest event is looked at, so nothing ever
+    jumps an event queued between them (e.g. an activation).
+    """
+    def __init__(self, capacity=16, levels=2, coalesce=()):
+        self.capacity = capacity
+        self._slots = [[None] * capacity for _ in range(levels)]
+        self._heads = [0] * levels
+        self._counts = [0] * levels
+        self._count = 0
+        self._coalesce = coalesce
+        self._event = uasyncio.Event()  # Set while anything is pending
+        self.coalesced = 0
     
-    async def put(self, item):
-        """Put an item into the queue"""
-        self._queue.append(item)
+    def __len__(self):
+        return self._count
+    
+    def put_nowait(self, item, priority=PRIORITY_NORMAL):
+        """Queue an event, raising QueueFull if its level has no room"""
+        slots = self._slots[priority]
+        count = self._counts[priority]
+        capacity = self.capacity
+        if count and item.type in self._coalesce:
+            newest = (self._heads[priority] + count - 1) % capacity
+            if slots[newest].type in self._coalesce:
+                slots[newest] = item
+                self.coalesced += 1
+                return
+        if count == capacity:
+            raise QueueFull(f"Event queue full ({capacity} pending)")
+        slots[(self._heads[priority] + count) % capacity] = item
+        self._counts[priority] = count + 1
+        self._count += 1
         self._event.set()
-        self._event.clear()
+    
+    async def put(self, item, priority=PRIORITY_NORMAL):
+        """Put an item into the queue (see put_nowait)"""
+        self.put_nowait(item, priority)
+    
+    def get_nowait(self):
+        """The next event, or None if nothing is pending"""
+        if not self._count:
+            return None
+        level = len(self._counts) - 1
+        while not self._counts[level]:
+            level -= 1
+        slots = self._slots[level]
+        head = self._heads[level]
+        item = slots[head]
+        slots[head] = None  # Don't keep the event's data alive
+        self._heads[level] = (head + 1) % self.capacity
+        self._counts[level] -= 1
+        self._count -= 1
+        return item
     
     async def get(self):
         """Get an item from the queue, waiting if necessary"""
-        while not self._queue:
+        while not self._count:
+            # Cleared only here, with the queue seen empty - a put from now on wakes us
+            self._event.clear()
             await self._event.wait()
-        return self._queue.pop(0)
+        return self.get_nowait()
     
     def task_done(self):
-        """Compatibility method - no-op for our simple implementation"""
+        """Compatibility method - nothing to track"""
         pass
 
 # Event Types - Server → Controller Events
 HTTP_COMMAND_UP = "http_command_up"
 HTTP_COMMAND_DOWN = "http_command_down"  
 HTTP_COMMAND_ACTIVATE = "http_command_activate"
+HTTP_COMMAND_CALIBRATE = "http_command_calibrate"  # data: {"done": Event}, "result" filled in
 
-# Global event queue for target system
-target_event_queue = SimpleQueue()
\ No newline at end of file
+# Global event queue for target system - a newer up/down replaces a pending one
+target_event_queue = EventQueue(
+    capacity=config.get('event_queue_size', 16),
+    coalesce=(HTTP_COMMAND_UP, HTTP_COMMAND_DOWN)
+)
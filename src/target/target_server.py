@@ -1,10 +1,14 @@
 import network
+import socket
 import time
 import uasyncio
 from config.config import config
 from utils.helpers import reset_network_interface
-from target.target_events import target_event_queue, TargetEvent, HTTP_COMMAND_UP, HTTP_COMMAND_DOWN, HTTP_COMMAND_ACTIVATE
-from utils.socket_protocol import SocketMessage, SocketServer
+from target.target_events import target_event_queue, TargetEvent, HTTP_COMMAND_UP, HTTP_COMMAND_DOWN, HTTP_COMMAND_ACTIVATE, HTTP_COMMAND_CALIBRATE
+from utils.socket_protocol import SocketMessage, SocketServer, ResponseTemplate, binary_codec, preferred_codecs, CODEC_JSON, CODEC_BINARY
+from utils.wire_codec import NO_TARGET
+from utils.broadcast import (BroadcastListener, parse_beacon, parse_hello, pack_hello, subnet_broadcast_ip,
+                             BEACON_MARKER, ANNOUNCE_MARKER, WELCOME_MARKER, FLAG_BINARY)
 
 async def connect_to_wifi(ssid, password):
     """Connect to the master's WiFi AP - time to join the network, brother!"""
@@ -39,29 +43,56 @@ async def connect_to_wifi(ssid, password):
         print(f'📡 Connected to {ssid}! IP: {wlan.ifconfig()[0]}')
         return wlan.ifconfig()[0]
 
+# Payloads of the fixed-shape replies, compiled into ResponseTemplates on first use
+REPLY_DATA = {
+    "PONG": {"status": "alive", "message": "Target reporting for duty!"},
+    "STANDING": {"status": "command_queued", "message": "Stand up command queued"},
+    "DOWN": {"status": "command_queued", "message": "Lay down command queued"},
+    "ACTIVATED": {"status": "activation_queued", "message": "Activation command queued"},
+}
+
 class TargetServer(SocketServer):
     """Target server - ready to serve and protect this digital battlefield!"""
     
     def __init__(self):
-        # Initialize parent SocketServer with port
-        super().__init__(config.port)
+        # Initialize parent SocketServer with port. Master connections are
+        # persistent, so reap any left open by a master that went away.
+        super().__init__(
+            config.port,
+            client_idle_timeout=config.get('client_idle_timeout', 120),
+            max_clients=config.get('max_clients', 4)
+        )
         
         self.node_id = config.get('node_id', 'target_unknown')
+        
+        # Compiled replies - keyed by type, or by duration for ACTIVATED
+        self._templates = {}
+        
+        # Last time the master talked to us - beacons, clock sync and
+        # heartbeats keep this fresh, so a long silence means the master is gone
+        self.last_master_ms = time.ticks_ms()
+        
+        # Where the master is - config until a beacon says otherwise
+        self.master_ip = config.server_ip
+        self.master_port = config.port
+        self.master_epoch = 0  # Boot epoch of the master we're registered with, 0 if none
+        self.listener = None
+        self._welcomed = uasyncio.Event()
     
 
     async def register_with_master_socket(self):
         """Register this target with the master server using socket protocol"""
-        master_ip = config.server_ip
-        socket_port = config.port
+        master_ip = self.master_ip
+        socket_port = self.master_port
         
         try:
             print(f"🔌 Socket registering with master at {master_ip}:{socket_port}")
             
-            # Create registration message
+            # Create registration message, offering our wire codecs
             register_msg = SocketMessage(
                 "REGISTER",
                 target_id=self.node_id,
-                data={"client_id": self.node_id}
+                data={"client_id": self.node_id, "codecs": preferred_codecs()}
             )
             
             # Use inherited send_message method
@@ -76,7 +107,14 @@ class TargetServer(SocketServer):
             
             # Check response
             if response_message.type == "registered":
-                print(f"✅ Successfully socket-registered target {self.node_id} with master!")
+                # Adopt the codec and wire index the master picked for us
+                codec = response_message.data.get("codec", CODEC_JSON)
+                self.peer_codecs[master_ip] = codec
+                binary_codec.bind_target(self.node_id, response_message.data.get("index"))
+                self.master_epoch = response_message.data.get("epoch", 0)
+                if self.listener:
+                    self.listener.set_epoch(self.master_epoch)
+                print(f"✅ Successfully socket-registered target {self.node_id} with master! ({codec} framing)")
                 return True
             elif response_message.type == "error":
                 error_msg = response_message.data.get("error", "Unknown error")
@@ -91,12 +129,145 @@ class TargetServer(SocketServer):
             return False
 
 
+    async def report_result(self, hit_value, ticks_us, reaction_us, intensity=0, activation=None):
+        """Push an activation result to the master on our persistent stream
+        
+        Args:
+            hit_value: Points for the hit, 0 for a miss
+            ticks_us: Local time.ticks_us() of the hit (or of the timeout)
+            reaction_us: Microseconds from standing up to the hit/timeout
+            intensity: Piezo reading that triggered the hit
+            activation: ID the master tagged the ACTIVATE with, echoed back
+        """
+        data = {"ticks_us": ticks_us, "reaction_us": reaction_us}
+        if hit_value:
+            data["hit_value"] = hit_value
+            data["intensity"] = intensity
+        if activation is not None:
+            data["activation"] = activation
+        
+        result_msg = SocketMessage(
+            "HIT" if hit_value else "MISS",
+            target_id=self.node_id,
+            data=data
+        )
+        
+        print(f"📤 Pushing {result_msg.type.upper()} to master")
+        pushed = await self.push_message(result_msg, self.master_ip)
+        if not pushed:
+            self.master_lost()
+        return pushed
+
+    def master_lost(self):
+        """Have watch_master re-register on its next check"""
+        self.last_master_ms = time.ticks_add(time.ticks_ms(), -config.get('master_timeout_ms', 45000))
+
+    async def ensure_wifi(self, timeout_ms=15000):
+        """Rejoin the AP if the association dropped - no interface reset"""
+        wlan = network.WLAN(network.STA_IF)
+        if wlan.isconnected():
+            return True
+        print(f"📡 Lost association - reconnecting to {config.ssid}")
+        wlan.connect(config.ssid, config.password)
+        start = time.ticks_ms()
+        while not wlan.isconnected():
+            if time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                return False
+            await uasyncio.sleep_ms(250)
+        return True
+
+    async def watch_master(self):
+        """Re-register when the master goes quiet (e.g. it rebooted)
+        
+        Keeps the existing WiFi association instead of the full reset in
+        connect_to_wifi, so a master power blip costs seconds, not a restart.
+        """
+        timeout_ms = config.get('master_timeout_ms', 45000)
+        retry_ms = config.get('master_retry_ms', 3000)
+        while True:
+            await uasyncio.sleep_ms(1000)
+            if time.ticks_diff(time.ticks_ms(), self.last_master_ms) < timeout_ms:
+                continue
+            
+            print(f"👻 No word from master for {timeout_ms // 1000}s - re-registering")
+            if await self.ensure_wifi() and await self.join_master():
+                self.last_master_ms = time.ticks_ms()
+            else:
+                # Next attempt in retry_ms
+                self.last_master_ms = time.ticks_add(time.ticks_ms(), retry_ms - timeout_ms)
+
+    # Discovery - see broadcast.py for the datagrams
+
+    def _handle_discovery(self, data, addr):
+        """Beacon or welcome from the master, via the broadcast listener"""
+        if data[0] == BEACON_MARKER:
+            beacon = parse_beacon(data)
+            if beacon is None:
+                return
+            self.master_port, epoch = beacon
+            self.master_ip = addr[0]
+            self.listener.set_epoch(epoch)
+            self.last_master_ms = time.ticks_ms()
+            # Our answer is the liveness signal - and a registration request if
+            # the master rebooted (new epoch) since we last joined
+            self._announce(addr)
+            return
+
+        welcome = parse_hello(data, WELCOME_MARKER)
+        if welcome is None or welcome[0] != self.node_id:
+            return
+        _, index, flags, epoch = welcome
+        codec = CODEC_BINARY if flags & FLAG_BINARY else CODEC_JSON
+        self.master_ip = addr[0]
+        self.peer_codecs[self.master_ip] = codec
+        binary_codec.bind_target(self.node_id, index)
+        self.master_epoch = epoch
+        self.listener.set_epoch(epoch)
+        self.last_master_ms = time.ticks_ms()
+        print(f"✅ Joined master at {self.master_ip} by announce ({codec} framing, index {index})")
+        self._welcomed.set()
+
+    def _announce(self, addr):
+        index = binary_codec.target_indexes.get(self.node_id) if self.master_epoch else None
+        flags = FLAG_BINARY if CODEC_BINARY in preferred_codecs() else 0
+        announce = pack_hello(ANNOUNCE_MARKER, self.node_id, NO_TARGET if index is None else index,
+                              flags, self.master_epoch)
+        self.listener.sock.sendto(announce, addr)
+
+    async def join_by_announce(self, attempts=3, wait_ms=1000):
+        """Register with one announce/welcome round trip - no TCP handshake"""
+        while self.listener.sock is None:
+            await uasyncio.sleep_ms(10)
+        broadcast_ip = config.get('broadcast_ip', subnet_broadcast_ip(config.server_ip))
+        addr = socket.getaddrinfo(broadcast_ip, config.get('discovery_port', 4211))[0][-1]
+
+        self.master_epoch = 0  # Ask for a fresh welcome
+        self._welcomed.clear()
+        for _ in range(attempts):
+            print(f"🛰️ Announcing {self.node_id} to {broadcast_ip}")
+            self._announce(addr)
+            try:
+                await uasyncio.wait_for_ms(self._welcomed.wait(), wait_ms)
+                return True
+            except uasyncio.TimeoutError:
+                pass
+        return False
+
+    async def join_master(self):
+        """Register by announce when discovery is on, falling back to TCP"""
+        if self.listener and self.listener.on_discovery and await self.join_by_announce():
+            return True
+        return await self.register_with_master_socket()
+
     async def _handle_message(self, message, client_ip, writer):
         """Handle individual socket messages from master"""
         print(f"📥 Target received: {message.type} from master")
+        self.last_master_ms = time.ticks_ms()
         
         # Handle different message types
-        if message.type == "ping":
+        if message.type == "sync":
+            await self._handle_sync_command(message, writer)
+        elif message.type == "ping":
             await self._handle_ping_command(message, writer)
         elif message.type == "stand_up":
             await self._handle_stand_up_command(message, writer)
@@ -104,6 +275,8 @@ class TargetServer(SocketServer):
             await self._handle_lay_down_command(message, writer)
         elif message.type == "activate":
             await self._handle_activate_command(message, writer)
+        elif message.type == "calibrate":
+            await self._handle_calibrate_command(message, writer)
         else:
             # Send error for unsupported message types
             error_msg = SocketMessage(
@@ -112,8 +285,35 @@ class TargetServer(SocketServer):
                 target_id=self.node_id,
                 data={"error": f"Unsupported command: {message.type}"}
             )
-            writer.write(error_msg.to_line().encode('utf-8'))
-            await writer.drain()
+            await self.write_message(writer, error_msg, message.codec)
+
+    def _reply_template(self, msg_type, duration=None):
+        """Cached ResponseTemplate for a fixed-shape reply
+        
+        One template per reply type - ACTIVATED is rebuilt when the duration
+        changes, so master-chosen durations can't pile up templates in RAM.
+        A game keeps one duration, so that is rare.
+        """
+        template = self._templates.get(msg_type)
+        if template is None or template.target_id != self.node_id or template.data.get("duration") != duration:
+            data = REPLY_DATA[msg_type]
+            if duration is not None:
+                data = dict(data, duration=duration)
+            template = self._templates[msg_type] = ResponseTemplate(msg_type, self.node_id, data)
+        return template
+
+    async def _handle_sync_command(self, message, writer):
+        """Handle SYNC command from master - stamp receive and send times"""
+        # Stamp first - anything before t2 or after t3 counts against accuracy
+        t2 = time.ticks_us()
+        synced_msg = SocketMessage(
+            "SYNCED",
+            msg_id=message.id,
+            target_id=self.node_id,
+            data={"t1": message.data.get("t1"), "t2": t2}
+        )
+        synced_msg.data["t3"] = time.ticks_us()
+        await self.write_message(writer, synced_msg, message.codec)
 
     async def _handle_ping_command(self, message, writer):
         """Handle PING command from master"""
@@ -121,20 +321,8 @@ class TargetServer(SocketServer):
         
         try:
             # Send PONG response
-            pong_msg = SocketMessage(
-                "PONG",
-                msg_id=message.id,
-                target_id=self.node_id,
-                data={
-                    "status": "alive",
-                    "message": "Target reporting for duty!"
-                }
-            )
-            
-            response_line = pong_msg.to_line()
-            print(f"📤 Sending PONG: {response_line.strip()}")
-            writer.write(response_line.encode('utf-8'))
-            await writer.drain()
+            print("📤 Sending PONG: alive")
+            await self.write_template(writer, self._reply_template("PONG"), message.id, message.codec)
             
         except Exception as e:
             print(f"💥 Error sending PONG response: {e}")
@@ -145,8 +333,7 @@ class TargetServer(SocketServer):
                 target_id=self.node_id,
                 data={"error": str(e)}
             )
-            writer.write(error_msg.to_line().encode('utf-8'))
-            await writer.drain()
+            await self.write_message(writer, error_msg, message.codec)
 
     async def _handle_stand_up_command(self, message, writer):
         """Handle STAND_UP command from master"""
@@ -157,20 +344,8 @@ class TargetServer(SocketServer):
             await target_event_queue.put(TargetEvent(HTTP_COMMAND_UP))
             
             # Send STANDING response
-            standing_msg = SocketMessage(
-                "STANDING",
-                msg_id=message.id,
-                target_id=self.node_id,
-                data={
-                    "status": "command_queued",
-                    "message": "Stand up command queued"
-                }
-            )
-            
-            response_line = standing_msg.to_line()
-            print(f"📤 Sending STANDING: {response_line.strip()}")
-            writer.write(response_line.encode('utf-8'))
-            await writer.drain()
+            print("📤 Sending STANDING: command_queued")
+            await self.write_template(writer, self._reply_template("STANDING"), message.id, message.codec)
             
         except Exception as e:
             print(f"💥 Error processing STAND_UP command: {e}")
@@ -181,8 +356,7 @@ class TargetServer(SocketServer):
                 target_id=self.node_id,
                 data={"error": str(e)}
             )
-            writer.write(error_msg.to_line().encode('utf-8'))
-            await writer.drain()
+            await self.write_message(writer, error_msg, message.codec)
 
     async def _handle_lay_down_command(self, message, writer):
         """Handle LAY_DOWN command from master"""
@@ -193,20 +367,8 @@ class TargetServer(SocketServer):
             await target_event_queue.put(TargetEvent(HTTP_COMMAND_DOWN))
             
             # Send DOWN response
-            down_msg = SocketMessage(
-                "DOWN",
-                msg_id=message.id,
-                target_id=self.node_id,
-                data={
-                    "status": "command_queued",
-                    "message": "Lay down command queued"
-                }
-            )
-            
-            response_line = down_msg.to_line()
-            print(f"📤 Sending DOWN: {response_line.strip()}")
-            writer.write(response_line.encode('utf-8'))
-            await writer.drain()
+            print("📤 Sending DOWN: command_queued")
+            await self.write_template(writer, self._reply_template("DOWN"), message.id, message.codec)
             
         except Exception as e:
             print(f"💥 Error processing LAY_DOWN command: {e}")
@@ -217,11 +379,11 @@ class TargetServer(SocketServer):
                 target_id=self.node_id,
                 data={"error": str(e)}
             )
-            writer.write(error_msg.to_line().encode('utf-8'))
-            await writer.drain()
+            await self.write_message(writer, error_msg, message.codec)
 
     async def _handle_activate_command(self, message, writer):
         """Handle ACTIVATE command from master"""
+        received_us = time.ticks_us()
         print(f"⚡ Processing ACTIVATE command from master")
         
         try:
@@ -229,25 +391,25 @@ class TargetServer(SocketServer):
             duration = message.data.get("duration", 5)  # Default 5 seconds
             print(f"🎯 Target {self.node_id} received activate command for {duration} seconds")
             
+            # A scheduled activation names its start in our own ticks_us, or as
+            # a delay if the master has no clock estimate for us yet
+            event_data = {'duration': duration}
+            start_us = message.data.get("start_us")
+            delay_ms = message.data.get("delay_ms")
+            if start_us is None and delay_ms is not None:
+                start_us = time.ticks_add(received_us, delay_ms * 1000)
+            if start_us is not None:
+                event_data['start_us'] = start_us
+            activation = message.data.get("activation")
+            if activation is not None:
+                event_data['activation'] = activation
+            
             # Emit event to controller (same as HTTP route)
-            await target_event_queue.put(TargetEvent(HTTP_COMMAND_ACTIVATE, {'duration': duration}))
+            await target_event_queue.put(TargetEvent(HTTP_COMMAND_ACTIVATE, event_data))
             
             # Send ACTIVATED response
-            activated_msg = SocketMessage(
-                "ACTIVATED",
-                msg_id=message.id,
-                target_id=self.node_id,
-                data={
-                    "status": "activation_queued",
-                    "duration": duration,
-                    "message": "Activation command queued"
-                }
-            )
-            
-            response_line = activated_msg.to_line()
-            print(f"📤 Sending ACTIVATED: {response_line.strip()}")
-            writer.write(response_line.encode('utf-8'))
-            await writer.drain()
+            print("📤 Sending ACTIVATED: activation_queued")
+            await self.write_template(writer, self._reply_template("ACTIVATED", duration), message.id, message.codec)
             
         except Exception as e:
             print(f"💥 Error processing ACTIVATE command: {e}")
@@ -258,27 +420,73 @@ class TargetServer(SocketServer):
                 target_id=self.node_id,
                 data={"error": str(e)}
             )
-            writer.write(error_msg.to_line().encode('utf-8'))
-            await writer.drain()
+            await self.write_message(writer, error_msg, message.codec)
+
 
+    async def _handle_calibrate_command(self, message, writer):
+        """Handle CALIBRATE command from master
+        
+        Calibration takes seconds, so it runs in its own task and the reply
+        follows when it is done - replies are matched by ID, so pings on the
+        same stream are answered meanwhile.
+        """
+        print(f"🎚️ Processing CALIBRATE command from master")
+        uasyncio.create_task(self._calibrate_and_reply(message, writer))
+
+    async def _calibrate_and_reply(self, message, writer):
+        request = {'done': uasyncio.Event()}
+        try:
+            # Through the controller's queue, so it never overlaps an activation
+            await target_event_queue.put(TargetEvent(HTTP_COMMAND_CALIBRATE, request))
+            await uasyncio.wait_for_ms(request['done'].wait(), config.get('calibrate_timeout_ms', 15000))
+            result = request['result']
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            reply = SocketMessage(
+                "CALIBRATED",
+                msg_id=message.id,
+                target_id=self.node_id,
+                data={"status": "calibrated", "hit_threshold": result["hit_threshold"],
+                      "noise_floor": result["noise_floor"], "clamped": result["clamped"],
+                      "travel_ms": result["travel_ms"]}
+            )
+        except Exception as e:
+            print(f"💥 Calibration failed: {e}")
+            reply = SocketMessage(
+                "ERROR",
+                msg_id=message.id,
+                target_id=self.node_id,
+                data={"error": str(e) or "Calibration timed out"}
+            )
+        await self.write_message(writer, reply, message.codec)
 
     async def start_server(self, host='0.0.0.0', port=config.port):
         """Start the target server - time to get this party started!"""
         print(f"📡 Connecting to master WiFi: {config.ssid}")
         await connect_to_wifi(config.ssid, config.password)
         
-        print(f"🤝 Registering with master server...")
-        # Socket-only registration
-        socket_success = await self.register_with_master_socket()
-        if not socket_success:
-            print(f"💥 Socket registration failed - no HTTP fallback in socket-only mode")
-            raise RuntimeError("Target registration failed")
-        
         print(f"🎯 Target server {self.node_id} starting socket-only on {host}:{port}")
         
-        # Start socket server for incoming commands
+        # Start socket server for incoming commands - up before we register,
+        # so the master can reach us as soon as it knows us
         await self.start_socket_server(host)
         
+        # Broadcast commands run through the same handlers as socket commands,
+        # and the same socket hears the master's beacons
+        if config.get('broadcast', True):
+            on_discovery = self._handle_discovery if config.get('discovery', True) else None
+            self.listener = BroadcastListener(self.node_id, self._handle_message, on_discovery=on_discovery)
+            uasyncio.create_task(self.listener.run())
+        
+        print(f"🤝 Registering with master server...")
+        if not await self.join_master():
+            print(f"💥 Registration failed - by announce and by socket")
+            raise RuntimeError("Target registration failed")
+        
+        # Re-register on our own if the master reboots
+        self.last_master_ms = time.ticks_ms()
+        uasyncio.create_task(self.watch_master())
+        
         try:
             # Keep socket server running (no HTTP server)
             print(f"✅ Target running socket-only mode on port {port}")
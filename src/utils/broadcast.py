@@ -0,0 +1,365 @@
+# broadcast.py - UDP broadcast command channel for SNYPER
+#
+# One datagram on the AP subnet addresses any set of targets by bitmask:
+#
+#   offset  size  field
+#   0       1     marker (0xB5)
+#   1       1     mask length in bytes (N)
+#   2       N     target mask - bit i of byte i // 8 set means wire index i acts
+#   2+N     ...   one binary frame (see wire_codec.py) carrying the command
+#
+# Targets run the embedded command through their normal message handler and
+# unicast the usual binary reply frame back to the sender - that reply is the
+# ack. The master rebroadcasts with only the unacked bits still set until
+# every target has answered or the retries run out, so "all targets up" costs
+# one packet no matter how many targets there are.
+#
+# Targets remember the last command ID they executed and re-send the cached
+# reply when it is repeated, so a lost ack never runs a command twice.
+#
+# Discovery rides the same port. The master broadcasts a beacon every few
+# seconds and targets answer each one with an announce, unicast back to the
+# beacon's source; a target that is new, or whose registration belongs to an
+# older master epoch (the master rebooted), gets a welcome carrying its wire
+# index and codec. A booting target also sends one announce to the subnet
+# unprompted, so joining is a single announce/welcome round trip.
+#
+#   BEACON    0xB6, version, TCP port (u16), epoch (u32)
+#   ANNOUNCE  0xB7, version, wire index, flags, epoch (u32), name (utf-8)
+#   WELCOME   0xB8, version, wire index, codec, epoch (u32), name (utf-8)
+#
+# The announce carries the index and epoch the target last registered
+# under (NO_TARGET / 0 if none) and FLAG_BINARY if it speaks the binary
+# codec; the welcome's codec byte is FLAG_BINARY for binary, 0 for JSON.
+
+import socket
+import struct
+import time
+import uasyncio
+from config.config import config
+from utils.socket_protocol import SocketMessage, binary_codec
+from utils.wire_codec import FRAME_MARKER
+
+BROADCAST_MARKER = 0xB5
+BEACON_MARKER = 0xB6
+ANNOUNCE_MARKER = 0xB7
+WELCOME_MARKER = 0xB8
+MAX_DATAGRAM = 512
+
+DISCOVERY_VERSION = 1
+FLAG_BINARY = 0x01
+
+_BEACON_FORMAT = "<BBHI"
+_HELLO_FORMAT = "<BBBBI"  # Announce and welcome share a layout
+_HELLO_SIZE = 8
+
+
+def subnet_broadcast_ip(ip):
+    """Broadcast address of the /24 the given IP lives on (the AP subnet)"""
+    return ip.rsplit(".", 1)[0] + ".255"
+
+
+def open_udp_socket(port):
+    """Open a non-blocking UDP socket bound to port that may send broadcasts"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    so_broadcast = getattr(socket, "SO_BROADCAST", None)
+    if so_broadcast is not None:
+        sock.setsockopt(socket.SOL_SOCKET, so_broadcast, 1)
+    sock.bind(socket.getaddrinfo("0.0.0.0", port)[0][-1])
+    sock.setblocking(False)
+    return sock
+
+
+def receive_datagram(sock):
+    """Return (data, addr) if a datagram is waiting, else (None, None)"""
+    try:
+        return sock.recvfrom(MAX_DATAGRAM)
+    except OSError:
+        return None, None
+
+
+class _IORead:
+    """Awaitable that parks the task on uasyncio's IO queue until sock is readable"""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def __iter__(self):
+        yield uasyncio.core._io_queue.queue_read(self.sock)
+
+    __await__ = __iter__
+
+
+async def _readable(sock):
+    await _IORead(sock)
+
+
+async def wait_datagram(sock, timeout_ms=None):
+    """Wait for a datagram to arrive on sock, False if timeout_ms passed first
+
+    The event loop select.poll()s its IO queue between tasks, so the waiting
+    task is woken by the datagram itself rather than by a timer.
+    """
+    if timeout_ms is None:
+        await _readable(sock)
+        return True
+    try:
+        await uasyncio.wait_for_ms(_readable(sock), timeout_ms)
+        return True
+    except uasyncio.TimeoutError:
+        return False
+
+
+def build_mask(indexes):
+    """Bitmask bytes with the bit for every wire index set"""
+    mask = bytearray(max(indexes) // 8 + 1)
+    for index in indexes:
+        mask[index >> 3] |= 1 << (index & 7)
+    return mask
+
+
+def mask_has(datagram, index):
+    """Check a broadcast datagram's mask for a wire index"""
+    byte = index >> 3
+    return byte < datagram[1] and bool(datagram[2 + byte] & (1 << (index & 7)))
+
+
+def pack_beacon(port, epoch):
+    return struct.pack(_BEACON_FORMAT, BEACON_MARKER, DISCOVERY_VERSION, port, epoch)
+
+
+def parse_beacon(data):
+    """(port, epoch) from a beacon, None if it isn't one we understand"""
+    if len(data) < 8 or data[0] != BEACON_MARKER or data[1] != DISCOVERY_VERSION:
+        return None
+    return struct.unpack_from(_BEACON_FORMAT, data, 0)[2:]
+
+
+def pack_hello(marker, name, index, flags, epoch):
+    """Announce or welcome datagram"""
+    return struct.pack(_HELLO_FORMAT, marker, DISCOVERY_VERSION, index, flags, epoch) + name.encode('utf-8')
+
+
+def parse_hello(data, marker):
+    """(name, index, flags, epoch) from an announce/welcome, None if malformed"""
+    if len(data) <= _HELLO_SIZE or data[0] != marker or data[1] != DISCOVERY_VERSION:
+        return None
+    _, _, index, flags, epoch = struct.unpack_from(_HELLO_FORMAT, data, 0)
+    try:
+        name = str(bytes(data[_HELLO_SIZE:]), 'utf-8')
+    except UnicodeError:
+        return None
+    return name, index, flags, epoch
+
+
+class DatagramReply:
+    """Stream-writer stand-in that sends whatever a handler writes as one datagram"""
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.data = b""
+        self.sent = None
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        if self.data:
+            self.sock.sendto(self.data, self.addr)
+            self.sent = self.data
+            self.data = b""
+
+
+class BroadcastChannel:
+    """Master side - sends one datagram to many targets and collects their acks"""
+
+    def __init__(self, port=None, broadcast_ip=None, retries=3, retry_ms=40):
+        self.port = port or config.get('broadcast_port', 4210)
+        self.broadcast_ip = broadcast_ip or config.get('broadcast_ip', subnet_broadcast_ip(config.server_ip))
+        self.retries = retries
+        self.retry_ms = retry_ms
+        self.sock = None
+        self.addr = None
+        self.lock = uasyncio.Lock()
+
+    def open(self):
+        """Open the channel's socket (acks come back to its ephemeral port)"""
+        self.sock = open_udp_socket(0)
+        self.addr = socket.getaddrinfo(self.broadcast_ip, self.port)[0][-1]
+        print(f"📢 Broadcast channel ready on {self.broadcast_ip}:{self.port}")
+
+    async def send(self, command_msg, indexes):
+        """Broadcast a command to targets by wire index, returns {index: reply message}
+
+        Targets missing from the result never acked, even after retries.
+        """
+        replies = {}
+        pending = set(indexes)
+        if not pending:
+            return replies
+
+        async with self.lock:
+            # Copy the frame out - the codec buffer is reused by the next encode
+            frame = bytes(binary_codec.encode(command_msg))
+
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    print(f"🔁 Rebroadcasting {command_msg.type} to {len(pending)} unacked targets")
+                self.sock.sendto(self._datagram(pending, frame), self.addr)
+
+                # Collect acks until everyone answered or this attempt's window closes
+                deadline = time.ticks_add(time.ticks_ms(), self.retry_ms * (attempt + 1))
+                while pending:
+                    data, addr = receive_datagram(self.sock)
+                    if data is not None:
+                        self._collect(data, command_msg.id, pending, replies)
+                        continue
+                    remaining = time.ticks_diff(deadline, time.ticks_ms())
+                    if remaining <= 0 or not await wait_datagram(self.sock, remaining):
+                        break
+
+                if not pending:
+                    break
+
+        return replies
+
+    def _datagram(self, indexes, frame):
+        mask = build_mask(indexes)
+        return bytes((BROADCAST_MARKER, len(mask))) + mask + frame
+
+    def _collect(self, data, command_id, pending, replies):
+        """Record an ack datagram if it answers the command in flight"""
+        if not data or data[0] != FRAME_MARKER:
+            return
+        try:
+            index = binary_codec.decode_header(data)[2]
+            reply = SocketMessage.from_frame(data)
+        except ValueError as e:
+            print(f"⚠️ Invalid broadcast ack: {e}")
+            return
+        if reply.id == command_id and index in pending:
+            pending.discard(index)
+            replies[index] = reply
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+
+class BeaconService:
+    """Master side - periodic beacons out, target announces in"""
+
+    def __init__(self, beacon, on_announce, port=None, target_port=None, broadcast_ip=None,
+                 interval_ms=2000):
+        """
+        Args:
+            beacon: The beacon datagram (fixed for the master's lifetime)
+            on_announce: on_announce((name, index, flags, epoch), addr) returning
+                a welcome datagram to send back, or None
+        """
+        self.beacon = beacon
+        self.on_announce = on_announce
+        self.port = port or config.get('discovery_port', 4211)
+        self.target_port = target_port or config.get('broadcast_port', 4210)
+        self.broadcast_ip = broadcast_ip or config.get('broadcast_ip', subnet_broadcast_ip(config.server_ip))
+        self.interval_ms = interval_ms
+        self.sock = None
+
+    async def run(self):
+        self.sock = open_udp_socket(self.port)
+        addr = socket.getaddrinfo(self.broadcast_ip, self.target_port)[0][-1]
+        print(f"🛰️ Beaconing to {self.broadcast_ip}:{self.target_port} every {self.interval_ms}ms")
+
+        next_beacon = time.ticks_ms()
+        while True:
+            if time.ticks_diff(time.ticks_ms(), next_beacon) >= 0:
+                try:
+                    self.sock.sendto(self.beacon, addr)
+                except OSError as e:
+                    print(f"💥 Beacon send failed: {e}")
+                next_beacon = time.ticks_add(next_beacon, self.interval_ms)
+
+            data, source = receive_datagram(self.sock)
+            if data is None:
+                # Sleep until an announce lands or the next beacon is due
+                await wait_datagram(self.sock, max(1, time.ticks_diff(next_beacon, time.ticks_ms())))
+                continue
+            announce = parse_hello(data, ANNOUNCE_MARKER)
+            if announce is None:
+                continue
+            try:
+                welcome = self.on_announce(announce, source)
+                if welcome:
+                    self.sock.sendto(welcome, source)
+            except Exception as e:
+                print(f"💥 Announce from {source[0]} failed: {e}")
+
+
+class BroadcastListener:
+    """Target side - runs broadcast commands addressed to this target's wire index"""
+
+    def __init__(self, node_id, handler, port=None, on_discovery=None):
+        self.node_id = node_id
+        self.handler = handler  # async handler(message, client_ip, writer)
+        self.on_discovery = on_discovery  # handler(datagram, addr) for beacons and welcomes
+        self.port = port or config.get('broadcast_port', 4210)
+        self.sock = None
+        self.epoch = 0  # Boot epoch of the master sending commands, 0 if unknown
+        self._last_key = None  # (epoch, id, type) of the last command run
+        self._last_reply = None
+
+    def set_epoch(self, epoch):
+        """Note the master's boot epoch - a new one means its message IDs restarted"""
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self._last_key = None
+            self._last_reply = None
+
+    async def run(self):
+        """Receive loop - waits for datagrams and acks every command we execute"""
+        self.sock = open_udp_socket(self.port)
+        print(f"📢 Listening for broadcast commands on port {self.port}")
+
+        while True:
+            data, addr = receive_datagram(self.sock)
+            if data is None:
+                await wait_datagram(self.sock)
+                continue
+            try:
+                await self._handle_datagram(data, addr)
+            except Exception as e:
+                print(f"💥 Broadcast command error: {e}")
+
+    async def _handle_datagram(self, data, addr):
+        if len(data) < 2:
+            return
+        if data[0] == BEACON_MARKER or data[0] == WELCOME_MARKER:
+            if self.on_discovery:
+                self.on_discovery(data, addr)
+            return
+        if data[0] != BROADCAST_MARKER:
+            return
+
+        index = binary_codec.target_indexes.get(self.node_id)
+        if index is None or not mask_has(data, index):
+            return
+
+        frame = memoryview(data)[2 + data[1]:]
+        message = SocketMessage.from_frame(frame)
+
+        # A repeat means our ack was lost - answer again without re-running it.
+        # IDs restart when the master reboots and wrap at 16 bits, so the
+        # epoch and type are part of what makes it the same command
+        key = (self.epoch, message.id, message.type)
+        if key == self._last_key and self._last_reply:
+            self.sock.sendto(self._last_reply, addr)
+            return
+
+        print(f"📢 Broadcast {message.type} from {addr[0]}")
+        reply = DatagramReply(self.sock, addr)
+        await self.handler(message, addr[0], reply)
+        self._last_key = key
+        self._last_reply = reply.sent
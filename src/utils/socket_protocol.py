@@ -1,35 +1,49 @@
 # socket_protocol.py - SNYPER Socket Communication Protocol
 #
 # JSON Lines Protocol for Master/Target Communication
-# Each message is a single line of JSON followed by newline
+# Each message is a single line of JSON followed by newline. Peers that both
+# support it switch to the compact binary framing in wire_codec.py instead.
 
 import json
+import struct
 import time
 import uasyncio
+from config.config import config
+from utils.wire_codec import BinaryCodec, FRAME_MARKER, HEADER_SIZE, NO_TARGET, frame_size
+
+# Wire codecs - negotiated per peer during registration
+CODEC_JSON = "json"
+CODEC_BINARY = "bin"
 
 class SocketMessage:
     """Represents a socket message in SNYPER protocol"""
     
-    # Message Types (valid message types)
+    # Message Types (valid message types) - APPEND ONLY, the index is the binary type code
     TYPES = (
         "ping", "pong", "stand_up", "standing", "lay_down", "down",
-        "activate", "activated", "register", "registered", "error"
+        "activate", "activated", "register", "registered", "error",
+        "hit", "miss", "sync", "synced", "calibrate", "calibrated"
     )
     
+    # Last issued message ID (wraps at 16 bits to fit the binary header)
+    _last_id = 0
+    
     def __init__(self, msg_type, msg_id=None, data=None, target_id=None):
         msg_type_lower = msg_type.lower()
         if msg_type_lower not in self.TYPES:
             raise ValueError(f"Invalid message type: {msg_type}. Valid types: {self.TYPES}")
         
         self.type = msg_type_lower
-        self.id = msg_id or self._generate_id()
+        self.id = msg_id if msg_id is not None else self._generate_id()
         self.data = data or {}
         self.target_id = target_id
-        self.timestamp = time.time()
+        self.timestamp = time.ticks_ms()
+        self.codec = CODEC_JSON  # Wire format this message arrived in
     
     def _generate_id(self):
-        """Generate unique message ID"""
-        return f"msg_{int(time.time() * 1000)}"
+        """Generate unique message ID from a wrapping sequence counter"""
+        SocketMessage._last_id = (SocketMessage._last_id + 1) & 0xFFFF
+        return SocketMessage._last_id
     
     def to_json(self):
         """Convert message to JSON string"""
@@ -51,6 +65,20 @@ class SocketMessage:
         """Convert message to JSON line (with newline)"""
         return self.to_json() + "\n"
     
+    def encode(self, codec=CODEC_JSON):
+        """Encode message for the wire in the given codec
+        
+        Binary frames alias a shared buffer, so write the result out before
+        encoding anything else. Messages that don't fit a binary frame fall
+        back to a JSON line - receivers accept both on any stream.
+        """
+        if codec == CODEC_BINARY:
+            try:
+                return binary_codec.encode(self)
+            except ValueError as e:
+                print(f"⚠️ Binary encode failed, sending JSON: {e}")
+        return self.to_line().encode('utf-8')
+    
     @classmethod
     def from_json(cls, json_str):
         """Create message from JSON string"""
@@ -62,40 +90,251 @@ class SocketMessage:
                 data=data.get("data"),
                 target_id=data.get("target_id")
             )
-            msg.timestamp = data.get("timestamp", time.time())
+            msg.timestamp = data.get("timestamp", time.ticks_ms())
             return msg
-        except (json.JSONDecodeError, KeyError) as e:
+        except (ValueError, KeyError) as e:
             raise ValueError(f"Invalid message format: {e}")
+    
+    @classmethod
+    def from_frame(cls, frame):
+        """Create message from a complete binary frame"""
+        try:
+            type_code, seq, index, ticks, length = binary_codec.decode_header(frame)
+            msg = cls(
+                msg_type=cls.TYPES[type_code],
+                msg_id=seq,
+                data=binary_codec.decode_payload(frame, length),
+                target_id=binary_codec.target_names.get(index)
+            )
+            msg.timestamp = ticks
+            msg.codec = CODEC_BINARY
+            return msg
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"Invalid binary frame: {e}")
+
+
+# Shared binary codec - one per device, its encode buffer is reused for every frame
+binary_codec = BinaryCodec(SocketMessage.TYPES)
+
+
+def preferred_codecs():
+    """Codecs this device offers during registration, best first"""
+    if config.get('codec', CODEC_BINARY) == CODEC_JSON:
+        return [CODEC_JSON]
+    return [CODEC_BINARY, CODEC_JSON]
+
+
+# Response Templates
+
+def _put_digits(buf, end, value, width):
+    """Right-align value's decimal digits in buf[end - width:end], space padded"""
+    pos = end
+    while True:
+        pos -= 1
+        buf[pos] = 48 + value % 10
+        value //= 10
+        if not value:
+            break
+    while pos > end - width:
+        pos -= 1
+        buf[pos] = 32
+
+
+class ResponseTemplate:
+    """A fixed-shape reply compiled once, with only its ID and timestamp patched per send
+    
+    Both encodings live in preallocated buffers. The JSON line reserves
+    space-padded fields for the ID and timestamp, which is still valid JSON.
+    The binary frame gets them packed straight into its header. render()
+    returns a memoryview of that buffer, so write it out before the next
+    render() of the same template.
+    """
+    
+    ID_WIDTH = 5          # u16 message IDs
+    TIMESTAMP_WIDTH = 10  # ticks_ms values stay below 2**30
+    
+    def __init__(self, msg_type, target_id, data):
+        self.type = msg_type.lower()
+        self.target_id = target_id
+        self.data = data
+        
+        head = '{"type": "%s", "id": ' % self.type
+        middle = ', "timestamp": '
+        tail = '%s%s}\n' % (
+            ', "target_id": %s' % json.dumps(target_id) if target_id else "",
+            ', "data": %s' % json.dumps(data) if data else ""
+        )
+        self.json = bytearray(
+            (head + " " * self.ID_WIDTH + middle + " " * self.TIMESTAMP_WIDTH + tail).encode('utf-8')
+        )
+        self.json_view = memoryview(self.json)
+        self._id_end = len(head) + self.ID_WIDTH
+        self._timestamp_end = self._id_end + len(middle) + self.TIMESTAMP_WIDTH
+        
+        self.frame = None
+        self.frame_view = None
+        self._frame_index = None
+    
+    def _compile_frame(self, index):
+        """(Re)build the binary frame - the target's wire index is baked into it"""
+        frame = binary_codec.encode(SocketMessage(self.type, msg_id=0, target_id=self.target_id, data=self.data))
+        self.frame = bytearray(frame)
+        self.frame_view = memoryview(self.frame)
+        self._frame_index = index
+    
+    def size(self, codec=CODEC_JSON):
+        """Encoded length in the given codec"""
+        if codec == CODEC_BINARY:
+            if self.frame is None:
+                self._compile_frame(binary_codec.target_indexes.get(self.target_id, NO_TARGET))
+            return len(self.frame)
+        return len(self.json)
+    
+    def render(self, msg_id, codec=CODEC_JSON):
+        """Patch in the ID and a fresh timestamp, returning the wire bytes"""
+        timestamp = time.ticks_ms()
+        if codec == CODEC_BINARY:
+            index = binary_codec.target_indexes.get(self.target_id, NO_TARGET)
+            if index != self._frame_index:
+                self._compile_frame(index)
+            struct.pack_into("<H", self.frame, 2, msg_id & 0xFFFF)
+            struct.pack_into("<I", self.frame, 5, timestamp & 0xFFFFFFFF)
+            return self.frame_view
+        
+        _put_digits(self.json, self._id_end, msg_id, self.ID_WIDTH)
+        _put_digits(self.json, self._timestamp_end, timestamp, self.TIMESTAMP_WIDTH)
+        return self.json_view
 
 
 # Message Line Parser
 
+# Largest JSON line or binary frame accepted from a peer
+MAX_FRAME_SIZE = 512
+
+# Not every MicroPython port builds bytearray.find - scan by hand without it
+_HAS_BYTEARRAY_FIND = hasattr(bytearray, 'find')
+
 class MessageLineParser:
-    """Parses incoming message lines from socket streams"""
+    """Frames JSON lines and binary frames out of a fixed receive buffer
+    
+    Incoming bytes land in one preallocated bytearray (ideally read straight
+    into it with read_from), and complete frames are decoded from memoryview
+    slices of it. Unparsed leftovers only move when the write position reaches
+    the end of the buffer, and then only the partial frame is moved.
+    A frame longer than max_frame raises ValueError - the stream can't be
+    resynchronised, so the caller should drop the connection.
+    """
     
-    def __init__(self):
-        self.buffer = ""
+    def __init__(self, max_frame=MAX_FRAME_SIZE):
+        self.max_frame = max_frame
+        self.buf = bytearray(2 * max_frame)
+        self.view = memoryview(self.buf)
+        self.start = 0  # First unparsed byte
+        self.end = 0    # One past the last received byte
+        self.scan = 0   # Newline search resumes here
+    
+    def space(self):
+        """Writable memoryview of the free tail of the buffer"""
+        if self.end == len(self.buf):
+            self._compact()
+        return self.view[self.end:]
+    
+    def _compact(self):
+        """Move the partial frame at the end of the buffer back to the front"""
+        # pending <= max_frame and start >= max_frame here, so the copy never overlaps
+        pending = self.end - self.start
+        self.buf[0:pending] = self.view[self.start:self.end]
+        self.scan -= self.start
+        self.start = 0
+        self.end = pending
+    
+    async def read_from(self, reader):
+        """Read from a stream into the buffer, returns messages or None at EOF"""
+        space = self.space()
+        if hasattr(reader, 'readinto'):
+            # MicroPython streams read straight into our buffer
+            count = await reader.readinto(space)
+        else:
+            data = await reader.read(len(space))
+            count = len(data)
+            space[:count] = data
+        if not count:
+            return None
+        self.end += count
+        return self._drain()
     
     def feed(self, data):
-        """Feed data to parser, returns list of complete messages"""
-        self.buffer += data
+        """Feed raw bytes to parser, returns list of complete messages"""
+        messages = []
+        data = memoryview(data)
+        while data:
+            space = self.space()
+            count = min(len(space), len(data))
+            space[:count] = data[:count]
+            data = data[count:]
+            self.end += count
+            messages.extend(self._drain())
+        return messages
+    
+    def _drain(self):
+        """Decode every complete frame currently in the buffer"""
         messages = []
+        buf = self.buf
         
-        while "\n" in self.buffer:
-            line, self.buffer = self.buffer.split("\n", 1)
-            if line.strip():  # Skip empty lines
-                try:
-                    message = SocketMessage.from_json(line.strip())
-                    messages.append(message)
-                except ValueError as e:
-                    print(f"⚠️ Invalid message received: {e}")
-                    # Could create error message here if needed
+        while self.start < self.end:
+            available = self.end - self.start
+            
+            if buf[self.start] == FRAME_MARKER:
+                # Binary frame - wait for the full header, then the full payload
+                if available < HEADER_SIZE:
+                    break
+                size = frame_size(buf, self.start)
+                if size > self.max_frame:
+                    raise ValueError(f"Binary frame too large: {size} bytes")
+                if available < size:
+                    break
+                frame = self.view[self.start:self.start + size]
+                self.start += size
+                decode = SocketMessage.from_frame
+            else:
+                newline = self._find_newline(max(self.scan, self.start), self.end)
+                if newline < 0:
+                    if available > self.max_frame:
+                        raise ValueError(f"Line too long: over {self.max_frame} bytes")
+                    self.scan = self.end
+                    break
+                # json.loads needs a real bytes object, so lines are the one copy
+                frame = bytes(self.view[self.start:newline]).strip()
+                self.start = newline + 1
+                if not frame:  # Skip empty lines
+                    continue
+                decode = SocketMessage.from_json
+            
+            try:
+                messages.append(decode(frame))
+            except ValueError as e:
+                print(f"⚠️ Invalid message received: {e}")
+                # Could create error message here if needed
+        
+        if self.start == self.end:
+            # Everything consumed - rewind for free instead of compacting later
+            self.start = self.end = self.scan = 0
         
         return messages
     
+    def _find_newline(self, start, end):
+        """Index of the next newline in buf[start:end], or -1"""
+        buf = self.buf
+        if _HAS_BYTEARRAY_FIND:
+            return buf.find(b"\n", start, end)
+        for i in range(start, end):
+            if buf[i] == 10:
+                return i
+        return -1
+    
     def clear(self):
         """Clear the buffer"""
-        self.buffer = ""
+        self.start = self.end = self.scan = 0
 
 # Example Usage and Protocol Documentation
 
@@ -108,46 +347,125 @@ Message Format: JSON Lines (each message is JSON followed by newline)
 Base Message Structure:
 {
     "type": "message_type",
-    "id": "unique_message_id", 
-    "timestamp": 1699123456.789,
+    "id": 42,                  // Sequence number per connection, wraps at 65535
+    "timestamp": 123456789,    // Sender time.ticks_ms()
     "target_id": "target_1",  // Optional
     "data": {}                 // Optional payload
 }
 
+Binary Framing:
+---------------
+Registration always happens in JSON. The target lists the codecs it speaks in
+`data.codecs` and the master answers with the chosen `data.codec` plus the
+target's wire `data.index`. After that the master sends commands to the target
+in that codec, and every reply mirrors the codec of the request it answers.
+Frames start with 0xA5, so one stream can mix binary frames and JSON lines -
+setting "codec": "json" in config.json forces JSON lines for debugging.
+See wire_codec.py for the frame layout.
+
+Connections:
+------------
+Streams are persistent. The master keeps one pooled connection per target IP
+and sends every command over it without waiting for earlier replies. Each
+connection numbers its requests from its own sequence and replies echo the
+request ID, which is how a reply finds its request. Broken streams are
+dropped and reopened on the next send, and master streams idle for longer
+than `pool_idle_ms` (default 30000) are closed. Each target keeps the stream
+it registered on open and pushes hit/miss results up it as they happen.
+Fleet-wide stand_up / lay_down / activate go out as one UDP broadcast on
+`broadcast_port` first (see broadcast.py); TCP is the fallback per target.
+
+Backpressure:
+-------------
+Replies to an accepted connection go through a bounded OutboundQueue that
+a writer task drains. A slow peer never stalls the read loop. When the
+queue is full, WRITE_POLICIES decides by message type: drop the new
+message, coalesce it with a queued one, or (for results that must not be
+lost) evict the oldest droppable message. A peer that stops reading is
+disconnected once a write has been stuck for `write_timeout` seconds, or
+once even must-keep messages no longer fit. A server holds at most
+`max_clients` accepted connections. A new connection from an IP that
+already has `max_clients_per_ip` open replaces that IP's oldest one
+(usually a stale stream the peer has already given up on).
+
 Message Types:
 --------------
 
 1. PING / PONG (Health Check)
    Master → Target:
-   {"type": "ping", "id": "msg_1", "target_id": "target_1"}
+   {"type": "ping", "id": 1, "target_id": "target_1"}
    
    Target → Master:
-   {"type": "pong", "id": "msg_1", "target_id": "target_1", "data": {"status": "alive"}}
+   {"type": "pong", "id": 1, "target_id": "target_1", "data": {"status": "alive"}}
 
 2. STAND_UP / STANDING (Target Stand Up)
    Master → Target:
-   {"type": "stand_up", "id": "msg_2", "target_id": "target_1"}
+   {"type": "stand_up", "id": 2, "target_id": "target_1"}
    
    Target → Master:
-   {"type": "standing", "id": "msg_2", "target_id": "target_1", "data": {"status": "standing"}}
+   {"type": "standing", "id": 2, "target_id": "target_1", "data": {"status": "standing"}}
 
 3. LAY_DOWN / DOWN (Target Lay Down)
    Master → Target:
-   {"type": "lay_down", "id": "msg_3", "target_id": "target_1"}
+   {"type": "lay_down", "id": 3, "target_id": "target_1"}
    
    Target → Master:
-   {"type": "down", "id": "msg_3", "target_id": "target_1", "data": {"status": "down"}}
+   {"type": "down", "id": 3, "target_id": "target_1", "data": {"status": "down"}}
 
 4. ACTIVATE / ACTIVATED (Target Activation)
    Master → Target:
-   {"type": "activate", "id": "msg_4", "target_id": "target_1", "data": {"duration": 5}}
+   {"type": "activate", "id": 4, "target_id": "target_1", "data": {"duration": 5}}
+   
+   Target → Master:
+   {"type": "activated", "id": 4, "target_id": "target_1", "data": {"status": "activated", "duration": 5}}
+   
+   Scheduled rounds add the start instant in the target's own ticks_us (from
+   the master's clock estimate, see section 7), or a delay from receipt for a
+   target that has not synced yet:
+   {"type": "activate", "id": 4, "target_id": "target_1", "data": {"duration": 5, "start_us": 98234000}}
+   {"type": "activate", "id": 4, "target_id": "target_1", "data": {"duration": 5, "delay_ms": 350}}
+   The target stays down until then and rises immediately if it is already late.
+
+5. REGISTER / REGISTERED (Target Registration)
+   Target → Master:
+   {"type": "register", "id": 5, "target_id": "target_1", "data": {"client_id": "target_1", "codecs": ["bin", "json"]}}
+   
+   Master → Target:
+   {"type": "registered", "id": 5, "target_id": "target_1", "data": {"status": "registered", "codec": "bin", "index": 0, "epoch": 81723}}
+   
+   Targets normally register with a UDP announce/welcome instead (see
+   broadcast.py); this TCP exchange is the fallback. `epoch` identifies the
+   master's current boot.
+
+6. HIT / MISS (Activation Result Push)
+   Target → Master, one-way on the target's persistent stream (no reply):
+   {"type": "hit", "id": 7, "target_id": "target_1", "data": {"ticks_us": 81234567, "intensity": 23110, "reaction_us": 412000, "hit_value": 10}}
+   {"type": "miss", "id": 8, "target_id": "target_1", "data": {"ticks_us": 86234567, "reaction_us": 5000000}}
+   `ticks_us` is the target's own time.ticks_us() at the hit (or timeout) and
+   `reaction_us` the time since the target finished standing up.
+
+7. SYNC / SYNCED (Clock Synchronization)
+   Master → Target:
+   {"type": "sync", "id": 9, "data": {"t1": 51234000}}
    
    Target → Master:
-   {"type": "activated", "id": "msg_4", "target_id": "target_1", "data": {"status": "activated", "duration": 5}}
+   {"type": "synced", "id": 9, "target_id": "target_1", "data": {"t1": 51234000, "t2": 81230012, "t3": 81230040}}
+   t1 is the master's ticks_us at send, t2/t3 the target's ticks_us on receipt
+   and just before replying. See master/clock_sync.py.
 
-5. ERROR (Error Response)
+8. CALIBRATE / CALIBRATED (Piezo Threshold and Servo Travel Calibration)
+   Master → Target:
+   {"type": "calibrate", "id": 10, "data": {"from": "master"}}
+   
+   Target → Master, once calibration is done (a few seconds - other
+   requests on the stream are answered meanwhile):
+   {"type": "calibrated", "id": 10, "target_id": "target_1", "data": {"status": "calibrated", "hit_threshold": 8400, "noise_floor": 1150, "clamped": false, "travel_ms": 380}}
+   The thresholds and servo stroke time are also saved in the target's
+   config/device_id.json.
+
+9. ERROR (Error Response)
    Any → Any:
-   {"type": "error", "id": "msg_1", "target_id": "target_1", "data": {"error": "Command failed"}}
+   {"type": "error", "id": 1, "target_id": "target_1", "data": {"error": "Command failed"}}
 
 Benefits:
 ---------
@@ -159,53 +477,402 @@ Benefits:
 - Timestamps for debugging and timeout handling
 """
 
+# Connection Pool
+
+class PooledConnection:
+    """One long-lived stream to a peer with many requests in flight at once
+    
+    Each request gets the next ID from this connection's own sequence and
+    parks on an entry in the pending table. A single reader task parses
+    everything the peer sends and wakes the request whose ID the reply echoes,
+    so replies may arrive in any order and nobody waits on a round trip to
+    send the next command.
+    """
+    
+    def __init__(self, ip, port, reader, writer):
+        self.ip = ip
+        self.port = port
+        self.reader = reader
+        self.writer = writer
+        self.parser = MessageLineParser()
+        self.write_lock = uasyncio.Lock()  # One drain() per stream at a time
+        self.pending = {}  # message id -> [Event, response message]
+        self.next_id = 0
+        self.closed = False
+        self.error = None
+        self.last_used = time.ticks_ms()
+        self.uses = 0
+        self.reader_task = uasyncio.create_task(self._read_loop())
+    
+    def _next_message_id(self):
+        """Next ID in this connection's sequence, skipping any still in flight"""
+        while True:
+            self.next_id = (self.next_id + 1) & 0xFFFF
+            if self.next_id not in self.pending:
+                return self.next_id
+    
+    async def request(self, command_msg, codec=CODEC_JSON, timeout=5):
+        """Send one message and wait for the reply that echoes its ID"""
+        if self.closed:
+            raise OSError(self.error or "Connection closed")
+        
+        self.uses += 1
+        command_msg.id = self._next_message_id()
+        slot = [uasyncio.Event(), None]
+        self.pending[command_msg.id] = slot
+        
+        try:
+            async with self.write_lock:
+                self.writer.write(command_msg.encode(codec))
+                await self.writer.drain()
+            await uasyncio.wait_for(slot[0].wait(), timeout=timeout)
+        finally:
+            self.pending.pop(command_msg.id, None)
+        
+        if slot[1] is None:
+            # Woken by the reader task shutting down, not by a reply
+            raise OSError(self.error or "Connection closed by peer")
+        
+        self.last_used = time.ticks_ms()
+        return slot[1]
+    
+    async def push(self, message, codec=CODEC_JSON):
+        """Send a one-way message on this stream - no reply is expected"""
+        if self.closed:
+            raise OSError(self.error or "Connection closed")
+        
+        self.uses += 1
+        message.id = self._next_message_id()
+        async with self.write_lock:
+            self.writer.write(message.encode(codec))
+            await self.writer.drain()
+        self.last_used = time.ticks_ms()
+    
+    async def _read_loop(self):
+        """Resolve pending requests as their replies arrive"""
+        try:
+            while True:
+                messages = await self.parser.read_from(self.reader)
+                if messages is None:
+                    break
+                for message in messages:
+                    slot = self.pending.get(message.id)
+                    if slot is None:
+                        print(f"⚠️ Unsolicited {message.type} (id {message.id}) from {self.ip}")
+                        continue
+                    slot[1] = message
+                    slot[0].set()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.closed = True
+            # Fail everything still waiting rather than letting it time out
+            for slot in self.pending.values():
+                slot[0].set()
+    
+    def idle_ms(self):
+        """Milliseconds since this connection last completed a request"""
+        return time.ticks_diff(time.ticks_ms(), self.last_used)
+    
+    async def close(self):
+        """Close the underlying stream, ignoring errors from dead sockets"""
+        self.closed = True
+        try:
+            self.reader_task.cancel()
+        except Exception:
+            pass
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """Keeps one persistent stream per peer IP, reconnecting lazily after errors"""
+    
+    def __init__(self, port, idle_timeout_ms=30000, connect_timeout=5):
+        self.port = port
+        self.idle_timeout_ms = idle_timeout_ms
+        self.connect_timeout = connect_timeout
+        self._connections = {}  # ip -> PooledConnection
+        self._connecting = {}   # ip -> Event set when an in-progress connect finishes
+    
+    def __len__(self):
+        return len(self._connections)
+    
+    def get(self, ip):
+        """Return the open connection for an IP, or None"""
+        return self._connections.get(ip)
+    
+    async def acquire(self, ip, port=None):
+        """Return the pooled connection for an IP, opening one if needed"""
+        # Requests fired together share one connect instead of racing
+        while ip in self._connecting:
+            await self._connecting[ip].wait()
+        
+        conn = self._connections.get(ip)
+        if conn is not None and not conn.closed:
+            return conn
+        if conn is not None:
+            # Reader task saw the stream die - replace it
+            await self.discard(ip, conn)
+        
+        if port is None:
+            port = self.port
+        
+        print(f"🔗 Opening pooled connection to {ip}:{port}")
+        connecting = self._connecting[ip] = uasyncio.Event()
+        try:
+            reader, writer = await uasyncio.wait_for(
+                uasyncio.open_connection(ip, port),
+                timeout=self.connect_timeout
+            )
+            conn = PooledConnection(ip, port, reader, writer)
+            self._connections[ip] = conn
+            return conn
+        finally:
+            del self._connecting[ip]
+            connecting.set()
+    
+    async def discard(self, ip, conn=None):
+        """Drop and close the connection for an IP (next acquire reconnects)
+        
+        Passing conn only drops the pooled entry if it is still that
+        connection, so a failed request can't close a newer replacement.
+        """
+        current = self._connections.get(ip)
+        if conn is None or current is conn:
+            self._connections.pop(ip, None)
+        else:
+            current = conn
+        if current is not None:
+            await current.close()
+    
+    async def evict_idle(self):
+        """Close connections that have not been used within the idle timeout"""
+        stale = [ip for ip, conn in self._connections.items()
+                 if not conn.pending and conn.idle_ms() > self.idle_timeout_ms]
+        for ip in stale:
+            print(f"🧹 Evicting idle connection to {ip}")
+            await self.discard(ip)
+        return len(stale)
+    
+    async def run_evictor(self, interval_ms=5000):
+        """Background task that periodically evicts idle connections"""
+        while True:
+            await uasyncio.sleep_ms(interval_ms)
+            await self.evict_idle()
+    
+    async def close_all(self):
+        """Close every pooled connection"""
+        for ip in list(self._connections):
+            await self.discard(ip)
+
+
+# Outbound queue policies - what happens to a message when its queue is full
+POLICY_DROP = 0      # Drop the new message (the peer's request times out)
+POLICY_COALESCE = 1  # Replace the queued message of the same group - only the latest matters
+POLICY_KEEP = 2      # Evict the oldest droppable message, disconnect if there is none
+
+WRITE_POLICIES = {
+    "pong": POLICY_DROP,
+    "synced": POLICY_DROP,
+    "error": POLICY_DROP,
+    "standing": POLICY_COALESCE,
+    "down": POLICY_COALESCE,
+    "activated": POLICY_COALESCE,
+    "registered": POLICY_KEEP,
+    "calibrated": POLICY_KEEP,
+    "hit": POLICY_KEEP,
+    "miss": POLICY_KEEP,
+}
+
+# Types that coalesce into one another - a queued "standing" is stale once "down" is sent
+COALESCE_GROUPS = {"standing": "pose", "down": "pose"}
+
+
+class OutboundQueue:
+    """Bounded per-connection send queue drained by its own writer task
+    
+    Handlers hand messages to send() and return immediately, so one slow
+    peer can't hold up the loop reading its requests. The queue is capped by
+    message count and by bytes. When it is full, WRITE_POLICIES decides
+    what gives way.
+    """
+    
+    def __init__(self, writer, peer, max_messages=8, max_bytes=2048, write_timeout=5):
+        self.writer = writer
+        self.peer = peer
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.write_timeout = write_timeout
+        self.items = []  # [message type, size, bytes or ResponseTemplate, id, codec], oldest first
+        self.bytes = 0
+        self.dropped = 0
+        self.closed = False
+        self._ready = uasyncio.Event()
+        self._room = uasyncio.Event()
+        self.task = uasyncio.create_task(self._run())
+    
+    def send(self, message, codec=CODEC_JSON):
+        """Queue a message for the writer task, returns False if it was dropped"""
+        if self.closed:
+            return False
+        # Copy out - binary frames alias the shared codec buffer
+        data = bytes(message.encode(codec))
+        return self._enqueue(message.type, len(data), data, None, None)
+    
+    def send_template(self, template, msg_id, codec=CODEC_JSON):
+        """Queue a templated reply - it is only rendered when the writer gets to it"""
+        if self.closed:
+            return False
+        return self._enqueue(template.type, template.size(codec), template, msg_id, codec)
+    
+    def _enqueue(self, msg_type, size, data, msg_id, codec):
+        if not self._fits(size):
+            policy = WRITE_POLICIES.get(msg_type, POLICY_DROP)
+            if policy == POLICY_COALESCE and self._coalesce(msg_type, size, data, msg_id, codec):
+                return True
+            if policy == POLICY_KEEP:
+                self._make_room(size)
+            if not self._fits(size):
+                self.dropped += 1
+                print(f"🚮 Send queue to {self.peer} full - dropped {msg_type}")
+                if policy == POLICY_KEEP:
+                    # Even must-keep messages can't get through - the peer has stalled
+                    self.close()
+                return False
+        
+        self.items.append([msg_type, size, data, msg_id, codec])
+        self.bytes += size
+        self._ready.set()
+        return True
+    
+    def _fits(self, size):
+        return len(self.items) < self.max_messages and self.bytes + size <= self.max_bytes
+    
+    def full(self):
+        return len(self.items) >= self.max_messages or self.bytes >= self.max_bytes
+    
+    async def wait_room(self, timeout_ms):
+        """Wait up to timeout_ms for the writer task to free a slot"""
+        try:
+            while self.full() and not self.closed:
+                self._room.clear()
+                await uasyncio.wait_for_ms(self._room.wait(), timeout_ms)
+        except uasyncio.TimeoutError:
+            pass
+    
+    def _coalesce(self, msg_type, size, data, msg_id, codec):
+        """Overwrite a queued message in the same group, newest state wins"""
+        group = COALESCE_GROUPS.get(msg_type, msg_type)
+        for item in self.items:
+            if COALESCE_GROUPS.get(item[0], item[0]) == group:
+                self.bytes += size - item[1]
+                item[0] = msg_type
+                item[1] = size
+                item[2] = data
+                item[3] = msg_id
+                item[4] = codec
+                self.dropped += 1
+                return True
+        return False
+    
+    def _make_room(self, size):
+        """Evict the oldest droppable messages until size bytes fit"""
+        index = 0
+        while not self._fits(size) and index < len(self.items):
+            msg_type = self.items[index][0]
+            if WRITE_POLICIES.get(msg_type, POLICY_DROP) == POLICY_KEEP:
+                index += 1
+                continue
+            self.bytes -= self.items.pop(index)[1]
+            self.dropped += 1
+            print(f"🚮 Send queue to {self.peer} full - evicted {msg_type}")
+    
+    async def _run(self):
+        """Writer task - drains the queue, disconnecting a peer that stops reading"""
+        try:
+            while True:
+                while not self.items:
+                    self._ready.clear()
+                    await self._ready.wait()
+                item = self.items.pop(0)
+                self.bytes -= item[1]
+                self._room.set()
+                data = item[2]
+                if isinstance(data, ResponseTemplate):
+                    # Streams copy what they are given, so the template buffer is free again after this
+                    data = data.render(item[3], item[4])
+                self.writer.write(data)
+                await uasyncio.wait_for(self.writer.drain(), timeout=self.write_timeout)
+        except uasyncio.TimeoutError:
+            print(f"⏰ {self.peer} stopped reading - dropping connection")
+        except Exception as e:
+            print(f"💥 Send to {self.peer} failed: {e}")
+        finally:
+            self.close()
+    
+    def close(self):
+        """Stop writing and close the stream - the read loop then sees EOF"""
+        if self.closed:
+            return
+        self.closed = True
+        self.items = []
+        self.bytes = 0
+        self._room.set()
+        try:
+            self.task.cancel()
+        except Exception:
+            pass
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
 # SocketServer Base Class
 
 class SocketServer:
     """Base class for socket-based servers with common functionality"""
     
-    def __init__(self, port):
+    def __init__(self, port, client_idle_timeout=None, max_clients=8):
         self.port = port
         self.socket_server = None
+        # Accepted connections by peer IP, oldest first, each an OutboundQueue
+        self.clients = {}
+        self.client_count = 0
+        self.max_clients = max_clients
+        self.max_clients_per_ip = config.get('max_clients_per_ip', 2)
+        # How long a full send queue may hold up reading before policies drop
+        self.write_grace_ms = config.get('write_grace_ms', 50)
+        # Outbound streams are reused across commands instead of reconnecting
+        self.pool = ConnectionPool(port, idle_timeout_ms=config.get('pool_idle_ms', 30000))
+        # Inbound connections with no traffic for this many seconds get closed
+        self.client_idle_timeout = client_idle_timeout
+        # Negotiated wire codec per peer IP (JSON until registration says otherwise)
+        self.peer_codecs = {}
     
-    async def send_message(self, command_msg, target_ip, port=None):
-        """Send a message to a target and return parsed response"""
-        if port is None:
-            port = self.port
-            
+    async def send_message(self, command_msg, target_ip, port=None, timeout=5):
+        """Send a message to a target over its pooled connection and return parsed response"""
         target_id = command_msg.target_id
         command_type = command_msg.type
         
-        try:
-            print(f"🔌 Socket {command_type.lower()} to {target_id} at {target_ip}:{port}")
-            
-            # Connect to target
-            reader, writer = await uasyncio.wait_for(
-                uasyncio.open_connection(target_ip, port),
-                timeout=5
-            )
-            
+        print(f"🔌 Socket {command_type.lower()} to {target_id} at {target_ip}")
+        
+        # A reused stream may have been closed by the peer since its last use,
+        # so a failure on one gets exactly one retry on a fresh connection
+        for attempt in range(2):
+            conn = None
             try:
-                # Send command message
-                message_line = command_msg.to_line()
-                print(f"📤 Sending {command_type}: {message_line.strip()}")
-                writer.write(message_line.encode('utf-8'))
-                await writer.drain()
+                conn = await self.pool.acquire(target_ip, port)
+                reused = conn.uses > 0
                 
-                # Read response
-                response_data = await uasyncio.wait_for(
-                    reader.read(1024),
-                    timeout=5
-                )
-                
-                if not response_data:
-                    return {"status": "failed", "error": "No response", "ip": target_ip}
-                
-                # Parse response
-                response_str = response_data.decode('utf-8').strip()
-                print(f"📥 Received {command_type.lower()} response: {response_str}")
-                
-                response_message = SocketMessage.from_json(response_str)
+                codec = self.peer_codecs.get(target_ip, CODEC_JSON)
+                print(f"📤 Sending {command_type} ({codec}): {command_msg.data}")
+                response_message = await conn.request(command_msg, codec, timeout=timeout)
+                print(f"📥 Received {command_type.lower()} response: {response_message.type}")
                 
                 # Return raw response data for caller to process
                 return {
@@ -213,14 +880,42 @@ class SocketServer:
                     "ip": target_ip,
                     "response_message": response_message
                 }
-                    
-            finally:
-                writer.close()
-                await writer.wait_closed()
                 
-        except Exception as e:
-            print(f"💥 Socket {command_type.lower()} error to {target_id}: {e}")
-            return {"status": "failed", "error": str(e), "ip": target_ip}
+            except uasyncio.TimeoutError:
+                # Replies are matched by ID, so a slow target doesn't spoil the
+                # stream for other requests in flight - keep it open
+                print(f"⏰ Socket {command_type.lower()} to {target_id} timed out")
+                return {"status": "failed", "error": "Timeout", "ip": target_ip}
+                
+            except Exception as e:
+                # Drop the broken stream - the next send reconnects lazily
+                await self.pool.discard(target_ip, conn)
+                if attempt == 0 and conn is not None and reused:
+                    print(f"🔁 Stale connection to {target_id}, reconnecting: {e}")
+                    continue
+                print(f"💥 Socket {command_type.lower()} error to {target_id}: {e}")
+                return {"status": "failed", "error": str(e), "ip": target_ip}
+    
+    async def push_message(self, message, target_ip, port=None):
+        """Send a one-way message over the pooled stream to a peer
+        
+        Returns True once the message is written. Like send_message, a stale
+        reused stream gets one retry on a fresh connection.
+        """
+        for attempt in range(2):
+            conn = None
+            try:
+                conn = await self.pool.acquire(target_ip, port)
+                reused = conn.uses > 0
+                await conn.push(message, self.peer_codecs.get(target_ip, CODEC_JSON))
+                return True
+            except Exception as e:
+                await self.pool.discard(target_ip, conn)
+                if attempt == 0 and conn is not None and reused:
+                    print(f"🔁 Stale push connection to {target_ip}, reconnecting: {e}")
+                    continue
+                print(f"💥 Socket {message.type} push to {target_ip} failed: {e}")
+                return False
     
     async def start_socket_server(self, host='0.0.0.0'):
         """Start socket server to handle incoming connections"""
@@ -237,35 +932,100 @@ class SocketServer:
             raise
     
     async def _handle_socket_client(self, reader, writer):
-        """Handle incoming socket connections - delegates to child class"""
+        """Handle incoming socket connections - delegates to child class
+        
+        Connections are persistent: the peer may send any number of requests
+        on one stream, and each is answered in order until it disconnects.
+        """
         client_addr = writer.get_extra_info('peername')
         client_ip = client_addr[0] if client_addr else "unknown"
         print(f"🔌 Socket connection from {client_ip}")
         
+        if self.client_count >= self.max_clients:
+            print(f"🚫 Connection limit ({self.max_clients}) reached - refusing {client_ip}")
+            writer.close()
+            await writer.wait_closed()
+            return
+        
+        # A reconnecting peer has usually abandoned its old stream - close the oldest
+        peer_queues = self.clients.setdefault(client_ip, [])
+        while len(peer_queues) >= self.max_clients_per_ip:
+            print(f"♻️ Too many connections from {client_ip} - closing its oldest")
+            peer_queues.pop(0).close()
+            self.client_count -= 1
+        
+        queue = OutboundQueue(
+            writer, client_ip,
+            max_messages=config.get('write_queue_len', 8),
+            max_bytes=config.get('write_queue_bytes', 2048),
+            write_timeout=config.get('write_timeout', 5)
+        )
+        peer_queues.append(queue)
+        self.client_count += 1
         parser = MessageLineParser()
         
         try:
             # Read data from client
             while True:
-                data = await reader.read(1024)
-                if not data:
+                # Read and parse incoming messages
+                if self.client_idle_timeout:
+                    messages = await uasyncio.wait_for(parser.read_from(reader), timeout=self.client_idle_timeout)
+                else:
+                    messages = await parser.read_from(reader)
+                if messages is None:
                     break
                 
-                # Parse incoming messages
-                messages = parser.feed(data.decode('utf-8'))
-                
                 for message in messages:
                     print(f"📥 Received socket message: {message.type}")
                     
-                    # Delegate to child class for message handling
-                    await self._handle_message(message, client_ip, writer)
+                    # A burst of pipelined requests can outrun the writer task -
+                    # give a healthy peer a moment to catch up before any drops
+                    if queue.full():
+                        await queue.wait_room(self.write_grace_ms)
+                    
+                    # Delegate to child class for message handling - replies
+                    # go through the queue, so this never waits on the peer
+                    await self._handle_message(message, client_ip, queue)
+                
+                if queue.closed:
+                    break
                 
+        except uasyncio.TimeoutError:
+            print(f"⏰ Socket connection from {client_ip} idle - closing")
         except Exception as e:
             print(f"💥 Socket client error: {e}")
         finally:
             print(f"🔌 Closing socket connection from {client_ip}")
-            writer.close()
-            await writer.wait_closed()
+            if queue in peer_queues:
+                peer_queues.remove(queue)
+                self.client_count -= 1
+            if not peer_queues and self.clients.get(client_ip) is peer_queues:
+                del self.clients[client_ip]
+            queue.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+    
+    async def write_message(self, writer, message, codec=CODEC_JSON):
+        """Encode a message in the given codec and write it to a stream
+        
+        Accepted connections hand handlers an OutboundQueue, which queues the
+        message for its writer task instead of waiting for the drain.
+        """
+        if isinstance(writer, OutboundQueue):
+            writer.send(message, codec)
+            return
+        writer.write(message.encode(codec))
+        await writer.drain()
+    
+    async def write_template(self, writer, template, msg_id, codec=CODEC_JSON):
+        """Send a ResponseTemplate reply - the fast path for fixed-shape messages"""
+        if isinstance(writer, OutboundQueue):
+            writer.send_template(template, msg_id, codec)
+            return
+        writer.write(template.render(msg_id, codec))
+        await writer.drain()
     
     async def _handle_message(self, message, client_ip, writer):
         """Handle individual messages - must be implemented by child classes"""
@@ -0,0 +1,179 @@
+# stats.py - Constant-memory streaming statistics
+#
+# Building blocks for stats that run for as long as the master is up without
+# growing: every structure here allocates its storage once and each update
+# is O(1).
+#
+#   RingBuffer    last N samples in a preallocated array
+#   RunningStats  count, mean, variance (Welford), min and max
+#   P2Quantile    one quantile estimated from five markers (the P-square
+#                 algorithm of Jain & Chlamtac) - no samples are kept
+#
+# Floats are single precision on the RP2040, which is plenty for reaction
+# times in microseconds; Welford's update keeps the variance stable anyway.
+
+from array import array
+
+
+class RingBuffer:
+    """Fixed-size buffer of the most recent samples"""
+
+    def __init__(self, size, typecode='i'):
+        self.data = array(typecode, [0] * size)
+        self.size = size
+        self._next = 0  # Slot the next sample goes in
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, value):
+        self.data[self._next] = value
+        self._next = (self._next + 1) % self.size
+        if self._count < self.size:
+            self._count += 1
+
+    def latest(self):
+        """Most recent sample, None if empty"""
+        if not self._count:
+            return None
+        return self.data[(self._next - 1) % self.size]
+
+    def __iter__(self):
+        """Samples oldest first"""
+        start = (self._next - self._count) % self.size
+        for i in range(self._count):
+            yield self.data[(start + i) % self.size]
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+
+class RunningStats:
+    """Online count/mean/variance/min/max"""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0  # Sum of squared differences from the mean
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return self.variance ** 0.5
+
+
+class P2Quantile:
+    """Streaming estimate of one quantile in five numbers
+
+    The first five samples are kept sorted exactly; after that five markers
+    track the min, the quantile, the max and the two midpoints between, and
+    each new sample nudges them with a parabolic fit. Exact for up to five
+    samples, typically within a few percent of the true quantile after that.
+    """
+
+    def __init__(self, quantile):
+        self.quantile = quantile
+        self.heights = array('f', [0] * 5)  # Marker heights
+        self.positions = array('i', [0] * 5)  # Actual marker positions (1-based)
+        self.desired = array('f', [0] * 5)  # Desired marker positions
+        self.increments = array('f', (0, quantile / 2, quantile, (1 + quantile) / 2, 1))
+        self.count = 0
+
+    def clear(self):
+        self.count = 0
+
+    def add(self, value):
+        heights = self.heights
+        if self.count < 5:
+            # Insertion sort into the first five slots
+            i = self.count
+            while i > 0 and heights[i - 1] > value:
+                heights[i] = heights[i - 1]
+                i -= 1
+            heights[i] = value
+            self.count += 1
+            if self.count == 5:
+                q = self.quantile
+                for i in range(5):
+                    self.positions[i] = i + 1
+                self.desired[0] = 1
+                self.desired[1] = 1 + 2 * q
+                self.desired[2] = 1 + 4 * q
+                self.desired[3] = 3 + 2 * q
+                self.desired[4] = 5
+            return
+
+        self.count += 1
+        positions = self.positions
+
+        # Find the cell the sample falls in, stretching the ends if needed
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards where they should be
+        for i in range(1, 4):
+            drift = self.desired[i] - positions[i]
+            if (drift >= 1 and positions[i + 1] - positions[i] > 1) or \
+                    (drift <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if drift > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, step)
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i, step):
+        h = self.heights
+        n = self.positions
+        return h[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (h[i + 1] - h[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - step) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def _linear(self, i, step):
+        h = self.heights
+        n = self.positions
+        return h[i] + step * (h[i + step] - h[i]) / (n[i + step] - n[i])
+
+    @property
+    def value(self):
+        """Current estimate, None before the first sample"""
+        if self.count == 0:
+            return None
+        if self.count < 5:
+            # Nearest rank over the sorted samples so far
+            return self.heights[min(self.count - 1, int(self.quantile * self.count))]
+        return self.heights[2]
@@ -0,0 +1,194 @@
+# wire_codec.py - Compact binary framing for the SNYPER socket protocol
+#
+# Binary alternative to JSON lines, negotiated per peer during `register`.
+# Every frame is a fixed 11-byte header followed by a TLV payload:
+#
+#   offset  size  field
+#   0       1     marker (0xA5 - never the first byte of a JSON line)
+#   1       1     message type (index into SocketMessage.TYPES)
+#   2       2     sequence number (message ID, u16)
+#   4       1     target index (0xFF = none)
+#   5       4     sender ticks_ms (u32)
+#   9       2     payload length
+#
+# Payload items are: tag (u8), length (u8), value. The tag's top two bits give
+# the value kind and the low six bits index into PAYLOAD_KEYS. Data keys that
+# are not in the table travel together as one JSON-encoded EXTRA item.
+#
+# All multi-byte fields are little-endian.
+
+import json
+import struct
+
+FRAME_MARKER = 0xA5
+HEADER_FORMAT = "<BBHBIH"
+HEADER_SIZE = 11
+MAX_PAYLOAD = 256
+NO_TARGET = 0xFF
+
+# Value kinds (top two bits of a TLV tag)
+KIND_INT = 0
+KIND_STR = 1
+KIND_FLOAT = 2
+KIND_JSON = 3
+
+# Payload key table - APPEND ONLY, the index is the wire tag
+PAYLOAD_KEYS = (
+    "_extra", "status", "message", "duration", "error", "from",
+    "client_id", "codecs", "codec", "index", "ticks_us", "intensity",
+    "reaction_us", "hit_value", "t1", "t2", "t3", "start_us", "delay_ms",
+    "epoch", "hit_threshold", "noise_floor", "travel_ms", "activation",
+)
+_KEY_TAGS = {key: tag for tag, key in enumerate(PAYLOAD_KEYS)}
+_EXTRA_TAG = 0
+
+
+def frame_size(buffer, start=0):
+    """Total frame length for a binary frame header at buffer[start:]"""
+    return HEADER_SIZE + struct.unpack_from("<H", buffer, start + 9)[0]
+
+
+class BinaryCodec:
+    """Encodes SocketMessages into a preallocated buffer and decodes them back
+
+    The memoryview returned by encode() aliases the codec's internal buffer and
+    is only valid until the next encode() call - write it out immediately.
+    """
+
+    def __init__(self, types):
+        self.types = types
+        self.type_codes = {name: code for code, name in enumerate(types)}
+        self.buf = bytearray(HEADER_SIZE + MAX_PAYLOAD)
+        self.view = memoryview(self.buf)
+
+        # Target name <-> index mapping, filled in as targets register
+        self.target_indexes = {}
+        self.target_names = {}
+
+    def bind_target(self, name, index):
+        """Record the wire index used for a target name"""
+        if index is None or name is None:
+            return
+        self.target_indexes[name] = index
+        self.target_names[index] = name
+
+    def encode(self, msg):
+        """Encode a SocketMessage, returning a memoryview of the frame"""
+        if not isinstance(msg.id, int):
+            raise ValueError(f"Binary frames need integer message IDs, got {msg.id!r}")
+
+        buf = self.buf
+        pos = HEADER_SIZE
+        extra = None
+
+        for key, value in msg.data.items():
+            tag = _KEY_TAGS.get(key)
+            if tag is None:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+                continue
+            pos = self._put_item(pos, tag, value)
+
+        if extra:
+            pos = self._put_value(pos, _EXTRA_TAG | (KIND_JSON << 6), json.dumps(extra).encode('utf-8'))
+
+        struct.pack_into(
+            HEADER_FORMAT, buf, 0,
+            FRAME_MARKER,
+            self.type_codes[msg.type],
+            msg.id & 0xFFFF,
+            self.target_indexes.get(msg.target_id, NO_TARGET),
+            msg.timestamp & 0xFFFFFFFF,
+            pos - HEADER_SIZE
+        )
+        return self.view[:pos]
+
+    def _put_item(self, pos, tag, value):
+        """Append one TLV item, choosing the smallest encoding for the value"""
+        if isinstance(value, bool) or value is None:
+            return self._put_value(pos, tag | (KIND_JSON << 6), json.dumps(value).encode('utf-8'))
+
+        if isinstance(value, int):
+            if -0x80 <= value < 0x80:
+                fmt, size = "<b", 1
+            elif -0x8000 <= value < 0x8000:
+                fmt, size = "<h", 2
+            elif -0x80000000 <= value < 0x80000000:
+                fmt, size = "<i", 4
+            else:
+                return self._put_value(pos, tag | (KIND_JSON << 6), json.dumps(value).encode('utf-8'))
+            self._check_room(pos, size)
+            self.buf[pos] = tag | (KIND_INT << 6)
+            self.buf[pos + 1] = size
+            struct.pack_into(fmt, self.buf, pos + 2, value)
+            return pos + 2 + size
+
+        if isinstance(value, float):
+            self._check_room(pos, 4)
+            self.buf[pos] = tag | (KIND_FLOAT << 6)
+            self.buf[pos + 1] = 4
+            struct.pack_into("<f", self.buf, pos + 2, value)
+            return pos + 6
+
+        if isinstance(value, str):
+            return self._put_value(pos, tag | (KIND_STR << 6), value.encode('utf-8'))
+
+        return self._put_value(pos, tag | (KIND_JSON << 6), json.dumps(value).encode('utf-8'))
+
+    def _put_value(self, pos, tag, raw):
+        """Append a TLV item whose value is already bytes"""
+        size = len(raw)
+        if size > 255:
+            raise ValueError(f"Payload field too long for binary frame: {size} bytes")
+        self._check_room(pos, size)
+        self.buf[pos] = tag
+        self.buf[pos + 1] = size
+        self.buf[pos + 2:pos + 2 + size] = raw
+        return pos + 2 + size
+
+    def _check_room(self, pos, size):
+        if pos + 2 + size > len(self.buf):
+            raise ValueError("Message too large for binary frame")
+
+    def decode_header(self, frame):
+        """Unpack the fixed header: (type, seq, target index, ticks, payload length)"""
+        marker, type_code, seq, index, ticks, length = struct.unpack_from(HEADER_FORMAT, frame, 0)
+        if marker != FRAME_MARKER:
+            raise ValueError(f"Bad frame marker: {marker}")
+        if type_code >= len(self.types):
+            raise ValueError(f"Unknown message type code: {type_code}")
+        return type_code, seq, index, ticks, length
+
+    def decode_payload(self, frame, length):
+        """Walk the TLV items of a frame into a data dict"""
+        data = {}
+        pos = HEADER_SIZE
+        end = HEADER_SIZE + length
+
+        while pos < end:
+            tag = frame[pos]
+            size = frame[pos + 1]
+            start = pos + 2
+            pos = start + size
+            if pos > end:
+                raise ValueError("Truncated payload item")
+
+            kind = tag >> 6
+            key_tag = tag & 0x3F
+
+            if kind == KIND_INT:
+                value = struct.unpack_from("<b" if size == 1 else "<h" if size == 2 else "<i", frame, start)[0]
+            elif kind == KIND_FLOAT:
+                value = struct.unpack_from("<f", frame, start)[0]
+            elif kind == KIND_STR:
+                value = bytes(frame[start:pos]).decode('utf-8')
+            else:
+                value = json.loads(bytes(frame[start:pos]))
+
+            if key_tag == _EXTRA_TAG:
+                data.update(value)
+            elif key_tag < len(PAYLOAD_KEYS):
+                data[PAYLOAD_KEYS[key_tag]] = value
+
+        return data
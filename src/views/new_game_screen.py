@@ -8,6 +8,7 @@ import gui.fonts.font14 as font14
 from gui.core.ugui import ssd
 from display.side_buttons import ButtonA, ButtonY
 from views.screen_helpers import navigate_to_main
+from master.game_engine import GAME_RUNNING
 
 class NewGameScreen(Screen):
     """New Game Setup Screen"""
@@ -39,14 +40,38 @@ class NewGameScreen(Screen):
         self.button_y = ButtonY(wri)  # Y = Select indicator
     
     def start_quick_game(self, button, arg):
-        # print("🎮 Starting quick game...")
-        # TODO: Implement game start logic
-        pass
+        print("🎮 Starting quick game...")
+        self._start_game("quick")
         
     def start_custom_game(self, button, arg):
-        # print("🎮 Starting custom game...")
-        # TODO: Implement custom game setup
-        pass
+        print("🎮 Starting custom game...")
+        self._start_game("custom")
+    
+    def _start_game(self, mode):
+        """Plan the game now, play it as a GUI task"""
+        if not self.controller:
+            print("💥 No controller provided to NewGameScreen!")
+            return
+        if self.controller.game.state == GAME_RUNNING:
+            print("⚠️ Game already running")
+            return
+        if not self.controller.get_targets():
+            print("💥 No targets registered - can't start a game!")
+            return
+        
+        # All round planning happens here, before the first target moves
+        self.controller.game.new_plan(mode)
+        self.reg_task(self._do_game_async())
+    
+    async def _do_game_async(self):
+        """Async wrapper for playing the planned game"""
+        try:
+            score = await self.controller.game.run()
+            if score:
+                summary = score.summary()
+                print(f"🏆 {summary['points']} points - {summary['hits']} hits, {summary['misses']} misses")
+        except Exception as e:
+            print(f"💥 Game failed: {e}")
     
     def _back_to_main(self, button):
         """Navigate back to MainScreen - breaks circular reference"""
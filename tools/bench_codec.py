@@ -0,0 +1,94 @@
+# bench_codec.py - Compare JSON lines against binary frames on the host
+#
+# Measures encode and decode cost per message and bytes on the wire for the
+# fixed-shape commands the master and targets exchange most often, then the
+# target's templated reply fast path against building each reply from scratch.
+#
+# Usage: python3 tools/bench_codec.py [iterations]
+
+import gc
+import sys
+import time
+
+import host_shims
+host_shims.install()
+
+from utils.socket_protocol import SocketMessage, MessageLineParser, ResponseTemplate, binary_codec, CODEC_JSON, CODEC_BINARY
+
+SAMPLES = (
+    ("ping", "target_1", {"from": "master"}),
+    ("pong", "target_1", {"status": "alive", "message": "Target reporting for duty!"}),
+    ("stand_up", "target_1", {"from": "master"}),
+    ("activate", "target_1", {"from": "master", "duration": 5}),
+    ("activated", "target_1", {"status": "activation_queued", "duration": 5, "message": "Activation command queued"}),
+)
+
+
+def _time_us(fn, iterations):
+    start = time.ticks_us()
+    for _ in range(iterations):
+        fn()
+    return time.ticks_diff(time.ticks_us(), start) / iterations
+
+
+def _alloc_bytes(fn):
+    """Heap bytes one call allocates (gc.mem_alloc on MicroPython, tracemalloc peak on CPython)"""
+    fn()  # Warm up lazily built state
+    if hasattr(gc, "mem_alloc"):
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        fn()
+        used = gc.mem_alloc() - before
+        gc.enable()
+        return used
+
+    import tracemalloc
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fn()
+    used = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return used
+
+
+def bench_replies(iterations):
+    print(f"\n{'reply':<10} {'codec':<5} {'build us':>9} {'tmpl us':>8} {'build B':>8} {'tmpl B':>7}")
+
+    for msg_type, target_id, data in SAMPLES:
+        if msg_type not in ("pong", "activated"):
+            continue
+        template = ResponseTemplate(msg_type, target_id, data)
+        for codec in (CODEC_JSON, CODEC_BINARY):
+            build = lambda: SocketMessage(msg_type, msg_id=42, target_id=target_id, data=dict(data)).encode(codec)
+            render = lambda: template.render(42, codec)
+
+            parser = MessageLineParser()
+            decoded = parser.feed(bytes(render()))[0]
+            assert decoded.type == msg_type and decoded.id == 42 and decoded.data == data, decoded.data
+
+            print(f"{msg_type:<10} {codec:<5} {_time_us(build, iterations):>9.1f} {_time_us(render, iterations):>8.1f} "
+                  f"{_alloc_bytes(build):>8} {_alloc_bytes(render):>7}")
+
+
+def bench(iterations):
+    binary_codec.bind_target("target_1", 0)
+    print(f"{'message':<10} {'codec':<5} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+
+    for msg_type, target_id, data in SAMPLES:
+        msg = SocketMessage(msg_type, target_id=target_id, data=data)
+        for codec in (CODEC_JSON, CODEC_BINARY):
+            wire = bytes(msg.encode(codec))
+            parser = MessageLineParser()
+            encode_us = _time_us(lambda: msg.encode(codec), iterations)
+            decode_us = _time_us(lambda: parser.feed(wire), iterations)
+
+            decoded = parser.feed(wire)[0]
+            assert decoded.type == msg.type and decoded.id == msg.id and decoded.data == data, decoded.data
+            print(f"{msg_type:<10} {codec:<5} {len(wire):>6} {encode_us:>10.1f} {decode_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    bench(iterations)
+    bench_replies(iterations)
@@ -0,0 +1,232 @@
+# bench_hit_detector.py - Hit detection quality and cost over piezo traces
+#
+# Plays piezo traces through PiezoSampler + HitDetector exactly as a target
+# does, and through a model of the old detection (one read_u16() against
+# hit_threshold every pass of a 10ms polling loop that the socket server
+# sometimes delays), then reports per trace kind:
+#
+#   detected   hits found within 15ms of their onset
+#   false +    detections with no hit there
+#   err ms     mean hit timestamp error against the true onset
+#
+# followed by the detector's cost per sample. Traces are synthesised from a
+# fixed seed - clean hits, light hits, servo vibration with current glitches,
+# lone glitches and a drifting bias - or read from recorded files given on
+# the command line: one ADC sample per line at --rate, with a line reading
+# "hit" just before each true onset.
+#
+# Usage: python3 tools/bench_hit_detector.py [--rate=2000] [--traces=40] [recorded.txt ...]
+
+import math
+import random
+import sys
+import time
+
+import host_shims
+host_shims.install()
+
+from target.piezo_sampler import PiezoSampler, WaveformSource
+from target.hit_detector import HitDetector
+
+THRESHOLD = 10000  # hit_threshold default
+MATCH_MS = 15  # A detection this long after an onset (or 2ms before) finds it
+POLL_MS = 10  # Old activate loop period
+SCAN_MS = 10  # How often wait_for_hit scans the ring
+
+
+class Trace:
+    def __init__(self, kind, rate, length_ms):
+        self.kind = kind
+        self.rate = rate
+        self.samples = [0] * (rate * length_ms // 1000)
+        self.onsets = []  # Sample index of each true hit
+
+    def add(self, index, value):
+        if 0 <= index < len(self.samples):
+            self.samples[index] += value
+
+    def finish(self):
+        for i, value in enumerate(self.samples):
+            self.samples[i] = min(65535, max(0, int(value)))
+        return self
+
+
+def _background(trace, bias, noise, drift_to=None):
+    count = len(trace.samples)
+    for i in range(count):
+        level = bias if drift_to is None else bias + (drift_to - bias) * i / count
+        trace.samples[i] = level + random.uniform(-noise, noise)
+
+
+def _hit(trace, index, amplitude):
+    """Sharp onset, ringing decay - a pellet on a steel plate"""
+    freq = random.uniform(500, 900)
+    tau_ms = random.uniform(2, 6)
+    for k in range(int(trace.rate * tau_ms * 5 / 1000)):
+        t = k / trace.rate
+        trace.add(index + k, amplitude * math.exp(-t * 1000 / tau_ms) * math.sin(2 * math.pi * freq * t + 1.2))
+    trace.onsets.append(index)
+
+
+def _glitches(trace, count):
+    """One- or two-sample spikes from the servo's current draw"""
+    for _ in range(count):
+        index = random.randrange(len(trace.samples))
+        height = random.uniform(15000, 50000)
+        for k in range(random.choice((1, 1, 2))):
+            trace.add(index + k, height)
+
+
+def synth_traces(rate, per_kind, length_ms=1500):
+    random.seed(1234)
+    traces = []
+    margin = rate // 5
+    for kind in ("hit", "light_hit", "servo", "glitch", "drift"):
+        for _ in range(per_kind):
+            trace = Trace(kind, rate, length_ms)
+            count = len(trace.samples)
+            if kind == "drift":
+                _background(trace, 1500, 800, drift_to=9800)
+            else:
+                _background(trace, 1500, 300)
+            if kind == "hit":
+                _hit(trace, random.randrange(margin, count - margin), random.uniform(14000, 60000))
+            elif kind == "light_hit":
+                _hit(trace, random.randrange(margin, count - margin), random.uniform(11000, 16000))
+            elif kind == "servo":
+                freq = random.uniform(60, 120)
+                amplitude = random.uniform(800, 4000)
+                for i in range(count):
+                    trace.add(i, amplitude * math.sin(2 * math.pi * freq * i / rate))
+                _glitches(trace, random.randrange(2, 6))
+            elif kind == "glitch":
+                _glitches(trace, random.randrange(3, 9))
+            traces.append(trace.finish())
+    return traces
+
+
+def load_trace(path, rate):
+    trace = Trace(path.rsplit("/", 1)[-1], rate, 0)
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line == "hit":
+                trace.onsets.append(len(trace.samples))
+            elif line:
+                trace.samples.append(int(line))
+    return trace
+
+
+def detect_new(trace):
+    """Sample indexes the sampler + detector report, scanning every SCAN_MS"""
+    sampler = PiezoSampler(WaveformSource(trace.samples), trace.rate)
+    detector = HitDetector(THRESHOLD, window=8 * trace.rate // 1000, refractory=150 * trace.rate // 1000)
+    sampler.tick(64)
+    detector.reset(sampler.mean(), sampler.mean_deviation())
+    found = []
+    step = trace.rate * SCAN_MS // 1000
+    for _ in range(64, len(trace.samples), step):
+        sampler.tick(step)
+        hit = sampler.scan(detector)
+        while hit is not None:
+            found.append(hit)
+            hit = sampler.scan(detector)
+    return found
+
+
+def detect_old(trace):
+    """Sample indexes an old-style poll reports, with the loop sometimes held up"""
+    found = []
+    index = 64
+    while index < len(trace.samples):
+        if trace.samples[index] > THRESHOLD:
+            found.append(index)
+            index += 150 * trace.rate // 1000  # Lowered and re-raised
+        late_ms = random.uniform(5, 40) if random.random() < 0.3 else 0
+        index += int((POLL_MS + late_ms) * trace.rate / 1000)
+    return found
+
+
+def score(trace, found):
+    """(hits found, false positives, summed timestamp error in samples)"""
+    early = 2 * trace.rate // 1000
+    late = MATCH_MS * trace.rate // 1000
+    unmatched = list(found)
+    detected = 0
+    error = 0
+    for onset in trace.onsets:
+        for index in unmatched:
+            if onset - early <= index <= onset + late:
+                unmatched.remove(index)
+                detected += 1
+                error += abs(index - onset)
+                break
+    return detected, len(unmatched), error
+
+
+def bench_cost(rate, seconds=5):
+    """Microseconds of detector work per sample, over noise with the odd hit"""
+    random.seed(99)
+    trace = Trace("cost", rate, 1000)
+    _background(trace, 1500, 300)
+    _hit(trace, rate // 2, 30000)
+    trace.finish()
+    sampler = PiezoSampler(WaveformSource(trace.samples * seconds), rate, 512)
+    detector = HitDetector(THRESHOLD, window=8 * rate // 1000, refractory=150 * rate // 1000)
+    total = rate * seconds
+    step = rate * SCAN_MS // 1000
+    spent = 0
+    for _ in range(0, total, step):
+        sampler.tick(step)
+        start = time.ticks_us()
+        while sampler.scan(detector) is not None:
+            pass
+        spent += time.ticks_diff(time.ticks_us(), start)
+    per_sample = spent / total
+    print(f"\ncost: {per_sample:.2f}us per sample on this machine = {per_sample * rate / 10000:.2f}% of a core at {rate}Hz")
+
+
+def main():
+    rate = 2000
+    per_kind = 40
+    paths = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--rate="):
+            rate = int(arg[7:])
+        elif arg.startswith("--traces="):
+            per_kind = int(arg[9:])
+        else:
+            paths.append(arg)
+
+    traces = [load_trace(path, rate) for path in paths] if paths else synth_traces(rate, per_kind)
+    kinds = []
+    totals = {}
+    random.seed(42)
+    for trace in traces:
+        if trace.kind not in totals:
+            kinds.append(trace.kind)
+            totals[trace.kind] = [0, 0, 0, 0, 0, 0, 0]  # hits, new: found/fp/err, old: found/fp/err
+        row = totals[trace.kind]
+        row[0] += len(trace.onsets)
+        for offset, found in ((1, detect_new(trace)), (4, detect_old(trace))):
+            detected, false_positives, error = score(trace, found)
+            row[offset] += detected
+            row[offset + 1] += false_positives
+            row[offset + 2] += error
+
+    ms_per_sample = 1000 / rate
+    print(f"{'trace':<10} {'hits':>5} | {'detector':^24} | {'threshold poll':^24}")
+    print(f"{'':<10} {'':>5} | {'detected':>9} {'false +':>7} {'err ms':>6} | {'detected':>9} {'false +':>7} {'err ms':>6}")
+    for kind in kinds:
+        hits, new_found, new_fp, new_err, old_found, old_fp, old_err = totals[kind]
+        cells = []
+        for found, fp, err in ((new_found, new_fp, new_err), (old_found, old_fp, old_err)):
+            rate_text = f"{100 * found / hits:.0f}%" if hits else "-"
+            err_text = f"{err * ms_per_sample / found:.1f}" if found else "-"
+            cells.append(f"{rate_text:>9} {fp:>7} {err_text:>6}")
+        print(f"{kind:<10} {hits:>5} | {cells[0]} | {cells[1]}")
+
+    bench_cost(rate)
+
+
+main()
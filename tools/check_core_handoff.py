@@ -0,0 +1,148 @@
+# check_core_handoff.py - Exercise the core 0 -> core 1 display handoff on two threads
+#
+# Runs display/core1_refresh.py with a host thread standing in for core 1
+# and a fake panel that takes a few ms per push, like the SPI transfer:
+#
+#   ring    a producer thread floods a small CommandRing while the consumer
+#           drains it slowly - every command must arrive once, in order
+#   frames  the uasyncio loop draws numbered frames as fast as ugui would and
+#           hands them off with do_refresh - every push must be one whole
+#           frame, frame numbers must only go up, the last frame must reach
+#           the panel, core 0 must never block on a push, and it must copy
+#           no faster than the panel takes frames
+#   show    ssd.show() pushes from core 0 without tearing a core 1 push
+#
+# Works on CPython and on the MicroPython unix port (both have _thread).
+#
+# Usage: python3 tools/check_core_handoff.py [frames]
+
+import sys
+import time
+import _thread
+
+import host_shims
+host_shims.install()
+
+import uasyncio
+from display.core1_refresh import CommandRing, Core1Refresh, CMD_FRAME
+
+FRAME_SIZE = 240 * 120  # 240x240 at 4 bits per pixel
+PUSH_MS = 8  # Simulated SPI time per frame
+
+failures = []
+
+
+def check(ok, message):
+    print(("✅ " if ok else "💥 ") + message)
+    if not ok:
+        failures.append(message)
+
+
+def check_ring(count=20000):
+    ring = CommandRing(4)
+    done = [False]
+
+    def producer():
+        for i in range(1, count + 1):
+            while not ring.put(CMD_FRAME, i):
+                time.sleep_us(10)
+        done[0] = True
+
+    _thread.start_new_thread(producer, ())
+    expected = 1
+    in_order = True
+    while expected <= count:
+        item = ring.get()
+        if item is None:
+            time.sleep_us(10)
+            continue
+        if item != (CMD_FRAME, expected):
+            in_order = False
+            break
+        expected += 1
+    while not done[0]:
+        time.sleep_ms(1)
+    check(in_order and expected == count + 1 and ring.get() is None,
+          f"ring: {count} commands through 4 slots, once each and in order")
+
+
+class FakePanel:
+    """Checks each pushed frame is whole, the way the panel would show it"""
+
+    def __init__(self):
+        self.frames = []  # Frame numbers in push order
+        self.torn = 0
+
+    def push(self, buf):
+        first = buf[0]
+        time.sleep_ms(PUSH_MS // 2)  # Half the "SPI transfer" - core 0 keeps drawing
+        middle = buf[len(buf) // 2]
+        time.sleep_ms(PUSH_MS - PUSH_MS // 2)
+        last = buf[len(buf) - 1]
+        if not first == middle == last:
+            self.torn += 1
+        self.frames.append(first)
+
+
+async def check_frames(count):
+    panel = FakePanel()
+    front = bytearray(FRAME_SIZE)
+    refresh = Core1Refresh(panel.push, memoryview(front), idle_ms=1)
+    refresh.start()
+
+    # Time the synchronous part of each handoff - the only time core 0 is held
+    publish = refresh.publish
+    slowest = [0]
+    copies = [0]
+
+    def timed_publish():
+        start = time.ticks_us()
+        done = publish()
+        slowest[0] = max(slowest[0], time.ticks_diff(time.ticks_us(), start))
+        copies[0] += done
+        return done
+
+    refresh.publish = timed_publish
+
+    for frame in range(1, count + 1):
+        value = frame % 256
+        for i in range(0, FRAME_SIZE, 4096):  # "Draw" - in chunks like widgets do
+            end = min(i + 4096, FRAME_SIZE)
+            front[i:end] = bytes([value]) * (end - i)
+        await refresh.do_refresh()
+        await uasyncio.sleep_ms(0)  # ugui's auto_refresh goes straight round again
+
+    # Let core 1 catch up, then blank the screen the way ugui shuts down
+    deadline = time.ticks_add(time.ticks_ms(), 2000)
+    while (not panel.frames or panel.frames[-1] != count % 256) and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+        await uasyncio.sleep_ms(5)
+    last_frame = panel.frames[-1] if panel.frames else None
+    front[:] = bytes(FRAME_SIZE)
+    refresh.show()
+    blanked = panel.frames[-1] == 0
+    refresh.stop()
+    while refresh.running:
+        await uasyncio.sleep_ms(1)
+
+    pushed = panel.frames[:-1]  # The last one is show()'s blank frame
+    rising = all((b - a) % 256 < 128 and a != b for a, b in zip(pushed, pushed[1:]))
+    check(panel.torn == 0, f"frames: {len(pushed)} pushed for {count} drawn, {panel.torn} torn")
+    check(rising, "frames: numbers only go up")
+    check(last_frame == count % 256, "frames: the last frame reached the panel")
+    check(slowest[0] < PUSH_MS * 1000 // 2, f"frames: core 0 held at most {slowest[0]}us per handoff (a push takes {PUSH_MS}ms)")
+    check(copies[0] <= len(pushed) + 1, f"frames: {copies[0]} copies for {len(pushed)} pushes - paced by the panel")
+    check(blanked and panel.torn == 0, "show: blank frame pushed from core 0 after the last core 1 push")
+    print(f"   core 0 found core 1 mid-push {refresh.retries} times and yielded")
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    check_ring()
+    uasyncio.run(check_frames(frames))
+    if failures:
+        print(f"💥 {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("🎉 Handoff checks passed")
+
+
+main()
@@ -0,0 +1,214 @@
+# host_shims.py - Run SNYPER modules on a host Python for benchmarks and tests
+#
+# Installs the MicroPython-only pieces the src/ tree relies on (time.ticks_*,
+# uasyncio, asyncio.sleep_ms, ThreadSafeFlag, the IO queue) so CPython can
+# import it. Under the MicroPython
+# unix port these already exist and nothing is patched. Tools that import the
+# master or target modules also call install_device_stubs() for the Pico-only
+# network/machine modules.
+#
+# Usage (from a script in tools/):
+#     import host_shims
+#     host_shims.install()
+
+import os
+import sys
+import time
+
+# No os.path on the unix port - tools/ and src/ are siblings
+_TOOLS_DIR = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+SRC_DIR = _TOOLS_DIR + "/../src"
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALF = _TICKS_PERIOD // 2
+
+
+def _install_ticks():
+    """Add MicroPython's wrapping ticks functions to the time module"""
+    if hasattr(time, "ticks_ms"):
+        return
+
+    origin = time.perf_counter_ns()
+
+    def ticks_ms():
+        return ((time.perf_counter_ns() - origin) // 1000000) & _TICKS_MAX
+
+    def ticks_us():
+        return ((time.perf_counter_ns() - origin) // 1000) & _TICKS_MAX
+
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & _TICKS_MAX
+
+    def ticks_diff(end, start):
+        diff = (end - start) & _TICKS_MAX
+        return diff - _TICKS_PERIOD if diff >= _TICKS_HALF else diff
+
+    time.ticks_ms = ticks_ms
+    time.ticks_us = ticks_us
+    time.ticks_add = ticks_add
+    time.ticks_diff = ticks_diff
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+
+
+class _HostIOQueue:
+    """uasyncio.core._io_queue on top of the running loop's add_reader"""
+
+    def queue_read(self, sock):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def ready():
+            if not future.done():
+                future.set_result(None)
+
+        loop.add_reader(sock, ready)
+        future.add_done_callback(lambda _: loop.remove_reader(sock))
+        # Yielded bare rather than awaited, the way uasyncio's streams do it
+        future._asyncio_future_blocking = True
+        return future
+
+
+class _ThreadSafeFlag:
+    """uasyncio.ThreadSafeFlag - set() from any thread wakes the task in wait()"""
+
+    def __init__(self):
+        import threading
+
+        self._lock = threading.Lock()
+        self._flag = False
+        self._waiter = None  # (loop, future) of the task in wait()
+
+    def set(self):
+        with self._lock:
+            self._flag = True
+            waiter = self._waiter
+        if waiter:
+            loop, future = waiter
+            try:
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+            except RuntimeError:
+                pass  # Loop already closed - nobody left to wake
+
+    def clear(self):
+        with self._lock:
+            self._flag = False
+
+    async def wait(self):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._flag:
+                    self._flag = False
+                    self._waiter = None
+                    return
+                future = loop.create_future()
+                self._waiter = (loop, future)
+            await future
+
+
+def _install_asyncio():
+    """Alias uasyncio to asyncio and add the MicroPython-only helpers"""
+    import asyncio
+    import types
+
+    if not hasattr(asyncio, "sleep_ms"):
+        asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+        asyncio.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+    if not hasattr(asyncio, "ThreadSafeFlag"):
+        asyncio.ThreadSafeFlag = _ThreadSafeFlag
+    if not hasattr(asyncio, "core"):
+        asyncio.core = types.SimpleNamespace(_io_queue=_HostIOQueue())
+    sys.modules.setdefault("uasyncio", asyncio)
+
+
+def install_device_stubs():
+    """Stand in for the Pico-only network and machine modules
+
+    Just enough surface for the src/ tree to import - anything that would
+    touch real hardware (WiFi bring-up, pins, PWM) is a no-op. Modules that
+    really exist (e.g. on the unix port) are left alone.
+    """
+    import types
+
+    try:
+        import network  # noqa: F401
+    except ImportError:
+        network = types.ModuleType("network")
+        network.STA_IF = 0
+        network.AP_IF = 1
+
+        class WLAN:
+            def __init__(self, interface=0):
+                self.interface = interface
+                self._active = False
+
+            def active(self, value=None):
+                if value is not None:
+                    self._active = bool(value)
+                return self._active
+
+            def config(self, *args, **kwargs):
+                return None
+
+            def connect(self, *args, **kwargs):
+                pass
+
+            def disconnect(self):
+                pass
+
+            def isconnected(self):
+                return True
+
+            def status(self):
+                return 3
+
+            def ifconfig(self, *args):
+                return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
+
+        network.WLAN = WLAN
+        sys.modules["network"] = network
+
+    try:
+        import machine  # noqa: F401
+    except ImportError:
+        machine = types.ModuleType("machine")
+
+        class _Peripheral:
+            """Accepts any constructor and method call, reads back as zero"""
+
+            IN = OUT = PULL_UP = PULL_DOWN = IRQ_RISING = IRQ_FALLING = 0
+            ONE_SHOT = PERIODIC = 0
+
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def __call__(self, *args, **kwargs):
+                return 0
+
+            def __getattr__(self, name):
+                return self
+
+        machine.Pin = machine.PWM = machine.ADC = machine.Timer = machine.I2C = machine.SPI = _Peripheral
+        machine.freq = lambda *args: 125000000
+        machine.reset = lambda: sys.exit(0)
+        machine.unique_id = lambda: b"\x00" * 8
+        sys.modules["machine"] = machine
+
+
+def install():
+    """Patch the host runtime and put src/ on the import path
+
+    config.config reads config/config.json relative to the working directory,
+    so the working directory is switched to src/ as well.
+    """
+    _install_ticks()
+    _install_asyncio()
+    if SRC_DIR not in sys.path:
+        sys.path.insert(0, SRC_DIR)
+    os.chdir(SRC_DIR)
@@ -0,0 +1,383 @@
+# load_test.py - Drive a real MasterController against hundreds of fake targets
+#
+# The master side is the real MasterController/MasterServer on 127.0.0.1.
+# Fake targets are real TargetServer instances running in a child process,
+# each bound to its own loopback address (127.0.1.x), so the master sees one
+# IP per target exactly as it would on the AP subnet. Keeping them out of the
+# master's process means the latency and allocation numbers below belong to
+# the master alone.
+#
+# Phases: registration, ping sweeps, activate_all rounds (targets push a hit
+# or miss back for each activation). Reported per phase: p50/p99 per-command
+# latency, commands per second, failures, and master-side allocations.
+#
+# With --lead-ms the clocks are synced first and rounds are scheduled that far
+# ahead; the report then adds how far apart the targets actually rose.
+#
+# Usage: python3 tools/load_test.py [--targets=200] [--sweeps=20] [--rate=5]
+#                                   [--activations=5] [--hit-rate=0.5]
+#                                   [--lead-ms=0] [--broadcast] [--verbose]
+#
+# Needs CPython (binding each fake target's source address and spawning the
+# child process are not available on the unix port). Linux routes all of
+# 127.0.0.0/8 to loopback out of the box; on macOS add aliases first.
+
+import builtins
+import contextvars
+import os
+import random
+import subprocess
+import sys
+import time
+
+# install() switches to src/, so remember where this script lives first
+SCRIPT_PATH = os.path.abspath(__file__)
+
+# The src/ tree narrates every message - keep that out of the report
+_print = builtins.print
+if "--verbose" not in sys.argv:
+    builtins.print = lambda *args, **kwargs: None
+
+import host_shims
+host_shims.install()
+host_shims.install_device_stubs()
+
+import asyncio
+import gc
+import tracemalloc
+
+from config.config import config
+
+MASTER_IP = "127.0.0.1"
+PORT = 18200
+BROADCAST_PORT = 18210
+BROADCAST_IP = "127.255.255.255"
+
+def target_ip(n):
+    """Loopback address of fake target n"""
+    return f"127.0.{1 + n // 250}.{1 + n % 250}"
+
+
+def configure(broadcast, targets):
+    config.set('port', PORT)
+    # Every fake target holds a stream open to the master
+    config.set('max_clients', targets + 8)
+    config.set('server_ip', MASTER_IP)
+    config.set('broadcast', broadcast)
+    config.set('broadcast_port', BROADCAST_PORT)
+    config.set('broadcast_ip', BROADCAST_IP)
+
+
+def parse_options(argv):
+    options = {
+        "targets": 200, "sweeps": 20, "rate": 5.0, "activations": 5,
+        "hit-rate": 0.5, "lead-ms": 0, "broadcast": False, "verbose": False, "serve-targets": None,
+    }
+    for arg in argv:
+        key, _, value = arg.lstrip("-").partition("=")
+        if key not in options:
+            raise SystemExit(f"Unknown option: {arg}")
+        default = options[key]
+        if isinstance(default, bool):
+            options[key] = True
+        elif isinstance(default, float):
+            options[key] = float(value)
+        else:
+            options[key] = int(value)
+    return options
+
+
+# ---------------------------------------------------------------------------
+# Fake targets (child process)
+
+# Outbound connections made inside a fake target's tasks bind its own IP
+_source_ip = contextvars.ContextVar("source_ip", default=None)
+_open_connection = asyncio.open_connection
+
+
+def _bound_open_connection(host, port, **kwargs):
+    ip = _source_ip.get()
+    if ip is not None:
+        kwargs.setdefault("local_addr", (ip, 0))
+    return _open_connection(host, port, **kwargs)
+
+
+async def serve_targets(count, hit_rate, broadcast):
+    from target.target_server import TargetServer
+    from target.target_events import target_event_queue
+    from utils.broadcast import BroadcastListener
+
+    asyncio.open_connection = _bound_open_connection
+
+    class FakeTarget(TargetServer):
+        """Real target protocol handlers, no hardware - activations end in a random hit or miss"""
+
+        def __init__(self, n):
+            super().__init__()
+            self.node_id = f"target_{n + 1}"
+            self.ip = target_ip(n)
+
+        async def _handle_activate_command(self, message, writer):
+            received_us = time.ticks_us()
+            await super()._handle_activate_command(message, writer)
+            start_us = message.data.get("start_us")
+            if start_us is None and message.data.get("delay_ms") is not None:
+                start_us = time.ticks_add(received_us, message.data["delay_ms"] * 1000)
+            asyncio.create_task(self._simulate_result(message.data.get("duration", 5), start_us,
+                                                      message.data.get("activation")))
+
+        async def _simulate_result(self, duration, start_us=None, activation=None):
+            _source_ip.set(self.ip)
+            if start_us is not None:
+                # Same wait as TargetController.activate, minus the hardware
+                remaining = time.ticks_diff(start_us, time.ticks_us())
+                if remaining > 2000:
+                    await asyncio.sleep_ms(remaining // 1000 - 1)
+                while time.ticks_diff(start_us, time.ticks_us()) > 0:
+                    await asyncio.sleep_ms(0)
+            start_us = time.ticks_us()
+            hit = random.random() < hit_rate
+            delay_ms = random.randint(50, 400) if hit else duration * 1000
+            await asyncio.sleep_ms(delay_ms)
+            await self.report_result(
+                random.randint(1, 10) if hit else 0,
+                ticks_us=time.ticks_us(),
+                reaction_us=time.ticks_diff(time.ticks_us(), start_us),
+                intensity=random.randint(1000, 30000) if hit else 0,
+                activation=activation
+            )
+
+        async def run(self):
+            _source_ip.set(self.ip)
+            await self.start_socket_server(self.ip)
+            while not await self.register_with_master_socket():
+                await asyncio.sleep_ms(500)
+            if broadcast:
+                asyncio.create_task(BroadcastListener(self.node_id, self._handle_message).run())
+
+    async def drain_events():
+        # Stand-in for TargetController - nothing moves, the events just go away
+        while True:
+            await target_event_queue.get()
+
+    asyncio.create_task(drain_events())
+    targets = [FakeTarget(n) for n in range(count)]
+    for target in targets:
+        asyncio.create_task(target.run())
+    await asyncio.Event().wait()
+
+
+# ---------------------------------------------------------------------------
+# Master side (this process)
+
+class AllocationMeter:
+    """Master-side allocation pressure for one phase
+
+    tracemalloc gives the peak traced memory above the phase's starting point
+    and the blocks still alive at the end; the generation-0 collection count
+    tracks how many container objects were churned through.
+    """
+
+    def start(self):
+        gc.collect()
+        self.gen0 = gc.get_stats()[0]["collections"]
+        tracemalloc.reset_peak()
+        self.base, _ = tracemalloc.get_traced_memory()
+        self.base_blocks = sys.getallocatedblocks()
+
+    def stop(self):
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "peak_kb": (peak - self.base) / 1024,
+            "net_blocks": sys.getallocatedblocks() - self.base_blocks,
+            "gen0": gc.get_stats()[0]["collections"] - self.gen0,
+        }
+
+
+class LatencyRecorder:
+    """Wraps MasterServer.send_message to time every command it sends"""
+
+    def __init__(self, server):
+        self.samples = []
+        self.failures = 0
+        send_message = server.send_message
+
+        async def timed_send_message(command_msg, target_ip, port=None, timeout=5):
+            start = time.ticks_us()
+            result = await send_message(command_msg, target_ip, port, timeout)
+            self.samples.append(time.ticks_diff(time.ticks_us(), start))
+            if result["status"] == "failed":
+                self.failures += 1
+            return result
+
+        server.send_message = timed_send_message
+
+    def reset(self):
+        self.samples = []
+        self.failures = 0
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))]
+
+
+def report(name, count, elapsed_us, samples, failures, allocations):
+    samples = sorted(samples)
+    per_second = count * 1000000 / elapsed_us if elapsed_us else 0
+    if samples:
+        p50 = f"{percentile(samples, 0.5) / 1000:>9.2f}"
+        p99 = f"{percentile(samples, 0.99) / 1000:>9.2f}"
+    else:
+        p50 = p99 = f"{'-':>9}"
+    _print(
+        f"{name:<12} {count:>7} {failures:>6} {p50} {p99} {per_second:>9.0f} "
+        f"{allocations['peak_kb']:>8.1f} {allocations['net_blocks']:>8} {allocations['gen0']:>6}"
+    )
+
+
+async def run_master(options, child):
+    from master.master_controller import MasterController
+    from utils.broadcast import BroadcastChannel
+
+    count = options["targets"]
+    controller = MasterController()
+    await controller.server.start_socket_server(MASTER_IP)
+    if options["broadcast"]:
+        controller.server.broadcast = BroadcastChannel()
+        controller.server.broadcast.open()
+
+    results = []
+
+    async def on_result(result):
+        results.append(result)
+
+    controller.add_result_listener(on_result)
+    recorder = LatencyRecorder(controller.server)
+    meter = AllocationMeter()
+
+    _print(f"{'phase':<12} {'cmds':>7} {'fails':>6} {'p50 ms':>9} {'p99 ms':>9} {'cmd/s':>9} "
+           f"{'peak KB':>8} {'blocks':>8} {'gen0':>6}")
+
+    # Registration - the child registers everything as fast as it can
+    register_times = []
+    register_target = controller.register_target
+
+    def timed_register(client_id, client_ip):
+        register_times.append(time.ticks_us())
+        return register_target(client_id, client_ip)
+
+    controller.server.on_target_register = timed_register
+    meter.start()
+    start = time.ticks_us()
+    deadline = time.ticks_add(time.ticks_ms(), 30000 + count * 50)
+    while len(controller.targets) < count:
+        if time.ticks_diff(deadline, time.ticks_ms()) <= 0:
+            _print(f"⏰ Only {len(controller.targets)}/{count} targets registered")
+            break
+        await asyncio.sleep_ms(20)
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+    gaps = [time.ticks_diff(b, a) for a, b in zip(register_times, register_times[1:])]
+    report("register", len(controller.targets), elapsed, gaps, count - len(controller.targets), meter.stop())
+
+    # Ping sweeps at the requested rate
+    recorder.reset()
+    meter.start()
+    start = time.ticks_us()
+    for _ in range(options["sweeps"]):
+        sweep_start = time.ticks_ms()
+        await controller.ping_targets()
+        remaining = int(1000 / options["rate"]) - time.ticks_diff(time.ticks_ms(), sweep_start)
+        if remaining > 0:
+            await asyncio.sleep_ms(remaining)
+    report("ping", len(recorder.samples), time.ticks_diff(time.ticks_us(), start),
+           recorder.samples, recorder.failures, meter.stop())
+
+    # Scheduled rounds need a clock estimate per target first
+    lead_ms = options["lead-ms"]
+    if lead_ms:
+        for _ in range(3):
+            for name in controller.get_targets():
+                await controller.clock_sync.sync_target(name, controller.targets.ip_of(name))
+        errors = [controller.clock_error_us(name) for name in controller.get_targets()]
+        synced = [e for e in errors if e is not None]
+        _print(f"🕐 {len(synced)}/{count} clocks synced, worst error bound "
+               f"{max(synced) if synced else '-'} us")
+
+    # activate_all rounds - fan-out latency per round, then wait for the pushes
+    recorder.reset()
+    round_samples = []
+    round_starts = []
+    meter.start()
+    start = time.ticks_us()
+    for _ in range(options["activations"]):
+        round_start = time.ticks_us()
+        round_results = await controller.activate_all(1, lead_ms=lead_ms)
+        round_samples.append(time.ticks_diff(time.ticks_us(), round_start))
+        round_starts.append(controller.round_start_us)
+        if lead_ms:
+            # Keep rounds apart so each target's rise belongs to one round
+            await asyncio.sleep_ms(lead_ms + 1500)
+        recorder.failures += sum(1 for r in round_results.values() if r["status"] == "failed")
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+    commands = options["activations"] * count
+    allocations = meter.stop()
+    # Broadcast acks never pass through send_message, so rounds are timed too
+    report("activate", commands, elapsed, recorder.samples, recorder.failures, allocations)
+    report("activate_all", options["activations"], elapsed, round_samples, 0, allocations)
+
+    expected = commands - recorder.failures
+    deadline = time.ticks_add(time.ticks_ms(), 3000)
+    while len(results) < expected and time.ticks_diff(deadline, time.ticks_ms()) > 0:
+        await asyncio.sleep_ms(50)
+    hits = sum(1 for r in results if r["hit"])
+    _print(f"\n📊 {len(results)}/{expected} results pushed back ({hits} hits), "
+           f"{len(controller.server.pool._connections)} pooled connections")
+
+    if lead_ms:
+        # Rise time in master clock = pushed timestamp - reaction, against the
+        # round's scheduled start
+        offsets = []
+        for result in results:
+            if result["master_us"] is None:
+                continue
+            rose = time.ticks_add(result["master_us"], -result["reaction_us"])
+            offsets.append(min((time.ticks_diff(rose, s) for s in round_starts), key=abs))
+        if offsets:
+            offsets.sort()
+            _print(f"🎯 Start vs schedule: p50 {percentile(offsets, 0.5) / 1000:.2f} ms, "
+                   f"spread {(offsets[-1] - offsets[0]) / 1000:.2f} ms over {len(offsets)} rises")
+
+    # Let the targets hang up first so the master's client handlers exit cleanly
+    child.terminate()
+    await asyncio.sleep_ms(200)
+    await controller.server.pool.close_all()
+    controller.server.socket_server.close()
+
+
+def main():
+    options = parse_options(sys.argv[1:])
+    configure(options["broadcast"], options["targets"])
+
+    if options["serve-targets"] is not None:
+        asyncio.run(serve_targets(options["serve-targets"], options["hit-rate"], options["broadcast"]))
+        return
+
+    child_args = [f"--serve-targets={options['targets']}", f"--hit-rate={options['hit-rate']}"]
+    if options["broadcast"]:
+        child_args.append("--broadcast")
+    if options["verbose"]:
+        child_args.append("--verbose")
+
+    tracemalloc.start()
+    child = subprocess.Popen([sys.executable, SCRIPT_PATH] + child_args)
+    try:
+        asyncio.run(run_master(options, child))
+    finally:
+        child.terminate()
+        child.wait()
+
+
+if __name__ == "__main__":
+    main()
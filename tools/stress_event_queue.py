@@ -0,0 +1,194 @@
+# stress_event_queue.py - Hammer the target event queue with bursty producers
+#
+# Runs target/target_events.py's EventQueue the way a busy target does -
+# several server connections putting commands in bursts while the controller
+# drains them, sometimes slowly - and checks:
+#
+#   order      events come out in the order they went in, across producers
+#   once       every activation comes out exactly once (they never coalesce)
+#   coalesce   only up/down commands are ever replaced, and the newest one
+#              put is always carried out
+#   wakeups    a consumer waiting on an empty queue wakes for every put
+#   full       a full level raises QueueFull, a pose command still coalesces
+#              into it, and there is room again after a get
+#   priority   urgent events overtake normal ones, FIFO within each level
+#
+# then reports end-to-end events/s and the cost of a put + get.
+#
+# Usage: python3 tools/stress_event_queue.py [events_per_producer] [producers]
+
+import random
+import sys
+import time
+
+import host_shims
+host_shims.install()
+
+import uasyncio
+from target.target_events import (EventQueue, QueueFull, TargetEvent, PRIORITY_URGENT,
+                                  HTTP_COMMAND_UP, HTTP_COMMAND_DOWN, HTTP_COMMAND_ACTIVATE)
+
+POSES = (HTTP_COMMAND_UP, HTTP_COMMAND_DOWN)
+
+failures = []
+
+
+def check(ok, message):
+    print(("✅ " if ok else "💥 ") + message)
+    if not ok:
+        failures.append(message)
+
+
+async def check_bursts(per_producer, producers):
+    queue = EventQueue(capacity=8, coalesce=POSES)
+    put_order = [0]  # Global sequence, stamped when a put is accepted
+    last_pose = [None]
+    activations = []
+    rejected = [0]
+    delivered = []
+    latencies = []
+    finished = [0]
+
+    async def producer(name):
+        for seq in range(per_producer):
+            kind = HTTP_COMMAND_ACTIVATE if random.random() < 0.3 else random.choice(POSES)
+            event = TargetEvent(kind, {"producer": name, "seq": seq})
+            while True:
+                try:
+                    event.data["order"] = put_order[0]
+                    event.data["put_us"] = time.ticks_us()
+                    queue.put_nowait(event)
+                    break
+                except QueueFull:
+                    # What the server does is answer ERROR - the master retries
+                    rejected[0] += 1
+                    await uasyncio.sleep_ms(1)
+            put_order[0] += 1
+            if kind == HTTP_COMMAND_ACTIVATE:
+                activations.append(event)
+            else:
+                last_pose[0] = event
+            if random.random() < 0.15:
+                # End of a burst - back to the network for a while
+                await uasyncio.sleep_ms(random.randint(0, 3))
+        finished[0] += 1
+
+    async def consumer():
+        while finished[0] < producers or len(queue):
+            try:
+                event = await uasyncio.wait_for_ms(queue.get(), 500)
+            except uasyncio.TimeoutError:
+                continue
+            latencies.append(time.ticks_diff(time.ticks_us(), event.data["put_us"]))
+            delivered.append(event)
+            if random.random() < 0.05:
+                await uasyncio.sleep_ms(random.randint(1, 4))  # An activation or a move
+            else:
+                await uasyncio.sleep_ms(0)
+
+    start = time.ticks_us()
+    tasks = [uasyncio.create_task(producer(p)) for p in range(producers)]
+    await consumer()
+    for task in tasks:
+        await task
+    elapsed_us = time.ticks_diff(time.ticks_us(), start)
+
+    orders = [event.data["order"] for event in delivered]
+    check(all(a < b for a, b in zip(orders, orders[1:])),
+          f"order: {len(delivered)} events came out in put order")
+    delivered_ids = [id(event) for event in delivered if event.type == HTTP_COMMAND_ACTIVATE]
+    check(sorted(delivered_ids) == sorted(id(event) for event in activations),
+          f"once: all {len(activations)} activations delivered exactly once")
+    dropped = put_order[0] - len(delivered)
+    check(dropped == queue.coalesced and last_pose[0] in delivered,
+          f"coalesce: {queue.coalesced} superseded up/down dropped, the newest pose carried out")
+    latencies.sort()
+    p99 = latencies[len(latencies) * 99 // 100] if latencies else 0
+    print(f"   {producers} producers, {rejected[0]} puts bounced off a full queue, "
+          f"{put_order[0] * 1000000 // max(1, elapsed_us)} events/s end to end, put->get p99 {p99}us")
+
+
+async def check_wakeups(count=500):
+    queue = EventQueue(capacity=4)
+    woken = [0]
+
+    async def consumer():
+        while woken[0] < count:
+            await queue.get()
+            woken[0] += 1
+
+    task = uasyncio.create_task(consumer())
+    for _ in range(count):
+        await uasyncio.sleep_ms(0)  # Consumer back to waiting on an empty queue
+        queue.put_nowait(TargetEvent(HTTP_COMMAND_ACTIVATE))
+    try:
+        await uasyncio.wait_for_ms(task, 1000)
+    except uasyncio.TimeoutError:
+        pass
+    check(woken[0] == count, f"wakeups: {woken[0]}/{count} single puts woke a waiting consumer")
+
+
+def check_full():
+    queue = EventQueue(capacity=4, coalesce=POSES)
+    for _ in range(3):
+        queue.put_nowait(TargetEvent(HTTP_COMMAND_ACTIVATE))
+    queue.put_nowait(TargetEvent(HTTP_COMMAND_UP))
+    down = TargetEvent(HTTP_COMMAND_DOWN)
+    queue.put_nowait(down)  # Coalesces - needs no room
+    try:
+        queue.put_nowait(TargetEvent(HTTP_COMMAND_ACTIVATE))
+        raised = False
+    except QueueFull:
+        raised = True
+    queue.get_nowait()
+    queue.put_nowait(TargetEvent(HTTP_COMMAND_ACTIVATE))
+    drained = [queue.get_nowait() for _ in range(4)]
+    check(raised and len(queue) == 0 and drained[2] is down,
+          "full: QueueFull when full, up/down still coalesce, room again after a get")
+
+
+def check_priority():
+    queue = EventQueue(capacity=8)
+    normal = [TargetEvent(HTTP_COMMAND_ACTIVATE, {"n": i}) for i in range(5)]
+    urgent = [TargetEvent(HTTP_COMMAND_DOWN, {"n": i}) for i in range(3)]
+    for i in range(5):
+        queue.put_nowait(normal[i])
+        if i < 3:
+            queue.put_nowait(urgent[i], PRIORITY_URGENT)
+    drained = []
+    event = queue.get_nowait()
+    while event is not None:
+        drained.append(event)
+        event = queue.get_nowait()
+    check(drained == urgent + normal, "priority: urgent first, FIFO within each level")
+
+
+def bench_cost(rounds=20000):
+    queue = EventQueue(capacity=16)
+    event = TargetEvent(HTTP_COMMAND_ACTIVATE)
+    for _ in range(8):
+        queue.put_nowait(event)  # Steady backlog, so the ring wraps
+    start = time.ticks_us()
+    for _ in range(rounds):
+        queue.put_nowait(event)
+        queue.get_nowait()
+    per_event = time.ticks_diff(time.ticks_us(), start) / rounds
+    print(f"\ncost: {per_event:.2f}us per put + get on this machine, whatever the backlog")
+
+
+def main():
+    per_producer = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    producers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    random.seed(7)
+    uasyncio.run(check_bursts(per_producer, producers))
+    uasyncio.run(check_wakeups())
+    check_full()
+    check_priority()
+    bench_cost()
+    if failures:
+        print(f"💥 {len(failures)} check(s) failed")
+        sys.exit(1)
+    print("🎉 Event queue checks passed")
+
+
+main()